@@ -2,7 +2,7 @@
 
 
 a = Analysis(
-    ['pigeon/__main__.py', 'pigeon/comms/__init__.py', 'pigeon/comms/services/__init__.py', 'pigeon/comms/services/command.py', 'pigeon/comms/services/common.py', 'pigeon/comms/services/imagesservice.py', 'pigeon/comms/uav.py', 'pigeon/features.py', 'pigeon/geo.py', 'pigeon/image.py', 'pigeon/log.py', 'pigeon/misc/__init__.py', 'pigeon/misc/qr.py', 'pigeon/settings.py', 'pigeon/ui/__init__.py', 'pigeon/ui/areas/__init__.py', 'pigeon/ui/areas/commandsarea.py', 'pigeon/ui/areas/controlsarea.py', 'pigeon/ui/areas/messagelogarea.py', 'pigeon/ui/areas/featuredetailarea.py', 'pigeon/ui/areas/infoarea.py', 'pigeon/ui/areas/imagemaparea.py', 'pigeon/ui/areas/ruler.py', 'pigeon/ui/areas/settingsarea.py', 'pigeon/ui/areas/thumbnailarea.py', 'pigeon/ui/common.py', 'pigeon/ui/commonwidgets.py', 'pigeon/ui/dialogues/__init__.py', 'pigeon/ui/dialogues/qr.py', 'pigeon/ui/icons.py', 'pigeon/ui/pixmaploader.py', 'pigeon/ui/style.py', 'pigeon/ui/ui.py'],
+    ['pigeon/__main__.py', 'pigeon/catalog.py', 'pigeon/comms/__init__.py', 'pigeon/comms/services/__init__.py', 'pigeon/comms/services/command.py', 'pigeon/comms/services/common.py', 'pigeon/comms/services/imagesservice.py', 'pigeon/comms/services/trackservice.py', 'pigeon/comms/uav.py', 'pigeon/coverage.py', 'pigeon/dem.py', 'pigeon/features.py', 'pigeon/footprints.py', 'pigeon/geo.py', 'pigeon/image.py', 'pigeon/landmarks.py', 'pigeon/log.py', 'pigeon/manifest.py', 'pigeon/misc/__init__.py', 'pigeon/mosaic.py', 'pigeon/misc/qr.py', 'pigeon/searcharea.py', 'pigeon/settings.py', 'pigeon/track.py', 'pigeon/ui/__init__.py', 'pigeon/ui/areas/__init__.py', 'pigeon/ui/areas/commandsarea.py', 'pigeon/ui/areas/controlsarea.py', 'pigeon/ui/areas/messagelogarea.py', 'pigeon/ui/areas/featuredetailarea.py', 'pigeon/ui/areas/infoarea.py', 'pigeon/ui/areas/imagemaparea.py', 'pigeon/ui/areas/imageview.py', 'pigeon/ui/areas/mapview.py', 'pigeon/ui/areas/ruler.py', 'pigeon/ui/areas/settingsarea.py', 'pigeon/ui/areas/thumbnailarea.py', 'pigeon/ui/common.py', 'pigeon/ui/commonwidgets.py', 'pigeon/ui/dialogues/__init__.py', 'pigeon/ui/dialogues/qr.py', 'pigeon/ui/icons.py', 'pigeon/ui/pixmaploader.py', 'pigeon/ui/prefetch.py', 'pigeon/ui/style.py', 'pigeon/ui/thumbnailcache.py', 'pigeon/ui/ui.py', 'pigeon/utm.py'],
     pathex=[],
     binaries=[],
     datas=[('data/icons/', 'data/icons'), ('data/ground_control_points.json', 'data/')],
@@ -1,6 +1,7 @@
 import os
 import logging
 import argparse
+import multiprocessing
 import queue
 
 from pigeon import log, settings
@@ -20,7 +21,8 @@ class GroundStation:
         self.statustext_queue = queue.Queue()
 
         self.loadSettings()
-        self.image_watcher = Watcher()
+        self.image_watcher = Watcher(self.im_queue,
+                                     self.settings_data.get("Image Directory"))
         device = self.settings_data.get("UAV Device")
         self.uav = UAV(device, self.im_queue, self.msg_queue,
                        self.statustext_queue)
@@ -56,8 +58,9 @@ Copyright (c) 2023 UAARG
         settings.save(settings_data)
 
     def run(self):
-        if self.settings_data["Load Existing Images"]:
-            pass
+        image_directory = self.settings_data.get("Image Directory")
+        if self.settings_data["Load Existing Images"] and image_directory:
+            self.image_watcher.loadExistingImages(image_directory)
         self.uav.try_connect()
         self.image_watcher.start()
 
@@ -110,4 +113,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # For the process pool of the bulk image import, in the bundled app
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,199 @@
+"""
+Index of every image of the session, so that images don't all need to
+be kept in memory to be found.
+"""
+
+import logging
+import sqlite3
+
+from pigeon import geo
+from pigeon.image import Image, find_images_containing
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCatalog:
+    """
+    SQLite catalog of the images of the session: their paths, capture
+    time and pose, with the bounds of their footprints in an R*Tree.
+    Queries (ex. "images in this box taken after 14:00") run on the
+    indexes and return ids, and Image objects are only made (hydrated
+    from the catalog, without reading their info files) when they're
+    asked for with get(). Images are only held weakly (through
+    image.images), so the ones nothing uses anymore are freed: the UI
+    keeps ids (ex. ListImageItem, FootprintIndex) and gets the images
+    from here.
+
+    The database is in memory by default: the catalog is for a session.
+
+    Not thread safe: use from a single thread (the UI thread).
+    """
+
+    def __init__(self, path=":memory:"):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                rowid INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                path TEXT,
+                info_path TEXT,
+                time REAL,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                height REAL,
+                alt REAL,
+                pitch REAL NOT NULL,
+                roll REAL NOT NULL,
+                yaw REAL NOT NULL,
+                width INTEGER,
+                pixel_height INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS images_time ON images (time);
+            CREATE VIRTUAL TABLE IF NOT EXISTS footprints USING rtree (
+                rowid, min_lat, max_lat, min_lon, max_lon
+            );
+            """)
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def __contains__(self, id_):
+        return self.connection.execute("SELECT 1 FROM images WHERE id = ?",
+                                       (id_, )).fetchone() is not None
+
+    def add(self, image, outline=None):
+        """
+        Adds the provided image to the catalog (replacing what was
+        recorded for an image with the same id). Its footprint is only
+        indexed if it can be determined, which needs the image's size.
+        The image's outline can be provided if it's already known (see
+        Image.getImageOutline()).
+        """
+        position = image.plane_position
+        orientation = image.plane_orientation
+        # Not set on images from older versions
+        time = getattr(image, "time", None)
+        with self.connection:
+            self._remove(image.id)
+            rowid = self.connection.execute(
+                "INSERT INTO images VALUES "
+                "(NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (image.id, image.path, image.info_path, time, position.lat,
+                 position.lon, position.height, position.alt,
+                 orientation.pitch, orientation.roll, orientation.yaw,
+                 image.width, image.height)).lastrowid
+            bounds = self._footprintBounds(image, outline)
+            if bounds:
+                self.connection.execute(
+                    "INSERT INTO footprints VALUES (?, ?, ?, ?, ?)",
+                    (rowid, *bounds))
+
+    def remove(self, id_):
+        """
+        Removes the image with the provided id from the catalog.
+        """
+        with self.connection:
+            self._remove(id_)
+
+    def get(self, id_):
+        """
+        Returns the Image with the provided id: the one in memory if
+        there is one, otherwise a new one made from the catalog. Returns
+        None if the image isn't in the catalog.
+        """
+        # Image.images is keyed by filename rather than id: fromRecord()
+        # finds the image in memory from its path
+        row = self.connection.execute(
+            "SELECT path, info_path, time, lat, lon, height, alt, pitch, "
+            "roll, yaw, width, pixel_height FROM images WHERE id = ?",
+            (id_, )).fetchone()
+        if row is None:
+            return None
+        (path, info_path, time, lat, lon, height, alt, pitch, roll, yaw, width,
+         pixel_height) = row
+        return Image.fromRecord(path, info_path,
+                                geo.Position(lat, lon, height, alt),
+                                geo.Orientation(pitch, roll, yaw), time, width,
+                                pixel_height)
+
+    def find(self,
+             north=None,
+             south=None,
+             east=None,
+             west=None,
+             after=None,
+             before=None):
+        """
+        Returns the ids (in order of capture time) of the images whose
+        footprints intersect the provided box (in degrees) and that
+        were taken in the provided time range (seconds since the
+        epoch). Any of the limits can be left out. Only images with a
+        footprint are found when limiting by the box.
+        """
+        conditions = []
+        parameters = []
+        for condition, value in [("footprints.min_lat <= ?", north),
+                                 ("footprints.max_lat >= ?", south),
+                                 ("footprints.min_lon <= ?", east),
+                                 ("footprints.max_lon >= ?", west),
+                                 ("images.time >= ?", after),
+                                 ("images.time <= ?", before)]:
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        query = "SELECT images.id FROM images"
+        if any(value is not None for value in (north, south, east, west)):
+            query += " JOIN footprints ON footprints.rowid = images.rowid"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY images.time, images.rowid"
+        return [id_ for id_, in self.connection.execute(query, parameters)]
+
+    def findImages(self, **limits):
+        """
+        Like find(), but returns the Images.
+        """
+        return [self.get(id_) for id_ in self.find(**limits)]
+
+    def imagesContaining(self, position):
+        """
+        Returns a list of (image, pixel_x, pixel_y) tuples for every
+        image in the catalog that depicts the provided position. Only
+        the images whose footprint bounds contain it are hydrated and
+        checked.
+        """
+        return find_images_containing(
+            position,
+            self.findImages(north=position.lat,
+                            south=position.lat,
+                            east=position.lon,
+                            west=position.lon))
+
+    def _remove(self, id_):
+        row = self.connection.execute("SELECT rowid FROM images WHERE id = ?",
+                                      (id_, )).fetchone()
+        if row:
+            self.connection.execute("DELETE FROM footprints WHERE rowid = ?",
+                                    row)
+            self.connection.execute("DELETE FROM images WHERE rowid = ?", row)
+
+    def _footprintBounds(self, image, outline=None):
+        """
+        Returns the (min_lat, max_lat, min_lon, max_lon) of the
+        footprint of the image, or None if it can't be determined (ex.
+        part of the image shows the sky).
+        """
+        try:
+            outline = outline or image.getImageOutline()
+        except Exception as e:
+            logger.debug("Can't index footprint of %s: %s" % (image, e))
+            return None
+        if None in outline.positions:
+            return None
+        lats = [position.lat for position in outline.positions]
+        lons = [position.lon for position in outline.positions]
+        return (min(lats), max(lats), min(lons), max(lons))
+
+
+image_catalog = ImageCatalog()  # Every image received in this session
@@ -0,0 +1,27 @@
+from pigeon.comms.services.common import MavlinkService
+from pigeon.track import FlightTrack
+
+
+class FlightTrackService(MavlinkService):
+    """
+    Flight Track Service
+    ====================
+
+    Records the position of the plane from GLOBAL_POSITION_INT messages
+    [0] into a FlightTrack, ex. for drawing its path on the map.
+    Altitudes are relative to home.
+
+    [0]: https://mavlink.io/en/messages/common.html#GLOBAL_POSITION_INT
+    """
+    track: FlightTrack
+
+    def __init__(self, track: FlightTrack):
+        self.track = track
+
+    def recv_message(self, message):
+        if message.get_type() != "GLOBAL_POSITION_INT":
+            return
+        if message.lat == 0 and message.lon == 0:
+            return  # No GPS fix yet
+        self.track.append(message.lat / 1e7, message.lon / 1e7,
+                          message.relative_alt / 1000)
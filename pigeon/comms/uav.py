@@ -10,7 +10,9 @@ import queue
 
 from .services.imagesservice import ImageService
 from .services.messageservice import MessageCollectorService
+from .services.trackservice import FlightTrackService
 from .services.common import HeartbeatService, StatusEchoService, DebugService, ForwardingService
+from pigeon.track import flight_track
 
 logger = logging.getLogger(__name__)
 
@@ -209,6 +211,7 @@ class UAV:
             ImageService(self.commands, self.im_queue),
             StatusEchoService(self._recvStatus),
             MessageCollectorService(self.msg_queue),
+            FlightTrackService(flight_track),
             DebugService(),
             ForwardingService(self.commands),
         ]
@@ -0,0 +1,278 @@
+"""
+Keeps track of the area of the ground that has been photographed.
+"""
+
+import logging
+from math import floor
+
+import shapely
+from shapely.geometry import Polygon
+
+from pigeon import geo
+
+logger = logging.getLogger(__name__)
+
+
+class _Cell:
+    """
+    The parts of footprints that fall in one square of the grid, and
+    their union.
+    """
+
+    def __init__(self):
+        self.pieces = {}  # Image id -> polygon clipped to the cell
+        self.union = None  # Union of the pieces, once merged
+        self.union_area = 0
+        self.new_pieces = []  # Pieces added since the last merge
+        self.rebuild = False  # Whether a piece was removed since the last merge
+
+
+class CoverageMap:
+    """
+    Running union of the footprints of images (the area of the ground
+    they show).
+
+    Re-doing the union of every footprint whenever an image arrives
+    gets slower as a mission goes on. Instead the ground is divided
+    into a grid of square cells and each footprint is clipped into the
+    cells that it overlaps, which each keep the union of just their own
+    pieces. Adding an image only touches the handful of cells under it,
+    and unions are merged lazily the next time they're needed, so a
+    burst of images costs one merge per cell.
+
+    Areas are in square metres and geometry is in a LocalFrame (metres
+    east and north) anchored at the first footprint added.
+
+    Not thread safe: use from a single thread (the UI thread).
+    """
+
+    def __init__(self, cell_size=250):
+        self.cell_size = cell_size
+        self.frame = None
+        self._cells = {}  # (column, row) -> _Cell
+        self._dirty = set()  # Keys of cells with unmerged changes
+        self._footprints = {}  # Image id -> (polygon, list of cell keys)
+        self._covered_area = 0  # Sum of the merged cells' union areas
+        self._footprint_area = 0  # Sum of the areas of all footprints
+        self.version = 0  # Incremented on every change, ex. to know when to redraw
+
+    def __len__(self):
+        return len(self._footprints)
+
+    def __contains__(self, image):
+        return image.id in self._footprints
+
+    def insert(self, image, outline=None):
+        """
+        Adds (or updates) the footprint of the provided image. Returns
+        False if the image's footprint couldn't be determined (ex. part
+        of the image shows the sky). The image's outline can be
+        provided if it's already known (see Image.getImageOutline()).
+        """
+        try:
+            outline = outline or image.getImageOutline()
+        except Exception as e:
+            logger.debug("Can't add footprint of %s to coverage: %s" %
+                         (image, e))
+            return False
+        if None in outline.positions:
+            logger.debug(
+                "Can't add footprint of %s to coverage: not all on the ground"
+                % image)
+            return False
+        return self.insertPolygon(
+            image.id, [position.latLon() for position in outline.positions])
+
+    def insertPolygon(self, key, lat_lons):
+        """
+        Adds (or updates) a footprint described by a list of (lat, lon)
+        tuples, identified by key. Returns False if it isn't a valid
+        polygon.
+        """
+        self.removePolygon(key)
+        if not self.frame:
+            lat, lon = lat_lons[0]
+            self.frame = geo.LocalFrame(lat, lon)
+        polygon = self.toLocal(lat_lons)
+        if not polygon.is_valid or polygon.is_empty:
+            return False
+
+        cell_keys = []
+        for cell_key in self._cellKeys(polygon.bounds):
+            piece = shapely.clip_by_rect(polygon, *self._cellBounds(cell_key))
+            if piece.is_empty:
+                continue
+            cell = self._cells.get(cell_key)
+            if cell is None:
+                cell = self._cells[cell_key] = _Cell()
+            cell.pieces[key] = piece
+            cell.new_pieces.append(piece)
+            self._dirty.add(cell_key)
+            cell_keys.append(cell_key)
+
+        self._footprints[key] = (polygon, cell_keys)
+        self._footprint_area += polygon.area
+        self.version += 1
+        return True
+
+    def remove(self, image):
+        """
+        Removes the footprint of the provided image, if present.
+        """
+        self.removePolygon(image.id)
+
+    def removePolygon(self, key):
+        """
+        Removes the footprint identified by key, if present. The cells
+        it was in are re-merged from their remaining pieces.
+        """
+        entry = self._footprints.pop(key, None)
+        if entry is None:
+            return
+        polygon, cell_keys = entry
+        self._footprint_area -= polygon.area
+        self.version += 1
+        for cell_key in cell_keys:
+            cell = self._cells[cell_key]
+            del cell.pieces[key]
+            cell.rebuild = True
+            self._dirty.add(cell_key)
+
+    def coveredArea(self):
+        """
+        Returns the area of the ground covered by at least one image.
+        """
+        self._merge()
+        return self._covered_area
+
+    def footprintArea(self):
+        """
+        Returns the sum of the areas of all the footprints (counting
+        overlapping areas multiple times).
+        """
+        return self._footprint_area
+
+    def overlapRatio(self):
+        """
+        Returns the fraction of the photographed area that's been
+        photographed more than once, counting each repeat: 0 without
+        overlap, 0.5 if everything was photographed twice, etc.
+        """
+        if self._footprint_area <= 0:
+            return 0
+        return 1 - self.coveredArea() / self._footprint_area
+
+    def geometries(self):
+        """
+        Returns a list of the covered areas of each cell (shapely
+        geometries in the local frame), ex. for drawing.
+        """
+        self._merge()
+        return [
+            cell.union for cell in self._cells.values()
+            if cell.union is not None and not cell.union.is_empty
+        ]
+
+    def coveredGeometry(self, bounds=None):
+        """
+        Returns the covered area as one shapely geometry in the local
+        frame. If bounds (min_x, min_y, max_x, max_y) is provided, only
+        the cells overlapping it are included.
+        """
+        self._merge()
+        if bounds is None:
+            cells = self._cells.values()
+        else:
+            cells = [
+                self._cells[key] for key in self._cellKeys(bounds)
+                if key in self._cells
+            ]
+        return shapely.union_all(
+            [cell.union for cell in cells if cell.union is not None])
+
+    def gaps(self, search_area, count=5, min_area=0):
+        """
+        Returns the largest areas inside the search area that haven't
+        been photographed, as a list of (area, PositionCollection)
+        tuples sorted from largest to smallest.
+
+        search_area - list of Positions outlining the area
+        count - maximum number of gaps to return
+        min_area - ignoring gaps smaller than this (square metres)
+        """
+        if not self.frame:
+            lat, lon = search_area[0].latLon()
+            self.frame = geo.LocalFrame(lat, lon)
+        polygon = self.toLocal([position.latLon() for position in search_area])
+        uncovered = polygon.difference(self.coveredGeometry(polygon.bounds))
+
+        gaps = [
+            gap for gap in getattr(uncovered, "geoms", [uncovered]) if
+            isinstance(gap, Polygon) and gap.area > 0 and gap.area >= min_area
+        ]
+        gaps.sort(key=lambda gap: gap.area, reverse=True)
+        return [(gap.area, self.toPositions(gap)) for gap in gaps[:count]]
+
+    def toLocal(self, lat_lons):
+        """
+        Converts a list of (lat, lon) tuples into a shapely Polygon in
+        the local frame.
+        """
+        return Polygon(
+            [self.frame.fromLatLon(lat, lon) for lat, lon in lat_lons])
+
+    def toPositions(self, polygon):
+        """
+        Converts a shapely Polygon in the local frame into a
+        PositionCollection (including any holes).
+        """
+
+        def to_positions(ring):
+            return [
+                geo.Position(*self.frame.toLatLon(east, north))
+                for east, north in ring.coords[:-1]
+            ]
+
+        return geo.PositionCollection(
+            to_positions(polygon.exterior),
+            [to_positions(interior) for interior in polygon.interiors])
+
+    def _cellKeys(self, bounds):
+        min_x, min_y, max_x, max_y = bounds
+        size = self.cell_size
+        return [(column, row) for column in range(floor(min_x / size),
+                                                  floor(max_x / size) + 1)
+                for row in range(floor(min_y / size),
+                                 floor(max_y / size) + 1)]
+
+    def _cellBounds(self, cell_key):
+        column, row = cell_key
+        size = self.cell_size
+        return (column * size, row * size, (column + 1) * size,
+                (row + 1) * size)
+
+    def _merge(self):
+        """
+        Brings the unions of the cells that changed up to date.
+        """
+        for cell_key in self._dirty:
+            cell = self._cells[cell_key]
+            if cell.rebuild:
+                pieces = list(cell.pieces.values())
+            else:
+                pieces = cell.new_pieces
+                if cell.union is not None:
+                    pieces.append(cell.union)
+            cell.union = shapely.union_all(pieces) if pieces else None
+            cell.new_pieces = []
+            cell.rebuild = False
+
+            self._covered_area -= cell.union_area
+            cell.union_area = cell.union.area if cell.union is not None else 0
+            self._covered_area += cell.union_area
+            if not cell.pieces:
+                del self._cells[cell_key]
+        self._dirty.clear()
+
+
+coverage_map = CoverageMap()  # Coverage of all images shown in the UI
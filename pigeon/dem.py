@@ -0,0 +1,296 @@
+"""
+Terrain elevations from a local Digital Elevation Model (DEM), for
+geo-referencing over ground that isn't flat.
+
+Supports two kinds of tiles, both in WGS84 latitude/longitude:
+    - SRTM .hgt files (named after their south west corner, ex. N53W114.hgt)
+    - Uncompressed GeoTIFFs (ex. as exported by most GIS software with
+      compression turned off)
+
+Tiles are memory mapped rather than read, so only the parts of a tile
+that are actually sampled get loaded from disk. A limited number of
+tiles are kept open, evicting the least recently used.
+"""
+
+import collections
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+supported_tile_formats = ["hgt", "tif", "tiff"]
+
+hgt_void = -32768  # Value used by SRTM for missing data
+
+# TIFF tag numbers used to locate the raster:
+_TIFF_TAGS = {
+    "width": 256,
+    "height": 257,
+    "bits_per_sample": 258,
+    "compression": 259,
+    "strip_offsets": 273,
+    "samples_per_pixel": 277,
+    "strip_byte_counts": 279,
+    "sample_format": 339,
+    "model_pixel_scale": 33550,
+    "model_tiepoint": 33922,
+    "nodata": 42113,
+}
+
+
+class Tile:
+    """
+    A rectangular grid of elevations (in metres) covering an area of
+    latitude and longitude. Row 0 is the northern edge and column 0 the
+    western edge. Values are sampled at the grid points (pixel
+    centres for GeoTIFFs).
+    """
+
+    def __init__(self,
+                 path,
+                 elevations,
+                 north,
+                 west,
+                 lat_step,
+                 lon_step,
+                 nodata=None):
+        self.path = path
+        self.elevations = elevations  # Usually a numpy memmap
+        self.north = north
+        self.west = west
+        self.lat_step = lat_step
+        self.lon_step = lon_step
+        self.nodata = nodata
+
+        rows, columns = elevations.shape
+        self.south = north - (rows - 1) * lat_step
+        self.east = west + (columns - 1) * lon_step
+
+    def __repr__(self):
+        return "Tile(path=%r)" % self.path
+
+    def resolution(self):
+        """
+        Returns the approximate spacing of the samples in metres.
+        """
+        metres_per_degree = 111320  # Close enough for choosing step sizes
+        return metres_per_degree * min(
+            self.lat_step,
+            self.lon_step * np.cos(np.radians((self.north + self.south) / 2)))
+
+    def elevation(self, lat, lon):
+        """
+        Bilinearly interpolates the elevations at the provided arrays of
+        points (which should be inside the tile). Returns NaN where
+        there's no data.
+        """
+        rows, columns = self.elevations.shape
+        fy = (self.north - lat) / self.lat_step
+        fx = (lon - self.west) / self.lon_step
+        iy = np.clip(np.floor(fy).astype(int), 0, rows - 2)
+        ix = np.clip(np.floor(fx).astype(int), 0, columns - 2)
+        ty = fy - iy
+        tx = fx - ix
+
+        # Fancy indexing a memmap only reads the pages that are needed
+        corners = [
+            self.elevations[iy + dy, ix + dx].astype(np.float64)
+            for dy, dx in ((0, 0), (0, 1), (1, 0), (1, 1))
+        ]
+        if self.nodata is not None:
+            for corner in corners:
+                corner[corner == self.nodata] = np.nan
+        top = corners[0] * (1 - tx) + corners[1] * tx
+        bottom = corners[2] * (1 - tx) + corners[3] * tx
+        return top * (1 - ty) + bottom * ty
+
+
+def open_hgt(path):
+    """
+    Opens an SRTM .hgt tile as a memory mapped Tile. The position of the
+    tile comes from its filename.
+    """
+    name = os.path.basename(path)
+    match = re.match(r"([NS])(\d{2})([EW])(\d{3})", name, re.IGNORECASE)
+    if not match:
+        raise ValueError("Can't tell the location of %s from its name." % path)
+    lat_sign = 1 if match.group(1).upper() == "N" else -1
+    lon_sign = 1 if match.group(3).upper() == "E" else -1
+    south = lat_sign * int(match.group(2))
+    west = lon_sign * int(match.group(4))
+
+    samples = int(round(np.sqrt(os.path.getsize(path) / 2)))
+    if samples * samples * 2 != os.path.getsize(path):
+        raise ValueError("%s isn't a square grid of 16 bit samples." % path)
+    elevations = np.memmap(path,
+                           dtype=">i2",
+                           mode="r",
+                           shape=(samples, samples))
+    step = 1 / (samples - 1)
+    return Tile(path, elevations, south + 1, west, step, step, hgt_void)
+
+
+def open_geotiff(path):
+    """
+    Opens an uncompressed, single band GeoTIFF in WGS84 lat/lon as a
+    memory mapped Tile. The raster must be stored in one contiguous run
+    of strips (the default when writing uncompressed GeoTIFFs).
+    """
+    from PIL import Image as PILImage  # Only needed for GeoTIFFs
+
+    with PILImage.open(path) as image:
+        tags = {
+            name: image.tag_v2.get(number)
+            for name, number in _TIFF_TAGS.items()
+        }
+        byte_order = ">" if image.tag_v2.prefix == b"MM" else "<"
+
+    if (tags["compression"] or 1) != 1:
+        raise ValueError("%s is compressed: can't memory map it." % path)
+    if (tags["samples_per_pixel"] or 1) != 1:
+        raise ValueError("%s has more than one band." % path)
+    if not tags["model_pixel_scale"] or not tags["model_tiepoint"]:
+        raise ValueError("%s is missing its georeferencing tags." % path)
+
+    offsets = _as_tuple(tags["strip_offsets"])
+    byte_counts = _as_tuple(tags["strip_byte_counts"])
+    for offset, count, next_offset in zip(offsets, byte_counts, offsets[1:]):
+        if offset + count != next_offset:
+            raise ValueError("%s isn't stored contiguously." % path)
+
+    bits = _as_tuple(tags["bits_per_sample"])[0]
+    kind = {1: "u", 2: "i", 3: "f"}[tags["sample_format"] or 1]
+    dtype = np.dtype("%s%s%d" % (byte_order, kind, bits // 8))
+    shape = (tags["height"], tags["width"])
+    elevations = np.memmap(path,
+                           dtype=dtype,
+                           mode="r",
+                           offset=offsets[0],
+                           shape=shape)
+
+    scale_x, scale_y = tags["model_pixel_scale"][:2]
+    _, _, _, tie_x, tie_y, _ = tags["model_tiepoint"][:6]
+    # The tiepoint is the outside corner of the top left pixel: sampling at pixel centres
+    north = tie_y - scale_y / 2
+    west = tie_x + scale_x / 2
+    nodata = float(tags["nodata"]) if tags["nodata"] else None
+    return Tile(path, elevations, north, west, scale_y, scale_x, nodata)
+
+
+def _as_tuple(value):
+    return tuple(value) if isinstance(value, (tuple, list)) else (value, )
+
+
+def open_tile(path):
+    """
+    Opens the tile at path according to its extension.
+    """
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension == "hgt":
+        return open_hgt(path)
+    elif extension in ("tif", "tiff"):
+        return open_geotiff(path)
+    raise ValueError("Unsupported DEM tile format: %s" % path)
+
+
+class DEM:
+    """
+    Provides elevations from the tiles in a directory. The directory is
+    scanned once for the area covered by each tile; tiles are then
+    opened as needed, keeping at most max_open_tiles open.
+    """
+
+    def __init__(self, directory, max_open_tiles=16):
+        self.directory = directory
+        self.max_open_tiles = max_open_tiles
+        # Path -> Tile, least recently used first
+        self._open_tiles = collections.OrderedDict()
+        # Images are prepared outside of the UI thread too
+        self._lock = threading.Lock()
+
+        self.tile_bounds = []  # List of (path, north, south, east, west)
+        resolutions = []
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            extension = os.path.splitext(entry.name)[1].lower().lstrip(".")
+            if not entry.is_file() or extension not in supported_tile_formats:
+                continue
+            try:
+                tile = self._openTile(entry.path)
+            except (ValueError, OSError) as e:
+                logger.warning("Skipping DEM tile %s: %s" % (entry.path, e))
+                continue
+            self.tile_bounds.append(
+                (entry.path, tile.north, tile.south, tile.east, tile.west))
+            resolutions.append(tile.resolution())
+        logger.info("Found %s DEM tiles in %s" %
+                    (len(self.tile_bounds), directory))
+
+        # Approximate spacing of the samples in metres (SRTM's 30 m if there aren't any tiles)
+        self.resolution = min(resolutions, default=30)
+
+    def __reduce__(self):
+        """
+        Called during pickling. The tiles can't be sent to another
+        process: looking up the DEM by directory there instead.
+        """
+        return (get_dem, (self.directory, ))
+
+    def elevation(self, lat, lon):
+        """
+        Returns the terrain elevation (in metres above sea level) at the
+        provided latitudes and longitudes (scalars or arrays). NaN where
+        no tile covers the point.
+        """
+        lat, lon = np.broadcast_arrays(np.asarray(lat, dtype=np.float64),
+                                       np.asarray(lon, dtype=np.float64))
+        result = np.full(lat.shape, np.nan)
+        remaining = np.isfinite(lat) & np.isfinite(lon)
+        if not remaining.any():
+            return result
+        lat_min, lat_max = lat[remaining].min(), lat[remaining].max()
+        lon_min, lon_max = lon[remaining].min(), lon[remaining].max()
+
+        for path, north, south, east, west in self.tile_bounds:
+            if south > lat_max or north < lat_min or west > lon_max or east < lon_min:
+                continue
+            inside = remaining & (lat >= south) & (lat <= north) & (
+                lon >= west) & (lon <= east)
+            if inside.any():
+                with self._lock:
+                    tile = self._openTile(path)
+                    result[inside] = tile.elevation(lat[inside], lon[inside])
+                remaining &= ~inside
+                if not remaining.any():
+                    break
+        return result
+
+    def _openTile(self, path):
+        tile = self._open_tiles.get(path)
+        if tile is None:
+            tile = open_tile(path)
+            self._open_tiles[path] = tile
+            while len(self._open_tiles) > self.max_open_tiles:
+                # Closing the memmap frees it
+                self._open_tiles.popitem(last=False)
+        else:
+            self._open_tiles.move_to_end(path)
+        return tile
+
+
+_dems = {}  # DEM by directory so that images share them
+
+
+def get_dem(directory):
+    """
+    Returns the (shared) DEM for the provided directory, or None if no
+    directory is provided or it doesn't exist.
+    """
+    if not directory or not os.path.isdir(directory):
+        return None
+    if directory not in _dems:
+        _dems[directory] = DEM(directory)
+    return _dems[directory]
@@ -0,0 +1,169 @@
+"""
+Spatial index over the areas of the ground covered by images, for
+quickly answering "which images see this point/area" queries.
+"""
+
+import logging
+
+from shapely import STRtree
+from shapely.geometry import Point, Polygon, box
+
+from pigeon import geo
+from pigeon.catalog import image_catalog
+
+logger = logging.getLogger(__name__)
+
+
+class FootprintIndex:
+    """
+    Incrementally maintained index of image footprints.
+
+    Footprints are stored as polygons in a LocalFrame (metres east and
+    north) anchored at the first footprint added. shapely's STRtree
+    can't be added to, so this uses the logarithmic method: footprints
+    go into a small unindexed buffer, and full buffers are merged into
+    a list of trees whose sizes are distinct powers of two (like the
+    digits of a binary counter). Each footprint is only rebuilt into a
+    tree O(log n) times, and a query searches O(log n) trees.
+
+    Only the ids of the images are kept: the images found by queries
+    are fetched from the image_catalog.
+
+    Not thread safe: use from a single thread (the UI thread).
+    """
+
+    buffer_size = 16
+
+    def __init__(self):
+        self.frame = None
+        self._images = {}  # Image id -> (polygon, key)
+        self._keys = {}  # Key -> image id. Every insert gets a new key.
+        self._next_key = 0
+        self._buffer = []  # Keys not in a tree yet
+        self._levels = []  # List of (keys, STRtree) tuples, largest first
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, image):
+        return image.id in self._images
+
+    def insert(self, image, outline=None):
+        """
+        Adds (or updates) the footprint of the provided image. Returns
+        False if the image's footprint couldn't be determined (ex. part
+        of the image shows the sky). The image's outline can be
+        provided if it's already known (see Image.getImageOutline()).
+        """
+        try:
+            outline = outline or image.getImageOutline()
+        except Exception as e:
+            logger.debug("Can't index footprint of %s: %s" % (image, e))
+            return False
+        if None in outline.positions:
+            logger.debug("Can't index footprint of %s: not all on the ground" %
+                         image)
+            return False
+
+        self.remove(image)
+
+        if not self.frame:
+            center = outline.center()
+            self.frame = geo.LocalFrame(center.lat, center.lon)
+        polygon = self._toLocal(
+            [position.latLon() for position in outline.positions])
+
+        key = self._next_key
+        self._next_key += 1
+        self._images[image.id] = (polygon, key)
+        self._keys[key] = image.id
+        self._buffer.append(key)
+        if len(self._buffer) >= self.buffer_size:
+            self._flushBuffer()
+        return True
+
+    def remove(self, image):
+        """
+        Removes the footprint of the provided image, if indexed. Its
+        stale entry in a tree is skipped by queries and dropped the
+        next time that tree is rebuilt.
+        """
+        entry = self._images.pop(image.id, None)
+        if entry is not None:
+            del self._keys[entry[1]]
+
+    def imagesAt(self, position):
+        """
+        Returns a list of the images whose footprint contains the
+        provided position.
+        """
+        return self.imagesIntersecting(Point(self._toLocalPoint(position)))
+
+    def imagesInBox(self, north, south, east, west):
+        """
+        Returns a list of the images whose footprint intersects the
+        box described by the provided latitudes and longitudes (the
+        same order as PositionCollection.boundingBox()).
+        """
+        corners = [(north, west), (north, east), (south, east), (south, west)]
+        return self.imagesIntersecting(self._toLocal(corners))
+
+    def imagesInPolygon(self, positions):
+        """
+        Returns a list of the images whose footprint intersects the
+        polygon described by the provided list of Positions.
+        """
+        return self.imagesIntersecting(
+            self._toLocal([position.latLon() for position in positions]))
+
+    def imagesIntersecting(self, geometry):
+        """
+        Returns a list of the images whose footprint intersects the
+        provided shapely geometry (in the index's local frame).
+        """
+        if not self.frame:
+            return []
+        keys = []
+        for level_keys, tree in self._levels:
+            keys.extend(
+                level_keys[index]
+                for index in tree.query(geometry, predicate="intersects"))
+        keys.extend(
+            key for key in self._buffer
+            if key in self._keys and self._polygon(key).intersects(geometry))
+        images = (image_catalog.get(self._keys[key]) for key in keys
+                  if key in self._keys)
+        return [image for image in images if image is not None]
+
+    def _polygon(self, key):
+        return self._images[self._keys[key]][0]
+
+    def _toLocalPoint(self, position):
+        if not self.frame:
+            return (0, 0)
+        return self.frame.fromLatLon(position.lat, position.lon)
+
+    def _toLocal(self, lat_lons):
+        if not self.frame:
+            return box(0, 0, 0, 0)
+        return Polygon(
+            [self.frame.fromLatLon(lat, lon) for lat, lon in lat_lons])
+
+    def _flushBuffer(self):
+        """
+        Merges the buffer into the trees, combining trees of the same
+        size like carrying digits when incrementing a binary counter.
+        """
+        keys = self._buffer
+        self._buffer = []
+        while self._levels and len(self._levels[-1][0]) <= len(keys):
+            level_keys, _ = self._levels.pop()
+            keys = level_keys + keys
+        keys = [key for key in keys
+                if key in self._keys]  # Dropping removed footprints
+        if keys:
+            tree = STRtree([self._polygon(key) for key in keys])
+            self._levels.append((keys, tree))
+
+
+footprint_index = FootprintIndex()  # Footprints of all images shown in the UI
@@ -6,21 +6,48 @@ Covers:
     - Calculating properties of a series of points (ex. length, area)
 """
 
-from math import radians, degrees, sqrt, tan, sin, cos, atan, atan2
+from math import radians, degrees, sqrt, tan, sin, cos, atan, atan2, isfinite, isnan, inf, pi
 from statistics import mean
 import copy
+import sys
 
+import numpy as np
 import pyproj
 from shapely.geometry import Polygon
 
+from pigeon import utm
+
 geod = pyproj.Geod(ellps="WGS84")  # WGS84 is the datum used by GPS
 
+_RADIANS_PER_DEGREE = pi / 180
+
+
+def _normalize_angle(angle, minimum=-180, maximum=180):
+    """
+    Returns the angle (in degrees) wrapped into the range minimum to
+    maximum (maximum - minimum should be 360). Raises a ValueError for
+    angles that are more than 10 turns out of range, which indicates
+    bad data.
+    """
+    if minimum <= angle < maximum:
+        return angle  # By far the most common case
+    if isnan(angle):
+        return angle
+    turns = (angle - minimum) // 360 if isfinite(angle) else inf
+    if abs(turns) > 10:
+        raise ValueError(
+            "Failed to normalize provided angle of {} : it's way out of range".
+            format(angle))
+    return angle - turns * 360
+
 
 class Position:
     """
     Position in 3D space of an object relative to the earth.
     Latitude and longitude are for the WGS84 datum.
     """
+    # Slots to keep the many Position objects (ex. from geo-referencing) small and quick to create
+    __slots__ = ("lat", "lon", "height", "alt")
 
     def __init__(self, lat, lon, height=0, alt=None):
         """
@@ -37,7 +64,7 @@ class Position:
     def __str__(self):
         output = "(%.6f, %.6f)" % (self.lat, self.lon)
 
-        if self.height != 0:
+        if self.height:  # Could be None
             output += " height=%.0f" % self.height
 
         if self.alt is not None:
@@ -116,6 +143,7 @@ class Orientation:
     """
     Orientation of an object with respect to the earth.
     """
+    __slots__ = ("pitch", "roll", "yaw", "pitch_rad", "roll_rad", "yaw_rad")
 
     def __init__(self, pitch, roll, yaw):
         """
@@ -127,32 +155,19 @@ class Orientation:
                 plane measured clockwise in degrees
         """
 
-        def normalize_angle(angle, mininum=-180, maximum=180):
-            original_angle = angle
-            i = 0
-            while angle >= maximum:
-                i += 1
-                angle -= 360
-                if i > 10:
-                    raise ValueError(
-                        "Failed to normalize provided angle of {} : it's way out of range"
-                        .format(original_angle))
-            while angle < mininum:
-                i += 1
-                angle += 360
-                if i > 10:
-                    raise ValueError(
-                        "Failed to normalize provided angle of {} : it's way out of range"
-                        .format(original_angle))
-            return angle
+        self.pitch = _normalize_angle(pitch)
+        self.roll = _normalize_angle(roll)
+        self.yaw = _normalize_angle(yaw, 0, 360)
+
+        self.pitch_rad = self.pitch * _RADIANS_PER_DEGREE
+        self.roll_rad = self.roll * _RADIANS_PER_DEGREE
+        self.yaw_rad = self.yaw * _RADIANS_PER_DEGREE
 
-        self.pitch = normalize_angle(pitch)
-        self.roll = normalize_angle(roll)
-        self.yaw = normalize_angle(yaw, 0, 360)
+    def __copy__(self):
+        return Orientation(self.pitch, self.roll, self.yaw)
 
-        self.pitch_rad = radians(self.pitch)
-        self.roll_rad = radians(self.roll)
-        self.yaw_rad = radians(self.yaw)
+    def copy(self):
+        return self.__copy__()
 
     def __str__(self):
         return "pitch: %s\N{DEGREE SIGN}, roll: %s\N{DEGREE SIGN}, yaw: %s\N{DEGREE SIGN}" % (
@@ -177,13 +192,77 @@ class Orientation:
         return "%s\N{DEGREE SIGN}" % int(self.yaw)
 
 
+# CameraSpecs by key, so that identical cameras share one instance
+_camera_specs = {}
+
+
+def _undistort(normalized, distortion):
+    """
+    Applies the radial distortion correction of a CameraSpecs to
+    normalized image coordinates (-1 to 1 from edge to edge). Works on
+    scalars and numpy arrays alike.
+    """
+    factor = 1
+    power = 1
+    squared = normalized * normalized
+    for coefficient in distortion:
+        power = power * squared
+        factor = factor + coefficient * power
+    return normalized * factor
+
+
+def _distort(undistorted, distortion):
+    """
+    Inverse of _undistort(), solved with a few Newton iterations.
+    """
+    if not distortion:
+        return undistorted
+    normalized = undistorted
+    for i in range(6):
+        squared = normalized * normalized
+        factor = 1
+        slope = 1
+        power = 1
+        for order, coefficient in enumerate(distortion, start=1):
+            power = power * squared
+            factor = factor + coefficient * power
+            slope = slope + (2 * order + 1) * coefficient * power
+        normalized = normalized - (normalized * factor - undistorted) / slope
+    return normalized
+
+
 class CameraSpecs:
     """
     Camera constants needed for geo-referencing.
+
+    Instances are shared: creating CameraSpecs with the same values as
+    an existing instance returns that instance. This way every image
+    from a camera reuses the same per-column and per-row angle tables.
     """
 
-    def __init__(self, image_width, image_height, field_of_view_horiz,
-                 field_of_view_vert):
+    # Like Image, overriding __new__() to reuse existing instances.
+    def __new__(cls,
+                image_width,
+                image_height,
+                field_of_view_horiz,
+                field_of_view_vert,
+                distortion=None):
+        key = (image_width, image_height, field_of_view_horiz,
+               field_of_view_vert, tuple(distortion or ()))
+        existing_specs = _camera_specs.get(key)
+        if existing_specs:
+            return existing_specs
+        else:
+            specs = super().__new__(cls)
+            _camera_specs[key] = specs
+            return specs
+
+    def __init__(self,
+                 image_width,
+                 image_height,
+                 field_of_view_horiz,
+                 field_of_view_vert,
+                 distortion=None):
         """
         image_width - the horizontal size of the image in pixels.
         image_height - the vertical size of the image in pixels.
@@ -191,12 +270,24 @@ class CameraSpecs:
                 the left and right edges of the image. In degrees.
         field_of_view_vert - the angle between the camera and
                 the top and bottom edges of the image. In degrees.
+        distortion - optional radial lens distortion coefficients
+                (k1, k2, ...). A normalized image coordinate d (-1 to 1
+                from edge to edge) is corrected to
+                d * (1 + k1 * d^2 + k2 * d^4 + ...). The correction is
+                applied along each axis separately so that it can be
+                baked into the per-column and per-row tables: exact
+                along the centre lines of the image and an
+                approximation towards the corners.
         """
+        if hasattr(self, "image_width"):
+            return  # An existing instance: already initialized
+
         self.image_width = image_width
         self.image_height = image_height
 
         self.field_of_view_horiz = field_of_view_horiz
         self.field_of_view_vert = field_of_view_vert
+        self.distortion = tuple(distortion or ())
 
         self.field_of_view_horiz_rad = radians(self.field_of_view_horiz)
         self.field_of_view_vert_rad = radians(self.field_of_view_vert)
@@ -205,12 +296,189 @@ class CameraSpecs:
         self.tan_angle_div_2_horiz = tan(self.field_of_view_horiz_rad / 2)
         self.tan_angle_div_2_vert = tan(self.field_of_view_vert_rad / 2)
 
+        # Angle offsets of every column and row. Built when first needed.
+        self._horiz_angle_table = None
+        self._vert_angle_table = None
+
+    def __getstate__(self):
+        """
+        Called during pickling. The tables are cheap to rebuild so they
+        aren't worth sending.
+        """
+        state = self.__dict__.copy()
+        state["_horiz_angle_table"] = None
+        state["_vert_angle_table"] = None
+        return state
+
+    def __setstate__(self, data):
+        # Only setting the __dict__ if self is a new instance:
+        if not hasattr(self, "image_width"):
+            self.__dict__ = data
+
+    def __getnewargs__(self):
+        """
+        Called during pickling. Provides __new__() with what it needs to
+        find an existing instance.
+        """
+        return self.key()
+
+    def key(self):
+        """
+        Returns a tuple identifying these specs. Two CameraSpecs with
+        equal keys give the same geo-referencing results.
+        """
+        return (self.image_width, self.image_height, self.field_of_view_horiz,
+                self.field_of_view_vert, self.distortion)
+
+    def horizAngleOffset(self, pixel_x):
+        """
+        Returns the horizontal angle (in radians) between the centre of
+        the camera and the pixel column pixel_x.
+        """
+        return atan(
+            _undistort(1 - 2 * pixel_x / self.image_width, self.distortion) *
+            self.tan_angle_div_2_horiz)
+
+    def vertAngleOffset(self, pixel_y):
+        """
+        Returns the vertical angle (in radians) between the centre of
+        the camera and the pixel row pixel_y.
+        """
+        return atan(
+            _undistort(1 - 2 * pixel_y / self.image_height, self.distortion) *
+            self.tan_angle_div_2_vert)
+
+    def horizAngleOffsets(self, pixel_x):
+        """
+        Vectorized version of horizAngleOffset(). Integer pixels are
+        looked up in the column table rather than computed.
+        """
+        if self._horiz_angle_table is None:
+            self._horiz_angle_table = self._angleOffsets(
+                np.arange(self.image_width + 1, dtype=np.float64),
+                self.image_width, self.tan_angle_div_2_horiz)
+        return self._lookupAngleOffsets(pixel_x, self._horiz_angle_table,
+                                        self.image_width,
+                                        self.tan_angle_div_2_horiz)
+
+    def vertAngleOffsets(self, pixel_y):
+        """
+        Vectorized version of vertAngleOffset(). Integer pixels are
+        looked up in the row table rather than computed.
+        """
+        if self._vert_angle_table is None:
+            self._vert_angle_table = self._angleOffsets(
+                np.arange(self.image_height + 1, dtype=np.float64),
+                self.image_height, self.tan_angle_div_2_vert)
+        return self._lookupAngleOffsets(pixel_y, self._vert_angle_table,
+                                        self.image_height,
+                                        self.tan_angle_div_2_vert)
+
+    def _angleOffsets(self, pixels, size, tan_angle_div_2):
+        return np.arctan(
+            _undistort(1 - 2 * pixels / size, self.distortion) *
+            tan_angle_div_2)
+
+    def _lookupAngleOffsets(self, pixels, table, size, tan_angle_div_2):
+        pixels = np.asarray(pixels)
+        if pixels.dtype.kind in "iu" and pixels.size and pixels.min(
+        ) >= 0 and pixels.max() <= size:
+            return table[pixels]
+        return self._angleOffsets(pixels.astype(np.float64), size,
+                                  tan_angle_div_2)
+
+    def pixelFromAngleOffsets(self, delta_theta_horiz, delta_theta_vert):
+        """
+        Inverse of the angle offset methods: returns the (pixel_x,
+        pixel_y) seen at the provided angles (in radians) from the
+        centre of the camera. Works on scalars and numpy arrays alike,
+        and doesn't check if the pixel is inside of the image.
+        """
+        tan_ = np.tan if isinstance(delta_theta_horiz, np.ndarray) else tan
+        normalized_x = _distort(
+            tan_(delta_theta_horiz) / self.tan_angle_div_2_horiz,
+            self.distortion)
+        normalized_y = _distort(
+            tan_(delta_theta_vert) / self.tan_angle_div_2_vert,
+            self.distortion)
+        return ((1 - normalized_x) * self.image_width / 2,
+                (1 - normalized_y) * self.image_height / 2)
+
     def __str__(self):
         return "%s by %s with %s\N{DEGREE SIGN} by %s\N{DEGREE SIGN}" % (
             self.image_width, self.image_height, self.field_of_view_horiz,
             self.field_of_view_vert)
 
 
+class LocalFrame:
+    """
+    A local east/north (equirectangular) frame anchored at a position.
+    Converting between lat/lon and metres east/north of the anchor is
+    pure arithmetic here, which makes it far cheaper than solving the
+    geodesic problem with pyproj.
+
+    The frame uses the WGS84 radii of curvature at the anchor. Its error
+    grows with the square of the distance from the anchor; errorBound()
+    gives a conservative bound (in metres) on the difference from the
+    geodesic result:
+
+        error <= distance^2 * (1 + |tan(anchor_lat)|) / R
+
+    where R is the smaller radius of curvature at the anchor. That is
+    about 3 cm at 300 m from the anchor at 53 degrees of latitude, but
+    the bound grows quickly towards the poles.
+    """
+
+    def __init__(self, anchor_lat, anchor_lon):
+        self.anchor_lat = anchor_lat
+        self.anchor_lon = anchor_lon
+
+        lat = radians(anchor_lat)
+        w = 1 - geod.es * sin(lat)**2
+        meridian_radius = geod.a * (1 - geod.es) / w**1.5
+        normal_radius = geod.a / sqrt(w)
+
+        self.metres_per_degree_lat = radians(1) * meridian_radius
+        self.metres_per_degree_lon = radians(1) * normal_radius * cos(lat)
+
+        self._error_factor = (1 + abs(tan(lat))) / min(meridian_radius,
+                                                       normal_radius)
+
+    def errorBound(self, distance):
+        """
+        Returns the maximum error in metres of a conversion for a point
+        the provided distance (in metres) away from the anchor.
+        """
+        return distance * distance * self._error_factor
+
+    def maxDistance(self, max_error):
+        """
+        Returns the distance from the anchor (in metres) up to which
+        conversions are within max_error metres.
+        """
+        return sqrt(max_error / self._error_factor)
+
+    def toLatLon(self, east, north):
+        """
+        Converts metres east and north of the anchor to latitude and
+        longitude. Works on scalars and numpy arrays alike.
+        """
+        lat = self.anchor_lat + north / self.metres_per_degree_lat
+        lon = self.anchor_lon + east / self.metres_per_degree_lon
+        return lat, lon
+
+    def fromLatLon(self, lat, lon):
+        """
+        Converts latitude and longitude to metres east and north of the
+        anchor. Works on scalars and numpy arrays alike.
+        """
+        delta_lon = (lon - self.anchor_lon +
+                     180) % 360 - 180  # Across the antimeridian
+        east = delta_lon * self.metres_per_degree_lon
+        north = (lat - self.anchor_lat) * self.metres_per_degree_lat
+        return east, north
+
+
 class GeoReference:
     """
     Class for geo-referencing. Create an instance with the relatively
@@ -218,11 +486,49 @@ class GeoReference:
     the desired type of geo-referencing.
     """
 
-    def __init__(self, camera_specs):
+    def __init__(self,
+                 camera_specs,
+                 max_local_error=None,
+                 dem=None,
+                 max_terrain_range=5000):
         """
         Create an instance according to the specified system constants.
+
+        max_local_error - if provided, enables the local frame fast
+                path: points close enough to the plane that a LocalFrame
+                anchored at the plane is accurate to within this many
+                metres are converted with plain arithmetic. Points
+                further away fall back to the full geodesic solution.
+        dem - if provided (a pigeon.dem.DEM), the ground follows the
+                terrain instead of being flat. The plane's height is
+                then its height above the terrain directly below it.
+                Anywhere that the DEM has no data below the plane, flat
+                ground is used as before.
+        max_terrain_range - how far (horizontally, in metres) to follow
+                a pixel's ray looking for the terrain before giving up
+                on it (ex. a ray pointed just below the horizon).
         """
         self.camera = camera_specs
+        self.max_local_error = max_local_error
+        self.dem = dem
+        self.max_terrain_range = max_terrain_range
+        self._local_frame = None
+        self._local_max_distance = 0
+
+    def _localFrame(self, location):
+        """
+        Returns a LocalFrame anchored at the provided location and the
+        distance within which it can be used. Returns None, 0 if the
+        fast path is disabled.
+        """
+        if self.max_local_error is None:
+            return None, 0
+        frame = self._local_frame
+        if not frame or frame.anchor_lat != location.lat or frame.anchor_lon != location.lon:
+            # Normally the same image (so the same anchor) is used over and over
+            frame = self._local_frame = LocalFrame(location.lat, location.lon)
+            self._local_max_distance = frame.maxDistance(self.max_local_error)
+        return frame, self._local_max_distance
 
     def centerOfImage(self, location, orientation):
         """
@@ -261,13 +567,17 @@ class GeoReference:
         if location.height <= 0:
             return None  # Can't geo-reference if the plane isn't above the ground
 
+        if self.dem:
+            # The terrain intersection is only implemented on arrays
+            lat, lon, valid = self.pointsInImage(location, orientation,
+                                                 pixel_x, pixel_y)
+            return Position(float(lat), float(lon)) if valid else None
+
         camera = self.camera
 
         # Step 1: calculating angle offsets of pixel selected
-        delta_theta_horiz = atan((1 - 2 * pixel_x / camera.image_width) *
-                                 camera.tan_angle_div_2_horiz)
-        delta_theta_vert = atan((1 - 2 * pixel_y / camera.image_height) *
-                                camera.tan_angle_div_2_vert)
+        delta_theta_horiz = camera.horizAngleOffset(pixel_x)
+        delta_theta_vert = camera.vertAngleOffset(pixel_y)
 
         # Step 2: calculating effective pitch and roll
         pitch = orientation.pitch_rad + delta_theta_vert
@@ -289,11 +599,16 @@ class GeoReference:
         # Step 4: calculating angle from north to pixel
         forward_azimuth = phi + orientation.yaw_rad
 
-        # Step 5: calculating endpoint using pyproj GIS module
-        pixel_lon, pixel_lat, back_azimuth = geod.fwd(location.lon,
-                                                      location.lat,
-                                                      degrees(forward_azimuth),
-                                                      distance)
+        # Step 5: calculating endpoint, in the local frame if it's accurate enough,
+        # otherwise using pyproj GIS module
+        frame, max_distance = self._localFrame(location)
+        if distance <= max_distance:
+            pixel_lat, pixel_lon = frame.toLatLon(
+                distance * sin(forward_azimuth),
+                distance * cos(forward_azimuth))
+        else:
+            pixel_lon, pixel_lat, back_azimuth = geod.fwd(
+                location.lon, location.lat, degrees(forward_azimuth), distance)
 
         # print("pointInImage - distance: %.1f, bearing: %.1f, result: %.6f, %.6f" % (distance,
         #                                                                             degrees(forward_azimuth),
@@ -302,6 +617,153 @@ class GeoReference:
 
         return Position(pixel_lat, pixel_lon)
 
+    def pointsInImage(self, location, orientation, pixel_x, pixel_y):
+        """
+        Vectorized version of pointInImage(): georeferences many pixels
+        of the same image at once.
+
+        pixel_x, pixel_y - array-likes (or scalars) of pixel coordinates
+                measured the same way as in pointInImage(). They are
+                broadcast against each other.
+
+        Returns a tuple of three numpy arrays (lat, lon, valid) with the
+        broadcast shape of the inputs. valid is a boolean mask that is
+        False wherever pointInImage() would have returned None; lat and
+        lon are NaN at those entries.
+        """
+        # Not converting to float: integer pixels can use the camera's tables
+        pixel_x, pixel_y = np.broadcast_arrays(np.asarray(pixel_x),
+                                               np.asarray(pixel_y))
+        shape = pixel_x.shape
+
+        lat = np.full(shape, np.nan)
+        lon = np.full(shape, np.nan)
+        if location.height <= 0:
+            return lat, lon, np.zeros(shape, dtype=bool)
+
+        camera = self.camera
+
+        # Same steps as in pointInImage(), just on whole arrays at a time
+        delta_theta_horiz = camera.horizAngleOffsets(pixel_x)
+        delta_theta_vert = camera.vertAngleOffsets(pixel_y)
+
+        pitch = orientation.pitch_rad + delta_theta_vert
+        roll = orientation.roll_rad + delta_theta_horiz
+
+        positive_90 = radians(90)
+        valid = np.asarray((np.abs(pitch) < positive_90)
+                           & (np.abs(roll) < positive_90))
+        if not valid.any():
+            return lat, lon, valid
+
+        pitch = pitch[valid]
+        roll = roll[valid]
+        distance_y = location.height * np.tan(pitch)
+        distance_x = location.height * np.tan(-roll)
+        distance = np.hypot(distance_x, distance_y)
+        forward_azimuth = np.arctan2(distance_x,
+                                     distance_y) + orientation.yaw_rad
+
+        if self.dem:
+            terrain_distance = self._terrainDistances(
+                location, forward_azimuth, distance / location.height)
+            if terrain_distance is not None:
+                hit = ~np.isnan(terrain_distance)
+                valid[valid] = hit
+                distance = terrain_distance[hit]
+                forward_azimuth = forward_azimuth[hit]
+
+        pixel_lat = np.empty(distance.shape)
+        pixel_lon = np.empty(distance.shape)
+
+        frame, max_distance = self._localFrame(location)
+        local = distance <= max_distance
+        if local.any():
+            pixel_lat[local], pixel_lon[local] = frame.toLatLon(
+                distance[local] * np.sin(forward_azimuth[local]),
+                distance[local] * np.cos(forward_azimuth[local]))
+
+        # A single call to pyproj for all of the remaining points
+        far = ~local
+        count = np.count_nonzero(far)
+        if count:
+            pixel_lon[far], pixel_lat[far], _ = geod.fwd(
+                np.full(count, location.lon), np.full(count, location.lat),
+                np.degrees(forward_azimuth[far]), distance[far])
+
+        lat[valid] = pixel_lat
+        lon[valid] = pixel_lon
+        return lat, lon, valid
+
+    def _terrainDistances(self, location, forward_azimuth, slope):
+        """
+        Finds where rays leaving the plane hit the terrain, by marching
+        all of them forward together in steps of about the DEM's
+        resolution and then bisecting the step where each one went
+        underground.
+
+        forward_azimuth - array of the rays' directions (radians)
+        slope - array of the horizontal distance each ray travels per
+                metre that it descends
+
+        Returns an array of the horizontal distances to the terrain (NaN
+        for rays that leave the DEM or don't hit within
+        max_terrain_range), or None if there's no DEM data below the
+        plane.
+        """
+        dem = self.dem
+        ground_below = float(dem.elevation(location.lat, location.lon))
+        if isnan(ground_below):
+            return None
+        altitude = ground_below + location.height
+        frame = LocalFrame(location.lat, location.lon)
+        east_per_metre = np.sin(forward_azimuth)
+        north_per_metre = np.cos(forward_azimuth)
+        # Straight down rays have no slope: any step at all takes them underground
+        descent = 1 / np.maximum(slope, 1e-12)
+
+        def clearance(rays, distance):
+            lat, lon = frame.toLatLon(distance * east_per_metre[rays],
+                                      distance * north_per_metre[rays])
+            return altitude - distance * descent[rays] - dem.elevation(
+                lat, lon)
+
+        # Limiting the number of steps for very detailed DEMs
+        step = max(dem.resolution, self.max_terrain_range / 500)
+        result = np.full(forward_azimuth.shape, np.nan)
+        rays = np.arange(forward_azimuth.size)
+        distance = 0
+        while rays.size and distance < self.max_terrain_range:
+            distance += step
+            above = clearance(rays, distance)
+            crossed = above <= 0
+            if crossed.any():
+                hit = rays[crossed]
+                low = np.full(hit.shape, distance - step)
+                high = np.full(hit.shape, distance)
+                for _ in range(16):  # Down to a millimetre or so for 30 m DEMs
+                    middle = (low + high) / 2
+                    below = ~(clearance(hit, middle) > 0)
+                    high = np.where(below, middle, high)
+                    low = np.where(below, low, middle)
+                result[hit] = (low + high) / 2
+            rays = rays[above
+                        > 0]  # Also dropping rays that left the DEM (NaN)
+        return result
+
+    def _terrainHeights(self, plane_location, lats, lons):
+        """
+        Returns the height of the terrain at the provided points above
+        the terrain below the plane, which is how far the plane's height
+        is off for those points. 0 without a DEM or where it has no
+        data.
+        """
+        if not self.dem:
+            return np.zeros(np.shape(lats))
+        heights = self.dem.elevation(lats, lons) - self.dem.elevation(
+            plane_location.lat, plane_location.lon)
+        return np.nan_to_num(heights)
+
     def pointBelowPlane(self, plane_location, orientation):
         """
         Calculates and returns the position (pixel_x and pixel_y) of
@@ -334,29 +796,38 @@ class GeoReference:
 
         camera = self.camera
 
-        forward_azimuth, back_azimuth, distance = geod.inv(
-            plane_location.lon, plane_location.lat, point_location.lon,
-            point_location.lat)
-        forward_azimuth = radians(forward_azimuth)
-        back_azimuth = radians(back_azimuth)
+        frame, max_distance = self._localFrame(plane_location)
+        if frame:
+            east, north = frame.fromLatLon(point_location.lat,
+                                           point_location.lon)
+            distance = sqrt(east * east + north * north)
+        if frame and distance <= max_distance:
+            forward_azimuth = atan2(east, north)
+        else:
+            forward_azimuth, back_azimuth, distance = geod.inv(
+                plane_location.lon, plane_location.lat, point_location.lon,
+                point_location.lat)
+            forward_azimuth = radians(forward_azimuth)
+
+        point_height = point_location.height or 0
+        if self.dem:
+            point_height += float(
+                self._terrainHeights(plane_location, point_location.lat,
+                                     point_location.lon))
 
         phi = forward_azimuth - orientation.yaw_rad
 
         distance_x = distance * sin(phi)
         distance_y = distance * cos(phi)
 
-        pitch = atan2(distance_y,
-                      plane_location.height - (point_location.height or 0))
-        roll = -atan2(distance_x, plane_location.height -
-                      (point_location.height or 0))
+        pitch = atan2(distance_y, plane_location.height - point_height)
+        roll = -atan2(distance_x, plane_location.height - point_height)
 
         delta_theta_vert = pitch - orientation.pitch_rad
         delta_theta_horiz = roll - orientation.roll_rad
 
-        pixel_x = (1 - tan(delta_theta_horiz) /
-                   camera.tan_angle_div_2_horiz) * camera.image_width / 2
-        pixel_y = (1 - tan(delta_theta_vert) /
-                   camera.tan_angle_div_2_vert) * camera.image_height / 2
+        pixel_x, pixel_y = camera.pixelFromAngleOffsets(
+            delta_theta_horiz, delta_theta_vert)
 
         # print("Internal pixel_x, pixel_y: %s, %s" % (pixel_x, pixel_y))
         if pixel_x < 0 or pixel_x >= camera.image_width or pixel_y < 0 or pixel_y >= camera.image_height:
@@ -364,6 +835,262 @@ class GeoReference:
 
         return pixel_x, pixel_y
 
+    def pointsOnImage(self,
+                      plane_location,
+                      orientation,
+                      point_lats,
+                      point_lons,
+                      point_heights=None):
+        """
+        Vectorized version of pointOnImage(): projects many ground
+        points into this image at once.
+
+        point_lats, point_lons - array-likes of the points' positions
+                in degrees.
+        point_heights - optional array-like (or scalar) of the points'
+                heights. Taken to be 0 if None.
+
+        Returns a tuple of three numpy arrays (pixel_x, pixel_y, valid).
+        valid is False wherever pointOnImage() would have returned
+        None's; pixel_x and pixel_y are NaN at those entries.
+        """
+        point_lats, point_lons = np.broadcast_arrays(
+            np.asarray(point_lats, dtype=np.float64),
+            np.asarray(point_lons, dtype=np.float64))
+        forward_azimuth = np.empty(point_lats.shape)
+        distance = np.empty(point_lats.shape)
+
+        frame, max_distance = self._localFrame(plane_location)
+        if frame:
+            east, north = frame.fromLatLon(point_lats, point_lons)
+            distance = np.hypot(east, north)
+            forward_azimuth = np.arctan2(east, north)
+            far = ~(distance <= max_distance)
+        else:
+            far = np.ones(point_lats.shape, dtype=bool)
+
+        count = np.count_nonzero(far)
+        if count:
+            far_azimuth, _, distance[far] = geod.inv(
+                np.full(count, plane_location.lon),
+                np.full(count, plane_location.lat), point_lons[far],
+                point_lats[far])
+            forward_azimuth[far] = np.radians(far_azimuth)
+
+        if self.dem:
+            point_heights = np.nan_to_num(
+                np.asarray(0 if point_heights is None else point_heights,
+                           dtype=np.float64)) + self._terrainHeights(
+                               plane_location, point_lats, point_lons)
+
+        camera = self.camera
+        return _ground_to_pixels(forward_azimuth, distance,
+                                 plane_location.height, orientation.pitch_rad,
+                                 orientation.roll_rad, orientation.yaw_rad,
+                                 camera.image_width, camera.image_height,
+                                 camera.tan_angle_div_2_horiz,
+                                 camera.tan_angle_div_2_vert, point_heights,
+                                 camera.distortion)
+
+
+def _bilinear_scalar(rows, fx, fy):
+    """
+    Scalar version of _bilinear() working on nested lists, which is
+    much quicker than numpy for a single point. Returns None if any of
+    the surrounding samples aren't finite.
+    """
+    ix = min(max(int(fx), 0), len(rows[0]) - 2)
+    iy = min(max(int(fy), 0), len(rows) - 2)
+    tx = fx - ix
+    ty = fy - iy
+    top = rows[iy][ix] * (1 - tx) + rows[iy][ix + 1] * tx
+    bottom = rows[iy + 1][ix] * (1 - tx) + rows[iy + 1][ix + 1] * tx
+    result = top * (1 - ty) + bottom * ty
+    return result if isfinite(result) else None
+
+
+def _bilinear(values, fx, fy):
+    """
+    Bilinearly interpolates the 2D array of samples at the fractional
+    indices fx (along columns) and fy (along rows). Returns the values
+    and a mask of where all four surrounding samples were finite.
+    """
+    rows, columns = values.shape
+    ix = np.clip(np.floor(fx).astype(int), 0, columns - 2)
+    iy = np.clip(np.floor(fy).astype(int), 0, rows - 2)
+    tx = fx - ix
+    ty = fy - iy
+    top = values[iy, ix] * (1 - tx) + values[iy, ix + 1] * tx
+    bottom = values[iy + 1, ix] * (1 - tx) + values[iy + 1, ix + 1] * tx
+    result = top * (1 - ty) + bottom * ty
+    return result, np.isfinite(result)
+
+
+class GeoReferenceGrid:
+    """
+    A coarse lookup table of geo-referencing results for one image.
+    Samples are computed once with the batch methods of GeoReference;
+    after that, any pixel (or ground position) is answered by bilinear
+    interpolation between the nearest samples, which takes microseconds
+    instead of a geodesic solution.
+
+    Results are only available where all of the surrounding samples are
+    valid (ex. not near the horizon or outside the image). Callers
+    should fall back to GeoReference for anything else. max_error is an
+    estimate of the interpolation error in metres, measured at the
+    centres of the cells when the grid is built.
+    """
+
+    def __init__(self, georeference, location, orientation, samples=33):
+        self.key = self.makeKey(georeference.camera, location, orientation)
+        self.samples = samples
+        camera = georeference.camera
+        self.image_width = camera.image_width
+        self.image_height = camera.image_height
+
+        # Forward grid: pixel -> lat/lon
+        xs = np.linspace(0, self.image_width, samples)
+        ys = np.linspace(0, self.image_height, samples)
+        pixel_x, pixel_y = np.meshgrid(xs, ys)
+        self.lat, self.lon, _ = georeference.pointsInImage(
+            location, orientation, pixel_x, pixel_y)
+
+        # Inverse grid: lat/lon -> pixel, over the bounding box of the footprint
+        if np.isfinite(self.lat).any():
+            self.lat_range = (float(np.nanmin(self.lat)),
+                              float(np.nanmax(self.lat)))
+            self.lon_range = (float(np.nanmin(self.lon)),
+                              float(np.nanmax(self.lon)))
+        else:
+            self.lat_range = self.lon_range = (0, 0)
+        grid_lat, grid_lon = np.meshgrid(np.linspace(*self.lat_range, samples),
+                                         np.linspace(*self.lon_range, samples),
+                                         indexing="ij")
+        self.pixel_x, self.pixel_y, _ = georeference.pointsOnImage(
+            location, orientation, grid_lat, grid_lon)
+
+        # Plain lists are faster than numpy arrays for looking up single points
+        self._lat_rows = self.lat.tolist()
+        self._lon_rows = self.lon.tolist()
+        self._pixel_x_rows = self.pixel_x.tolist()
+        self._pixel_y_rows = self.pixel_y.tolist()
+
+        # Measuring how well the interpolation matches at the centres of the cells
+        centres_x = (xs[:-1] + xs[1:]) / 2
+        centres_y = (ys[:-1] + ys[1:]) / 2
+        centre_x, centre_y = np.meshgrid(centres_x, centres_y)
+        exact_lat, exact_lon, exact_valid = georeference.pointsInImage(
+            location, orientation, centre_x, centre_y)
+        approx_lat, approx_lon, approx_valid = self.pointsInImage(
+            centre_x, centre_y)
+        compare = exact_valid & approx_valid
+        if compare.any():
+            _, _, errors = geod.inv(approx_lon[compare], approx_lat[compare],
+                                    exact_lon[compare], exact_lat[compare])
+            self.max_error = float(np.max(errors))
+        else:
+            self.max_error = 0.0
+
+    @staticmethod
+    def makeKey(camera, location, orientation):
+        """
+        Returns the key a grid built for these inputs would have. A grid
+        is out of date if its key doesn't match.
+        """
+        return (location.lat, location.lon, location.height, orientation.pitch,
+                orientation.roll, orientation.yaw, camera.key())
+
+    @property
+    def nbytes(self):
+        """
+        Approximate memory used by the samples, in bytes. Counts both
+        the arrays and the list copies (a float object and a pointer for
+        each sample).
+        """
+        arrays = (self.lat.nbytes + self.lon.nbytes + self.pixel_x.nbytes +
+                  self.pixel_y.nbytes)
+        return arrays + arrays // 8 * (sys.getsizeof(0.0) + 8)
+
+    def pointInImage(self, pixel_x, pixel_y):
+        """
+        Interpolated version of GeoReference.pointInImage() for a single
+        pixel. Returns a (lat, lon) tuple or None if the grid can't
+        answer for this pixel.
+        """
+        if not (0 <= pixel_x <= self.image_width
+                and 0 <= pixel_y <= self.image_height):
+            return None
+        fx = pixel_x / self.image_width * (self.samples - 1)
+        fy = pixel_y / self.image_height * (self.samples - 1)
+        lat = _bilinear_scalar(self._lat_rows, fx, fy)
+        lon = _bilinear_scalar(self._lon_rows, fx, fy)
+        if lat is None or lon is None:
+            return None
+        return lat, lon
+
+    def pointOnImage(self, lat, lon):
+        """
+        Interpolated version of GeoReference.pointOnImage() for a single
+        point on the ground. Returns a (pixel_x, pixel_y) tuple or None
+        if the grid can't answer for this point.
+        """
+        lat_min, lat_max = self.lat_range
+        lon_min, lon_max = self.lon_range
+        if not (lat_min <= lat <= lat_max and lon_min <= lon <= lon_max
+                and lat_max > lat_min and lon_max > lon_min):
+            return None
+        fy = (lat - lat_min) / (lat_max - lat_min) * (self.samples - 1)
+        fx = (lon - lon_min) / (lon_max - lon_min) * (self.samples - 1)
+        pixel_x = _bilinear_scalar(self._pixel_x_rows, fx, fy)
+        pixel_y = _bilinear_scalar(self._pixel_y_rows, fx, fy)
+        if pixel_x is None or pixel_y is None:
+            return None
+        return pixel_x, pixel_y
+
+    def pointsInImage(self, pixel_x, pixel_y):
+        """
+        Interpolated version of GeoReference.pointsInImage(). Returns a
+        tuple of (lat, lon, valid) numpy arrays.
+        """
+        pixel_x, pixel_y = np.broadcast_arrays(
+            np.asarray(pixel_x, dtype=np.float64),
+            np.asarray(pixel_y, dtype=np.float64))
+        fx = pixel_x / self.image_width * (self.samples - 1)
+        fy = pixel_y / self.image_height * (self.samples - 1)
+        inside = ((pixel_x >= 0) & (pixel_x <= self.image_width) &
+                  (pixel_y >= 0) & (pixel_y <= self.image_height))
+        fx = np.where(inside, fx, 0)
+        fy = np.where(inside, fy, 0)
+        lat, lat_valid = _bilinear(self.lat, fx, fy)
+        lon, lon_valid = _bilinear(self.lon, fx, fy)
+        valid = inside & lat_valid & lon_valid
+        return np.where(valid, lat, np.nan), np.where(valid, lon,
+                                                      np.nan), valid
+
+    def pointsOnImage(self, lats, lons):
+        """
+        Interpolated version of GeoReference.pointsOnImage() for points
+        on the ground. Returns a tuple of (pixel_x, pixel_y, valid)
+        numpy arrays.
+        """
+        lats, lons = np.broadcast_arrays(np.asarray(lats, dtype=np.float64),
+                                         np.asarray(lons, dtype=np.float64))
+        lat_min, lat_max = self.lat_range
+        lon_min, lon_max = self.lon_range
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fy = (lats - lat_min) / (lat_max - lat_min) * (self.samples - 1)
+            fx = (lons - lon_min) / (lon_max - lon_min) * (self.samples - 1)
+        inside = ((lats >= lat_min) & (lats <= lat_max) & (lons >= lon_min) &
+                  (lons <= lon_max) & (lat_max > lat_min) &
+                  (lon_max > lon_min))
+        fx = np.where(inside, fx, 0)
+        fy = np.where(inside, fy, 0)
+        pixel_x, x_valid = _bilinear(self.pixel_x, fx, fy)
+        pixel_y, y_valid = _bilinear(self.pixel_y, fx, fy)
+        valid = inside & x_valid & y_valid
+        return np.where(valid, pixel_x,
+                        np.nan), np.where(valid, pixel_y, np.nan), valid
+
 
 class PositionCollection:
 
@@ -578,6 +1305,341 @@ class PositionCollection:
         return (north, south, east, west)
 
 
+def _optional_array(values, count):
+    """
+    Converts a sequence of optional numbers (or None) to a float array
+    of the provided length, using NaN for missing values.
+    """
+    if values is None:
+        return np.full(count, np.nan)
+    if isinstance(values, np.ndarray) and values.dtype != object:
+        return np.asarray(values, dtype=np.float64).ravel()
+    if not isinstance(values, (list, tuple)):
+        values = list(values)
+    if None not in values:
+        return np.asarray(values, dtype=np.float64).ravel()
+    return np.array([np.nan if value is None else value for value in values],
+                    dtype=np.float64)
+
+
+class PositionArray:
+    """
+    Columnar version of PositionCollection. Holds an ordered series of
+    positions as numpy arrays of latitudes, longitudes, heights and
+    altitudes so that its properties are each computed with a few
+    vectorized operations rather than a loop over Position objects.
+    Missing heights and altitudes (None in a Position) are stored as
+    NaN.
+
+    Provides the same methods as PositionCollection and gives the same
+    results.
+    """
+
+    def __init__(self,
+                 lat,
+                 lon,
+                 height=None,
+                 alt=None,
+                 interior_positions_list=None):
+        """
+        lat, lon - sequences of latitudes and longitudes in degrees.
+        height, alt - optional sequences of heights and altitudes in
+                meters (may contain None's).
+        interior_positions_list - optional list of holes, each either a
+                PositionArray or a list of Positions. See
+                PositionCollection.
+        """
+        self.lat = np.asarray(lat, dtype=np.float64).ravel()
+        self.lon = np.asarray(lon, dtype=np.float64).ravel()
+        count = len(self.lat)
+        if len(self.lon) != count:
+            raise ValueError("Got %s latitudes but %s longitudes." %
+                             (count, len(self.lon)))
+        self.height = _optional_array(height, count)
+        self.alt = _optional_array(alt, count)
+
+        self.interior_positions_list = [
+            interior if isinstance(interior, PositionArray) else
+            PositionArray.fromPositions(interior)
+            for interior in interior_positions_list or []
+        ]
+        self._area = None  # Cached since the projection is expensive to create
+
+    @classmethod
+    def fromPositions(cls, positions, interior_positions_list=None):
+        """
+        Creates a PositionArray from a list of Position objects.
+        """
+        return cls([position.lat for position in positions],
+                   [position.lon for position in positions],
+                   [position.height for position in positions],
+                   [position.alt
+                    for position in positions], interior_positions_list)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __getitem__(self, index):
+        height = self.height[index]
+        alt = self.alt[index]
+        return Position(float(self.lat[index]), float(self.lon[index]),
+                        None if np.isnan(height) else float(height),
+                        None if np.isnan(alt) else float(alt))
+
+    @property
+    def positions(self):
+        """
+        The positions as a list of Position objects. For compatibility
+        with PositionCollection: avoid this for large arrays.
+        """
+        return [self[i] for i in range(len(self))]
+
+    def center(self):
+        """
+        Calculates the centroid of the positions. See
+        PositionCollection.center().
+        """
+        if not len(self):
+            return None
+        elif len(self) == 1:
+            return self[0]
+
+        lat = np.radians(self.lat)
+        lon = np.radians(self.lon)
+        x = float(np.mean(np.cos(lat) * np.cos(lon)))
+        y = float(np.mean(np.cos(lat) * np.sin(lon)))
+        z = float(np.mean(np.sin(lat)))
+
+        def mean_if_all_set(values):
+            # Like PositionCollection: only averaged if all are non-zero
+            if np.all((values != 0) & ~np.isnan(values)):
+                return float(np.mean(values))
+            return None
+
+        return Position(degrees(atan2(z, sqrt(x * x + y * y))),
+                        degrees(atan2(y, x)), mean_if_all_set(self.height),
+                        mean_if_all_set(self.alt))
+
+    def _closed(self):
+        """
+        Returns a PositionArray where the last position is the same as
+        the first.
+        """
+        first = (self.lat[0], self.lon[0], self.height[0], self.alt[0])
+        last = (self.lat[-1], self.lon[-1], self.height[-1], self.alt[-1])
+        if np.array_equal(first, last, equal_nan=True):
+            return self
+        return PositionArray(np.append(self.lat, self.lat[0]),
+                             np.append(self.lon, self.lon[0]),
+                             np.append(self.height, self.height[0]),
+                             np.append(self.alt, self.alt[0]))
+
+    def area(self):
+        """
+        Calculates the area of the polygon defined by the positions
+        (and optional holes). See PositionCollection.area().
+        """
+        if len(self) < 4:
+            return 0
+        if self._area is not None:
+            return self._area
+
+        outside = self._closed()
+        projection = pyproj.Proj(proj="aea",
+                                 lat_1=outside.lat.min(),
+                                 lat_2=outside.lat.max(),
+                                 lat_0=outside.lat.mean(),
+                                 lon_0=outside.lon.mean())
+
+        def to_coords(positions):
+            x, y = projection(positions.lon, positions.lat)
+            return np.column_stack((x, y))
+
+        interior_coords_list = [
+            to_coords(interior) for interior in self.interior_positions_list
+        ] or None
+        polygon = Polygon(to_coords(outside), interior_coords_list)
+        if not polygon.is_valid:
+            raise ValueError("Positions do not define a valid polygon.")
+        self._area = polygon.area
+        return self._area
+
+    def _segment_length(self, include_height, include_alt):
+        """
+        Total length along the positions, computed with a single call to
+        Geod.line_lengths(). See PositionCollection._segment_length().
+        """
+        if include_height and include_alt:
+            raise ValueError(
+                "Both include_height and include_alt specified. Must pick only one or neither."
+            )
+        if len(self) < 2:
+            return 0
+
+        distances = np.asarray(geod.line_lengths(self.lon, self.lat))
+
+        for include, values, name in ((include_height, self.height, "height"),
+                                      (include_alt, self.alt, "alt")):
+            if include:
+                if np.isnan(values).any():
+                    raise ValueError(
+                        "Valid %s values must be provided for all positions when specifying include_%s."
+                        % (name, name))
+                distances = np.hypot(distances, np.diff(values))
+
+        return float(np.sum(distances))
+
+    def perimeter(self, include_height=False, include_alt=False):
+        """
+        Returns the length around the outside of the polygon plus the
+        length around each hole. See PositionCollection.perimeter().
+        """
+        segments = [self._closed()] + self.interior_positions_list
+        return sum(
+            segment._segment_length(include_height, include_alt)
+            for segment in segments)
+
+    def length(self, include_height=False, include_alt=False):
+        """
+        Returns the length along the positions. Does not connect the
+        last to the first automatically.
+        """
+        return self._segment_length(include_height, include_alt)
+
+    def boundingBox(self, include_rotation=False):
+        return (float(self.lat.max()), float(self.lat.min()),
+                float(self.lon.max()), float(self.lon.min()))
+
+
+class PoseArray:
+    """
+    Struct-of-arrays store for many timestamped poses (ex. hours of
+    telemetry or the poses of thousands of images). Each field is kept
+    in its own numpy array rather than as Position and Orientation
+    objects: 64 bytes per pose instead of several hundred.
+
+    Storage grows by doubling, so appending is amortized O(1). Times are
+    expected to be appended in non-decreasing order for poseAt().
+    """
+
+    fields = ("time", "lat", "lon", "height", "alt", "pitch", "roll", "yaw")
+
+    def __init__(self, capacity=1024):
+        self._data = np.full((len(self.fields), max(capacity, 1)), np.nan)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self):
+        """
+        Memory reserved for the poses, in bytes.
+        """
+        return self._data.nbytes
+
+    def column(self, name):
+        """
+        Returns a read-only view of the values of the named field (one
+        of PoseArray.fields). Missing heights and altitudes are NaN.
+        """
+        view = self._data[self.fields.index(name), :self._count]
+        view.flags.writeable = False
+        return view
+
+    def append(self, time, position, orientation):
+        """
+        Adds a pose. time is in seconds (ex. from time.time()).
+        """
+        self._reserve(self._count + 1)
+        self._data[:, self._count] = (
+            time, position.lat, position.lon,
+            np.nan if position.height is None else position.height,
+            np.nan if position.alt is None else position.alt,
+            orientation.pitch, orientation.roll, orientation.yaw)
+        self._count += 1
+
+    def extend(self, time, lat, lon, height, alt, pitch, roll, yaw):
+        """
+        Adds many poses at once from arrays (or scalars, which are
+        broadcast). Angles are in degrees and are normalized the same
+        way as by Orientation.
+        """
+        columns = np.broadcast_arrays(*[
+            np.asarray(value, dtype=np.float64).ravel()
+            for value in (time, lat, lon, height, alt, pitch, roll, yaw)
+        ])
+        count = len(columns[0])
+        self._reserve(self._count + count)
+        new = self._data[:, self._count:self._count + count]
+        for i, values in enumerate(columns):
+            new[i] = values
+        pitch_roll = slice(self.fields.index("pitch"),
+                           self.fields.index("roll") + 1)
+        new[pitch_roll] = (new[pitch_roll] + 180) % 360 - 180
+        new[self.fields.index("yaw")] %= 360
+        self._count += count
+
+    def __getitem__(self, index):
+        """
+        Returns the pose at index as a (time, Position, Orientation)
+        tuple.
+        """
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("PoseArray index out of range")
+        return self._toPose(self._data[:, index])
+
+    def positions(self):
+        """
+        Returns the positions as a PositionArray.
+        """
+        return PositionArray(self.column("lat"), self.column("lon"),
+                             self.column("height"), self.column("alt"))
+
+    def poseAt(self, time):
+        """
+        Returns the pose at the provided time as a (time, Position,
+        Orientation) tuple, linearly interpolated between the nearest
+        stored poses. Times outside of the stored range use the first or
+        last pose. Returns None if there aren't any poses.
+        """
+        if not self._count:
+            return None
+        times = self._data[0, :self._count]
+        after = int(np.searchsorted(times, time))
+        if after == 0:
+            return self._toPose(self._data[:, 0])
+        if after == self._count:
+            return self._toPose(self._data[:, self._count - 1])
+
+        before_pose = self._data[:, after - 1]
+        after_pose = self._data[:, after]
+        span = after_pose[0] - before_pose[0]
+        fraction = (time - before_pose[0]) / span if span else 0
+        delta = after_pose - before_pose
+        for name in ("pitch", "roll", "yaw"):  # Going the short way around
+            i = self.fields.index(name)
+            delta[i] = (delta[i] + 180) % 360 - 180
+        return self._toPose(before_pose + delta * fraction)
+
+    def _toPose(self, values):
+        time, lat, lon, height, alt, pitch, roll, yaw = values.tolist()
+        return (time,
+                Position(lat, lon, None if isnan(height) else height,
+                         None if isnan(alt) else alt),
+                Orientation(pitch, roll, yaw))
+
+    def _reserve(self, count):
+        capacity = self._data.shape[1]
+        if count > capacity:
+            data = np.full((len(self.fields), max(count, capacity * 2)),
+                           np.nan)
+            data[:, :self._count] = self._data[:, :self._count]
+            self._data = data
+
+
 def utm_to_DD(easting, northing, zone, hemisphere="northern"):
     """
     Converts a set of UTM GPS coordinates to WGS84 Decimal Degree GPS coordinates.
@@ -586,31 +1648,15 @@ def utm_to_DD(easting, northing, zone, hemisphere="northern"):
     northing - UTM northing in metres
     zone - current UTM zone
 
-    Note that no hemisphere is specified; in the southern hemisphere, this function expects the
-    false northing (10 000 000m) to be subtracted.
+    With the default hemisphere ("northern"), this function expects the false northing
+    (10 000 000m) to be subtracted for positions in the southern hemisphere.
 
     An exception will be raised if the conversion involves invalid values.
-    """
 
-    easting, northing, zone = float(easting), float(northing), int(zone)
-    # Easting and Northing ranges from http://geokov.com/education/utm.aspx (used to be:
-    # https://www.e-education.psu.edu/natureofgeoinfo/c2_p23.html)
-    min_easting, max_easting = 166000, 834000
-    if not (min_easting < easting < max_easting):
-        raise ValueError("Easting value of %s is out of bounds (%s to %s)." %
-                         (easting, min_easting, max_easting))
-    min_northing, max_northing = -9900000, 9400000
-    if not (min_northing < northing < max_northing):
-        raise ValueError("Northing value of %s is out of bounds (%s to %s)." %
-                         (northing, min_northing, max_northing))
-
-    if not (1 <= zone <= 60):
-        raise ValueError("Zone value of %s is out of bounds" % zone)
-
-    pr = pyproj.Proj(proj='utm', zone=zone, ellps='WGS84', errcheck=True)
-
-    lon, lat = pr(easting, northing, inverse=True)
-    return lat, lon
+    See the utm module for converting many coordinates at once.
+    """
+    lat, lon = utm.to_lat_lon(easting, northing, zone, hemisphere)
+    return float(lat), float(lon)
 
 
 def position_at_offset(position, distance, angle):
@@ -660,3 +1706,121 @@ def heading_between_positions(position_a, position_b):
         return angle
 
     return normalize_angle(az_ab)
+
+
+def _ground_to_pixels(forward_azimuth,
+                      distance,
+                      plane_height,
+                      pitch_rad,
+                      roll_rad,
+                      yaw_rad,
+                      image_width,
+                      image_height,
+                      tan_angle_div_2_horiz,
+                      tan_angle_div_2_vert,
+                      point_height,
+                      distortion=()):
+    """
+    The math of GeoReference.pointOnImage() on numpy arrays, starting
+    from the forward azimuth (in radians) and distance from the plane
+    to each point. Every argument other than distortion (the lens
+    distortion of CameraSpecs, shared by all entries) may be a scalar
+    or an array; they're broadcast against each other so this can
+    project many points into one image or one point into many images at
+    once.
+
+    Returns a tuple of (pixel_x, pixel_y, valid) arrays.
+    """
+    if point_height is None:
+        point_height = 0
+    arrays = np.broadcast_arrays(*[
+        np.asarray(value, dtype=np.float64)
+        for value in (forward_azimuth, distance, plane_height, pitch_rad,
+                      roll_rad, yaw_rad, image_width, image_height,
+                      tan_angle_div_2_horiz, tan_angle_div_2_vert,
+                      point_height)
+    ])
+    (forward_azimuth, distance, plane_height, pitch_rad, roll_rad, yaw_rad,
+     image_width, image_height, tan_angle_div_2_horiz, tan_angle_div_2_vert,
+     point_height) = arrays
+
+    phi = forward_azimuth - yaw_rad
+
+    distance_x = distance * np.sin(phi)
+    distance_y = distance * np.cos(phi)
+
+    height_above_point = plane_height - np.nan_to_num(point_height)
+    pitch = np.arctan2(distance_y, height_above_point)
+    roll = -np.arctan2(distance_x, height_above_point)
+
+    normalized_x = _distort(
+        np.tan(roll - roll_rad) / tan_angle_div_2_horiz, distortion)
+    normalized_y = _distort(
+        np.tan(pitch - pitch_rad) / tan_angle_div_2_vert, distortion)
+    pixel_x = (1 - normalized_x) * image_width / 2
+    pixel_y = (1 - normalized_y) * image_height / 2
+
+    valid = ((plane_height > 0) & (pixel_x >= 0) & (pixel_x < image_width) &
+             (pixel_y >= 0) & (pixel_y < image_height))
+    # np.where rather than assigning, since 0-d inputs give numpy scalars
+    return np.where(valid, pixel_x, np.nan), np.where(valid, pixel_y,
+                                                      np.nan), valid
+
+
+def point_on_images(georeferences, plane_locations, orientations,
+                    point_location):
+    """
+    Projects a single position into many images at once. The three
+    sequences describe one image per entry: the GeoReference for its
+    camera, and the plane location and orientation when it was taken.
+
+    Returns a tuple of (pixel_x, pixel_y, valid) numpy arrays with one
+    entry per image, like GeoReference.pointsOnImage().
+    """
+    cameras = [georeference.camera for georeference in georeferences]
+    count = len(cameras)
+    forward_azimuth, _, distance = geod.inv(
+        [location.lon for location in plane_locations],
+        [location.lat for location in plane_locations],
+        np.full(count, point_location.lon), np.full(count, point_location.lat))
+    forward_azimuth = np.radians(forward_azimuth)
+    distance = np.asarray(distance)
+    plane_height = np.array([location.height for location in plane_locations])
+    pitch_rad = np.array(
+        [orientation.pitch_rad for orientation in orientations])
+    roll_rad = np.array([orientation.roll_rad for orientation in orientations])
+    yaw_rad = np.array([orientation.yaw_rad for orientation in orientations])
+    image_width = np.array([camera.image_width for camera in cameras])
+    image_height = np.array([camera.image_height for camera in cameras])
+    tan_angle_div_2_horiz = np.array(
+        [camera.tan_angle_div_2_horiz for camera in cameras])
+    tan_angle_div_2_vert = np.array(
+        [camera.tan_angle_div_2_vert for camera in cameras])
+
+    # Adjusting the point's height for the terrain, one lookup per DEM
+    point_height = np.full(count, float(point_location.height or 0))
+    dems = [georeference.dem for georeference in georeferences]
+    plane_lats = np.array([location.lat for location in plane_locations])
+    plane_lons = np.array([location.lon for location in plane_locations])
+    for dem in set(dems) - {None}:
+        group = np.array([other is dem for other in dems])
+        ground_below = dem.elevation(plane_lats[group], plane_lons[group])
+        point_height[group] += np.nan_to_num(
+            dem.elevation(point_location.lat, point_location.lon) -
+            ground_below)
+
+    pixel_x = np.full(count, np.nan)
+    pixel_y = np.full(count, np.nan)
+    valid = np.zeros(count, dtype=bool)
+
+    # Cameras with different lens distortion need their own pass (normally there's just one)
+    distortions = [camera.distortion for camera in cameras]
+    for distortion in set(distortions):
+        group = np.array([other == distortion for other in distortions])
+        pixel_x[group], pixel_y[group], valid[group] = _ground_to_pixels(
+            forward_azimuth[group], distance[group], plane_height[group],
+            pitch_rad[group], roll_rad[group], yaw_rad[group],
+            image_width[group], image_height[group],
+            tan_angle_div_2_horiz[group], tan_angle_div_2_vert[group],
+            point_height[group], distortion)
+    return pixel_x, pixel_y, valid
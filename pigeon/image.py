@@ -5,9 +5,19 @@ Provides tools for importing images.
 import queue
 import os
 import logging
+import collections
+import concurrent.futures
+import multiprocessing
+import threading
+import time
+import weakref
 from math import degrees
 
-from pigeon import geo
+import numpy as np
+
+from pigeon import geo, dem
+from pigeon.manifest import ImageManifest
+from pigeon.settings import settings_data
 
 logger = logging.getLogger(__name__)
 
@@ -16,10 +26,73 @@ supported_image_formats = [
 ]
 supported_info_formats = ["txt"]
 
-images = {}  # Dictionary of images by id so we can avoid creating duplicates.
+# Images in memory by id so we can avoid creating duplicates. Weak so that
+# images nothing uses are freed: the image_catalog keeps track of all of them,
+# and the UI only keeps the ids of the images it isn't showing.
+images = weakref.WeakValueDictionary()
+
+
+class GeoReferenceGridCache:
+    """
+    Keeps track of the GeoReferenceGrid's held by images. When the
+    total memory used by the grids goes over the budget, the grids of
+    the least recently used images are dropped (they're rebuilt if
+    needed again).
+    """
+
+    def __init__(self, budget_megabytes=32):
+        self.budget = budget_megabytes * 1024 * 1024
+        self.nbytes = 0  # Memory currently used by the grids
+        # Image id -> (image, bytes its grid was counted as), least recently used first
+        self._images = collections.OrderedDict()
+
+    def get(self, image):
+        """
+        Returns the grid for the provided image, building it if it
+        doesn't exist yet or is out of date.
+        """
+        grid = image.georeference_grid
+        key = geo.GeoReferenceGrid.makeKey(image.camera_specs,
+                                           image.plane_position,
+                                           image.plane_orientation)
+        if grid is None or grid.key != key:
+            self.remove(image)
+            grid = geo.GeoReferenceGrid(image.georeference,
+                                        image.plane_position,
+                                        image.plane_orientation)
+            image.georeference_grid = grid
+            self.nbytes += grid.nbytes
+            self._images[image.id] = (image, grid.nbytes)
+            self._evict()
+        else:
+            self._images.move_to_end(image.id)
+        return grid
+
+    def remove(self, image):
+        """
+        Drops the grid of the provided image, if it has one.
+        """
+        _, nbytes = self._images.pop(image.id, (None, 0))
+        self.nbytes -= nbytes
+        image.georeference_grid = None
+
+    def _evict(self):
+        while self.nbytes > self.budget and len(self._images) > 1:
+            _, (image, nbytes) = self._images.popitem(last=False)
+            self.nbytes -= nbytes
+            image.georeference_grid = None
+
+
+georeference_grids = GeoReferenceGridCache()
 
 
 class Image(object):
+    # Metres of interpolation error allowed before approxGeoReferencePoint()
+    # stops using the georeference grid
+    max_grid_error = 1
+
+    pixmap_loader = None  # Set by the UI (a PixmapLoader) for the images it shows
+
     # This is static method because it doesn't need access to the instance and
     # we want to be able to call it from __new__() (when the instance doesn't
     # exist yet). It's basically just a normal function, but belonging to this
@@ -61,6 +134,43 @@ class Image(object):
         self.width = None  # Automatically set later when image read
         self.height = None  # Automatically set later when  image read
         self.georeference = None
+        self.georeference_grid = None  # Managed by georeference_grids
+
+    @classmethod
+    def fromRecord(cls,
+                   image_path,
+                   info_path,
+                   plane_position,
+                   plane_orientation,
+                   time,
+                   width=None,
+                   height=None):
+        """
+        Returns the image with the provided properties (ex. from the
+        image_catalog) without reading its info file. Returns the
+        existing instance if the image is already in memory. A new
+        instance has no pixmap_loader: the UI attaches one when it
+        needs it (see ListImageItem.image).
+        """
+        image = cls.__new__(cls, image_path)
+        if hasattr(image, "id"):
+            return image
+        image._parsePaths(image_path, info_path)
+        image.plane_position = plane_position
+        image.plane_orientation = plane_orientation
+        image.time = time
+        image.width = width
+        image.height = height
+        image.georeference = None
+        image.georeference_grid = None
+        return image
+
+    def record(self):
+        """
+        Returns the arguments of fromRecord() for this image.
+        """
+        return (self.path, self.info_path, self.plane_position,
+                self.plane_orientation, self.time)
 
     def __str__(self):
         return "Image %s" % self.name
@@ -75,6 +185,7 @@ class Image(object):
         state = self.__dict__.copy()
         state["path"] = None
         state["info_path"] = None
+        state["georeference_grid"] = None
         return state
 
     def __setstate__(self, data):
@@ -164,6 +275,14 @@ class Image(object):
         self.plane_position = geo.Position(lat, lon, height, alt)
         self.plane_orientation = geo.Orientation(pitch, roll, yaw)
 
+        # Seconds since the epoch (the info file has microseconds). Falling back
+        # on when the image was written for info files without it.
+        try:
+            self.time = float(self.info_data["time"]) / 1e6
+        except (KeyError, ValueError):
+            self.time = os.path.getmtime(self.path) if os.path.exists(
+                self.path) else None
+
     def _prepareGeo(self):
         """
         Prepares all the data needed to perform geo-referencing on
@@ -181,10 +300,17 @@ class Image(object):
         self.camera_specs = geo.CameraSpecs(self.width, self.height,
                                             field_of_view_horiz,
                                             field_of_view_vert)
-        self.georeference = geo.GeoReference(self.camera_specs)
+        # Allowing up to 5 cm of error in exchange for skipping the geodesic
+        # math for points near the plane: far below the GPS error anyway.
+        self.georeference = geo.GeoReference(
+            self.camera_specs,
+            max_local_error=0.05,
+            dem=dem.get_dem(settings_data.get("DEM Directory")))
 
     def _requireGeo(self):
-        if not self.georeference:
+        if not self.georeference or (self.camera_specs.image_width,
+                                     self.camera_specs.image_height) != (
+                                         self.width, self.height):
             self._prepareGeo()
 
     def geoReferencePoint(self, pixel_x, pixel_y):
@@ -197,6 +323,40 @@ class Image(object):
                                               self.plane_orientation, pixel_x,
                                               pixel_y)
 
+    def geoReferencePoints(self, pixel_x, pixel_y):
+        """
+        Batch version of geoReferencePoint(). Takes arrays of pixel
+        coordinates and returns numpy arrays of (lat, lon, valid). See
+        GeoReference.pointsInImage().
+        """
+        self._requireGeo()
+        return self.georeference.pointsInImage(self.plane_position,
+                                               self.plane_orientation, pixel_x,
+                                               pixel_y)
+
+    def getGeoReferenceGrid(self):
+        """
+        Returns the GeoReferenceGrid for this image, building it the
+        first time it's needed (or if the image's pose or camera changed).
+        """
+        self._requireGeo()
+        return georeference_grids.get(self)
+
+    def approxGeoReferencePoint(self, pixel_x, pixel_y):
+        """
+        Like geoReferencePoint(), but interpolated from this image's
+        georeference grid: fast enough to call on every mouse move.
+        Falls back to geoReferencePoint() where the grid has no answer
+        or, for the whole image, if the grid's error is over
+        max_grid_error (ex. oblique images showing the horizon).
+        """
+        grid = self.getGeoReferenceGrid()
+        if grid.max_error <= self.max_grid_error:
+            lat_lon = grid.pointInImage(pixel_x, pixel_y)
+            if lat_lon:
+                return geo.Position(*lat_lon)
+        return self.geoReferencePoint(pixel_x, pixel_y)
+
     def invGeoReferencePoint(self, position):
         """
         Determines the pixel that depicts the location at the provided
@@ -206,6 +366,18 @@ class Image(object):
         return self.georeference.pointOnImage(self.plane_position,
                                               self.plane_orientation, position)
 
+    def invGeoReferencePoints(self, lats, lons, heights=None):
+        """
+        Batch version of invGeoReferencePoint(). Takes arrays of
+        latitudes and longitudes (and optionally heights) and returns
+        numpy arrays of (pixel_x, pixel_y, valid). See
+        GeoReference.pointsOnImage().
+        """
+        self._requireGeo()
+        return self.georeference.pointsOnImage(self.plane_position,
+                                               self.plane_orientation, lats,
+                                               lons, heights)
+
     def getPlanePlumbPixel(self):
         """
         Returns a tuple of the x and y values of the pixel corresponding
@@ -245,15 +417,67 @@ class Image(object):
         """
         Returns a PositionCollection that describes the area of the
         ground that the picture covers.
+
+        Doesn't use the georeference grid: the four corners are a single
+        batch call, which is cheaper than building a grid for them.
         """
-        positions = []
-        corners = [(0, self.height), (self.width, self.height),
-                   (self.width, 0), (0, 0)]  # All corners of the image
-        for x, y in corners:
-            positions.append(self.geoReferencePoint(x, y))
+        corners_x = [0, self.width, self.width, 0]  # All corners of the image
+        corners_y = [self.height, self.height, 0, 0]
+        lats, lons, valid = self.geoReferencePoints(corners_x, corners_y)
+        positions = [
+            geo.Position(lat, lon) if ok else None for lat, lon, ok in zip(
+                lats.tolist(), lons.tolist(), valid.tolist())
+        ]
         return geo.PositionCollection(positions)
 
 
+def inv_georeference_point_in_images(images, position):
+    """
+    Projects a single position into each of the provided images with
+    one vectorized computation. Images which can't be geo-referenced
+    yet (ex. their size isn't known) are never valid.
+
+    Returns a tuple of (pixel_x, pixel_y, valid) numpy arrays with an
+    entry for each image.
+    """
+    ready = []
+    for image in images:
+        try:
+            image._requireGeo()
+        except Exception:
+            ready.append(False)
+        else:
+            ready.append(True)
+    ready = np.array(ready, dtype=bool)
+    pixel_x = np.full(len(ready), np.nan)
+    pixel_y = np.full(len(ready), np.nan)
+    valid = np.zeros(len(ready), dtype=bool)
+
+    geo_images = [image for image, ok in zip(images, ready) if ok]
+    if geo_images:
+        (pixel_x[ready], pixel_y[ready], valid[ready]) = geo.point_on_images(
+            [image.georeference for image in geo_images],
+            [image.plane_position for image in geo_images],
+            [image.plane_orientation for image in geo_images], position)
+    return pixel_x, pixel_y, valid
+
+
+def find_images_containing(position, candidates=None):
+    """
+    Returns a list of (image, pixel_x, pixel_y) tuples for every image
+    that depicts the provided position. Searches the images in memory
+    if no candidates are provided (see ImageCatalog.imagesContaining()
+    to search all of them).
+    """
+    if candidates is None:
+        candidates = list(images.values())
+    pixel_x, pixel_y, valid = inv_georeference_point_in_images(
+        candidates, position)
+    return [(image, x, y)
+            for image, x, y, ok in zip(candidates, pixel_x.tolist(),
+                                       pixel_y.tolist(), valid.tolist()) if ok]
+
+
 class ImageCrop:
     """
     Represents a cropped area of a particular image.
@@ -289,28 +513,320 @@ class ImageCrop:
         return (self.max_x, self.max_y)
 
 
+def read_image_record(paths):
+    """
+    Reads the info file of an image. Returns the arguments of
+    Image.fromRecord() for it (ex. to make the image in another
+    process), or an exception if it couldn't be read.
+
+    paths - tuple of the image's path and its info file's path
+    """
+    image_path, info_path = paths
+    try:
+        return Image(image_path, info_path).record()
+    except Exception as e:
+        return e
+
+
 class Watcher:
-    # Empty watcher class
-    # This will have to be replaced by something else as we no longer use pyinotify
+    """
+    Watches a directory for images and their info files (with the same
+    name), putting an Image in the queue once both are there.
+
+    Polls instead of relying on OS notifications: the directory is only
+    listed again when its modification time changes, which is when
+    files are added or removed, so an idle poll is a single stat().
+    Files are only used once they haven't been modified for
+    settle_seconds, so that they aren't read while being written.
+
+    Images already in a directory are imported in bulk by
+    loadExistingImages(): their info files are read in a process pool
+    (when there are enough of them to be worth it) and the images are
+    put in the queue as they're read, so they show up progressively.
+
+    The poses read from info files are added to the directory's
+    ImageManifest, so that when the directory is loaded again only the
+    info files that are new (or changed) need reading.
+    """
 
-    def __init__(self):
-        # this is still defined as some components rely on these variables
-        self.queue = queue.Queue()
+    poll_interval = 0.5  # Seconds
+    settle_seconds = 0.5
+    coarse_mtime_seconds = 2
+    pool_threshold = 256  # Images needed to use a process pool for bulk imports
+    pool_chunk_size = 64
+
+    def __init__(self, image_queue=None, directory=None):
+        self.queue = image_queue if image_queue is not None else queue.Queue()
+        # Name (without extension) -> path, of the images waiting for their
+        # info file and of the info files waiting for their image
         self.pending_images = {}
         self.pending_infos = {}
+        self.directory = None
+        self._directory_mtime = None
+        self._seen = set()  # Paths of the files listed already
+        # Directories whose existing images are to be imported
+        self._imports = queue.Queue()
+        self._stopping = threading.Event()
+        self._thread = None
+        # Directory -> ImageManifest, or None if it can't be used
+        self._manifests = {}
+        if directory:
+            self.setDirectory(directory)
 
-    # no-op old Watcher class methods
     def createImage(self, image_pathname, info_pathname):
-        pass
+        """
+        Makes the Image of the provided files and puts it in the queue.
+        Returns whether it could be made.
+        """
+        try:
+            image = Image(image_pathname, info_pathname)
+        except Exception as e:
+            logger.warning("Failed to import image %s: %s" %
+                           (image_pathname, e))
+            return False
+        self.queue.put(image)
+        self._remember(os.path.dirname(info_pathname), [image.record()])
+        return True
 
     def loadExistingImages(self, path):
-        pass
+        """
+        Imports the images already in the provided directory, in the
+        background once the watcher has started. Images without an info
+        file yet are imported when it shows up (if path is the
+        directory being watched).
+        """
+        self._imports.put(path)
 
     def setDirectory(self, path):
-        pass
+        """
+        Starts watching the provided directory. Only the files added
+        from now on are imported (see loadExistingImages()).
+        """
+        self.directory = path
+        self.pending_images = {}
+        self.pending_infos = {}
+        self._seen = set(path for path, _ in self._scan(path))
+        self._directory_mtime = self._modified(path)
 
     def start(self):
-        pass
+        """
+        Starts watching (and importing) in a background thread.
+        """
+        if self._thread:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
 
     def stop(self):
-        pass
+        """
+        Stops watching, cancelling any bulk import in progress.
+        """
+        if not self._thread:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                while True:
+                    self._importExisting(self._imports.get(block=False))
+            except queue.Empty:
+                pass
+            try:
+                self._poll()
+            except OSError as e:
+                logger.warning("Failed to check %s for new images: %s" %
+                               (self.directory, e))
+            self._stopping.wait(self.poll_interval)
+
+    def _poll(self):
+        """
+        Lists the directory if it changed, then imports the images
+        that have both of their files ready.
+        """
+        if not self.directory:
+            return
+        modified = self._modified(self.directory)
+        now = time.time()
+        # Listing again while the modification time is recent too, in case the
+        # filesystem's timestamps are too coarse (ex. FAT on SD cards) to change
+        # between two files added in a row
+        if modified != self._directory_mtime or (
+                modified and now - modified / 1e9 < self.coarse_mtime_seconds):
+            self._directory_mtime = modified
+            for path, kind in self._scan(self.directory):
+                if path not in self._seen:
+                    self._seen.add(path)
+                    self._addPending(path, kind)
+
+        for name in list(self.pending_images.keys()
+                         & self.pending_infos.keys()):
+            image_path = self.pending_images[name]
+            info_path = self.pending_infos[name]
+            try:
+                settled = max(
+                    os.path.getmtime(image_path),
+                    os.path.getmtime(info_path)) + self.settle_seconds
+            except OSError:
+                # Removed or renamed: forgetting it until it's listed again
+                del self.pending_images[name]
+                del self.pending_infos[name]
+                self._seen -= {image_path, info_path}
+                continue
+            if settled <= now:
+                del self.pending_images[name]
+                del self.pending_infos[name]
+                self.createImage(image_path, info_path)
+
+    def _importExisting(self, directory):
+        """
+        Imports the images with an info file in the provided directory
+        (oldest first), reading the info files in a process pool if
+        there are many.
+        """
+        images_found = {}
+        infos_found = {}
+        for path, kind in self._scan(directory):
+            found = images_found if kind == "image" else infos_found
+            found[Image.parseFilePath(path)[2]] = path
+        if directory == self.directory:
+            for name, path in images_found.items():
+                if name not in infos_found:
+                    self.pending_images[name] = path
+        pairs = sorted(((images_found[name], infos_found[name])
+                        for name in images_found.keys() & infos_found.keys()),
+                       key=lambda pair: self._modified(pair[0]) or 0)
+        manifest = self._manifest(directory)
+        if manifest is not None:
+            unread = []
+            for image_path, info_path in pairs:
+                record = manifest.get(image_path, info_path)
+                if record:
+                    self.queue.put(Image.fromRecord(*record))
+                else:
+                    unread.append((image_path, info_path))
+            logger.info("Imported %s existing images from the manifest of %s" %
+                        (len(pairs) - len(unread), directory))
+            pairs = unread
+        logger.info("Importing %s existing images from %s" %
+                    (len(pairs), directory))
+
+        imported = 0
+        if len(pairs) >= self.pool_threshold:
+            imported = self._importInPool(directory, pairs)
+        records = []
+        for image_path, info_path in pairs[imported:]:
+            if self._stopping.is_set():
+                break
+            try:
+                image = Image(image_path, info_path)
+            except Exception as e:
+                logger.warning("Failed to import image %s: %s" %
+                               (image_path, e))
+                continue
+            self.queue.put(image)
+            records.append(image.record())
+        self._remember(directory, records)
+
+    def _importInPool(self, directory, pairs):
+        """
+        Reads the info files of the (image path, info path) pairs in a
+        process pool, putting the images in the queue as they're read.
+        Returns how many pairs were handled: fewer than all of them if
+        the pool failed.
+        """
+        handled = 0
+        records = []
+        try:
+            # Spawning rather than forking, since this process has threads (ex. the UI's)
+            with concurrent.futures.ProcessPoolExecutor(
+                    mp_context=multiprocessing.get_context(
+                        "spawn")) as executor:
+                results = executor.map(read_image_record,
+                                       pairs,
+                                       chunksize=self.pool_chunk_size)
+                for (image_path, _), record in zip(pairs, results):
+                    if self._stopping.is_set():
+                        executor.shutdown(cancel_futures=True)
+                        handled = len(pairs)
+                        break
+                    handled += 1
+                    if isinstance(record, Exception):
+                        logger.warning("Failed to import image %s: %s" %
+                                       (image_path, record))
+                        continue
+                    self.queue.put(Image.fromRecord(*record))
+                    records.append(record)
+        except (OSError, concurrent.futures.BrokenExecutor) as e:
+            logger.warning(
+                "Process pool failed, importing the rest of the images without it: %s"
+                % e)
+        self._remember(directory, records)
+        return handled
+
+    def _manifest(self, directory):
+        """
+        Returns the ImageManifest of the provided directory, or None if
+        it can't be read.
+        """
+        if directory not in self._manifests:
+            try:
+                self._manifests[directory] = ImageManifest(directory)
+            except (OSError, ValueError) as e:
+                logger.warning("Can't use the image manifest of %s: %s" %
+                               (directory, e))
+                self._manifests[directory] = None
+        return self._manifests[directory]
+
+    def _remember(self, directory, records):
+        """
+        Adds the records (arguments of Image.fromRecord()) to the
+        manifest of the provided directory.
+        """
+        manifest = self._manifest(directory)
+        if manifest is None or not records:
+            return
+        try:
+            manifest.append(records)
+        except OSError as e:
+            logger.warning("Can't add to the image manifest of %s: %s" %
+                           (directory, e))
+            self._manifests[directory] = None
+
+    def _addPending(self, path, kind):
+        name = Image.parseFilePath(path)[2]
+        if kind == "image":
+            self.pending_images[name] = path
+        else:
+            self.pending_infos[name] = path
+
+    def _scan(self, directory):
+        """
+        Returns a list of (path, "image" or "info") of the files in the
+        directory with a supported extension.
+        """
+        files = []
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return files
+        for entry in entries:
+            extension = os.path.splitext(entry.name)[1][1:].lower()
+            if extension in supported_image_formats:
+                kind = "image"
+            elif extension in supported_info_formats:
+                kind = "info"
+            else:
+                continue
+            if entry.is_file():
+                files.append((entry.path, kind))
+        return files
+
+    def _modified(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
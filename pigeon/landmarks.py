@@ -0,0 +1,333 @@
+"""
+Index of points of interest on the ground with known positions: the
+surveyed ground control points (GCPs) and targets marked by the
+operator.
+"""
+
+import heapq
+import json
+import logging
+
+import numpy as np
+
+from pigeon import geo
+
+logger = logging.getLogger(__name__)
+
+GROUND_CONTROL_POINT = "Ground Control Point"
+TARGET = "Target"
+
+
+class KDTree:
+    """
+    Static k-d tree over an array of points, for nearest neighbour,
+    radius and box queries in O(log n) (for well spread out points).
+
+    Built once with median splits along the widest dimension of each
+    node. Points are stored sorted by leaf so that each leaf is a
+    contiguous slice that can be checked with numpy all at once.
+    Returned indices refer to the rows of the points passed in.
+    """
+
+    leaf_size = 16
+
+    def __init__(self, points):
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim != 2:
+            raise ValueError("Points must be a 2D array (one row per point).")
+        order = np.arange(len(points))
+
+        # Nodes are stored as parallel lists; children of -1 mark a leaf
+        starts, ends, dims, splits, lefts, rights = [], [], [], [], [], []
+        stack = [(0, len(points), None, None)]  # (start, end, parent, is_left)
+        while stack:
+            start, end, parent, is_left = stack.pop()
+            node = len(starts)
+            if parent is not None:
+                (lefts if is_left else rights)[parent] = node
+            starts.append(start)
+            ends.append(end)
+            lefts.append(-1)
+            rights.append(-1)
+            if end - start <= self.leaf_size:
+                dims.append(0)
+                splits.append(0.0)
+                continue
+            values = points[order[start:end]]
+            dim = int(np.argmax(values.max(axis=0) - values.min(axis=0)))
+            middle = (start + end) // 2
+            partition = np.argpartition(values[:, dim], middle - start)
+            order[start:end] = order[start:end][partition]
+            dims.append(dim)
+            splits.append(float(points[order[middle], dim]))
+            stack.append((middle, end, node, False))
+            stack.append((start, middle, node, True))
+
+        self.order = order
+        self.points = points[order]
+        self._starts = starts
+        self._ends = ends
+        self._dims = dims
+        self._splits = splits
+        self._lefts = lefts
+        self._rights = rights
+
+    def __len__(self):
+        return len(self.points)
+
+    def nearest(self, point, k=1):
+        """
+        Returns a list of up to k (distance, index) tuples of the points
+        nearest to the provided point, nearest first.
+        """
+        point = np.asarray(point, dtype=np.float64)
+        if not len(self.points) or k < 1:
+            return []
+        # Max heap (by negated squared distance) of the k nearest so far
+        best = []
+        # (node, squared distance to the node's side of its parent's split)
+        stack = [(0, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if len(best) == k and bound >= -best[0][0]:
+                continue  # Can't have anything nearer than what's been found
+            if self._lefts[node] < 0:
+                start, end = self._starts[node], self._ends[node]
+                distances = np.sum((self.points[start:end] - point)**2, axis=1)
+                for offset, distance in enumerate(distances.tolist()):
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, start + offset))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, start + offset))
+                continue
+            difference = point[self._dims[node]] - self._splits[node]
+            near, far = ((self._lefts[node],
+                          self._rights[node]) if difference <= 0 else
+                         (self._rights[node], self._lefts[node]))
+            # Pushing the far side first so that the near side is searched first
+            stack.append((far, difference * difference))
+            stack.append((near, 0.0))
+        return [(float(np.sqrt(-distance)), int(self.order[index]))
+                for distance, index in sorted(best, reverse=True)]
+
+    def withinRadius(self, point, radius):
+        """
+        Returns a list of (distance, index) tuples of the points within
+        radius of the provided point, nearest first.
+        """
+        point = np.asarray(point, dtype=np.float64)
+        found = []
+        stack = [0] if len(self.points) else []
+        while stack:
+            node = stack.pop()
+            if self._lefts[node] < 0:
+                start, end = self._starts[node], self._ends[node]
+                distances = np.sqrt(
+                    np.sum((self.points[start:end] - point)**2, axis=1))
+                for offset in np.flatnonzero(distances <= radius).tolist():
+                    found.append((float(distances[offset]), start + offset))
+                continue
+            difference = point[self._dims[node]] - self._splits[node]
+            if difference <= radius:
+                stack.append(self._lefts[node])
+            if difference >= -radius:
+                stack.append(self._rights[node])
+        found.sort()
+        return [(distance, int(self.order[index]))
+                for distance, index in found]
+
+    def withinBox(self, minimums, maximums):
+        """
+        Returns a list of the indices of the points inside the box with
+        the provided minimum and maximum corners.
+        """
+        minimums = np.asarray(minimums, dtype=np.float64)
+        maximums = np.asarray(maximums, dtype=np.float64)
+        found = []
+        stack = [0] if len(self.points) else []
+        while stack:
+            node = stack.pop()
+            if self._lefts[node] < 0:
+                start, end = self._starts[node], self._ends[node]
+                points = self.points[start:end]
+                inside = np.all((points >= minimums) & (points <= maximums),
+                                axis=1)
+                found.extend(self.order[start:end][inside].tolist())
+                continue
+            dim = self._dims[node]
+            if minimums[dim] <= self._splits[node]:
+                stack.append(self._lefts[node])
+            if maximums[dim] >= self._splits[node]:
+                stack.append(self._rights[node])
+        return found
+
+
+class Landmark:
+    """
+    A named point of interest on the ground.
+    """
+
+    def __init__(self, name, position, kind=TARGET):
+        self.name = name
+        self.position = position
+        self.kind = kind
+
+    def __str__(self):
+        return "%s (%s) at %s" % (self.name, self.kind, self.position)
+
+
+class LandmarkIndex:
+    """
+    Spatial index of Landmarks, for finding the ones near a position or
+    visible in an image without solving a geodesic for every landmark.
+
+    Landmarks are placed in a LocalFrame (metres east and north)
+    anchored at the first landmark added, and distances are measured in
+    that frame: plenty accurate over the area of a mission. The k-d
+    tree is rebuilt the next time it's needed after landmarks are added
+    or removed, which is cheap for the number of landmarks involved.
+
+    Not thread safe: use from a single thread (the UI thread).
+    """
+
+    def __init__(self):
+        self.frame = None
+        self._landmarks = {}  # Name -> Landmark
+        self._tree = None
+        # Landmarks in the order of the tree's points
+        self._tree_landmarks = []
+
+    def __len__(self):
+        return len(self._landmarks)
+
+    def __iter__(self):
+        return iter(list(self._landmarks.values()))
+
+    def __contains__(self, name):
+        return name in self._landmarks
+
+    def get(self, name):
+        """
+        Returns the landmark with the provided name, or None.
+        """
+        return self._landmarks.get(name)
+
+    def add(self, landmark):
+        """
+        Adds (or replaces, if the name is taken) a landmark.
+        """
+        if not self.frame:
+            self.frame = geo.LocalFrame(landmark.position.lat,
+                                        landmark.position.lon)
+        self._landmarks[landmark.name] = landmark
+        self._tree = None
+
+    def addTarget(self, name, position):
+        """
+        Adds a target marked by the operator. Returns the Landmark.
+        """
+        landmark = Landmark(name, position, TARGET)
+        self.add(landmark)
+        return landmark
+
+    def remove(self, name):
+        """
+        Removes the landmark with the provided name, if present.
+        """
+        if self._landmarks.pop(name, None) is not None:
+            self._tree = None
+
+    def loadGroundControlPoints(self, path):
+        """
+        Adds the GCPs from a JSON file mapping names to [lat, lon]
+        (ex. data/ground_control_points.json). Returns how many were
+        loaded.
+        """
+        with open(path) as gcp_file:
+            data = json.load(gcp_file)
+        for name, (lat, lon) in data.items():
+            self.add(
+                Landmark(name, geo.Position(float(lat), float(lon)),
+                         GROUND_CONTROL_POINT))
+        logger.info("Loaded %s ground control points from %s" %
+                    (len(data), path))
+        return len(data)
+
+    def nearest(self, position, k=1):
+        """
+        Returns a list of up to k (distance, Landmark) tuples of the
+        landmarks nearest the provided position, nearest first.
+        """
+        tree = self._requireTree()
+        if not tree:
+            return []
+        return [(distance, self._tree_landmarks[index])
+                for distance, index in tree.nearest(
+                    self.frame.fromLatLon(position.lat, position.lon), k)]
+
+    def withinRadius(self, position, radius):
+        """
+        Returns a list of (distance, Landmark) tuples of the landmarks
+        within radius metres of the provided position, nearest first.
+        """
+        tree = self._requireTree()
+        if not tree:
+            return []
+        return [(distance, self._tree_landmarks[index])
+                for distance, index in tree.withinRadius(
+                    self.frame.fromLatLon(position.lat, position.lon), radius)]
+
+    def visibleIn(self, image):
+        """
+        Returns a list of (Landmark, pixel_x, pixel_y) tuples of the
+        landmarks that appear in the provided image.
+
+        Candidates are found with the tree from the bounding box of the
+        image's footprint, then all projected into the image at once.
+        """
+        tree = self._requireTree()
+        if not tree:
+            return []
+        try:
+            outline = image.getImageOutline()
+        except Exception as e:
+            logger.debug("Can't find landmarks in %s: %s" % (image, e))
+            return []
+        if None in outline.positions:
+            # Part of the image shows the sky
+            candidates = list(range(len(self._tree_landmarks)))
+        else:
+            corners = np.array([
+                self.frame.fromLatLon(position.lat, position.lon)
+                for position in outline.positions
+            ])
+            candidates = tree.withinBox(corners.min(axis=0),
+                                        corners.max(axis=0))
+        if not candidates:
+            return []
+
+        landmarks = [self._tree_landmarks[index] for index in candidates]
+        pixel_x, pixel_y, valid = image.invGeoReferencePoints(
+            [landmark.position.lat for landmark in landmarks],
+            [landmark.position.lon for landmark in landmarks],
+            [landmark.position.height or 0 for landmark in landmarks])
+        return [(landmark, x, y) for landmark, x, y, ok in zip(
+            landmarks, pixel_x.tolist(), pixel_y.tolist(), valid.tolist())
+                if ok]
+
+    def _requireTree(self):
+        """
+        Returns the k-d tree of the landmarks, rebuilding it if they
+        changed. None if there aren't any.
+        """
+        if self._tree is None and self._landmarks:
+            self._tree_landmarks = list(self._landmarks.values())
+            self._tree = KDTree([
+                self.frame.fromLatLon(landmark.position.lat,
+                                      landmark.position.lon)
+                for landmark in self._tree_landmarks
+            ])
+        return self._tree
+
+
+landmarks = LandmarkIndex()  # GCPs and targets shown in the UI
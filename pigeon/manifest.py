@@ -0,0 +1,162 @@
+"""
+Keeps the metadata of the images in a directory in a single file, so
+that reloading the directory doesn't need every info file parsed again.
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from pigeon import geo
+
+logger = logging.getLogger(__name__)
+
+# One row per image. Info files are identified by their name, modification
+# time and size, so that a changed one is parsed again.
+record_dtype = np.dtype([
+    ("info_name", "S255"),  # UTF-8
+    ("info_modified", "<i8"),  # In nanoseconds
+    ("info_size", "<i8"),
+    ("time", "<f8"),  # NaN if unknown
+    ("lat", "<f8"),
+    ("lon", "<f8"),
+    ("height", "<f8"),
+    ("alt", "<f8"),
+    ("pitch", "<f8"),
+    ("roll", "<f8"),
+    ("yaw", "<f8"),
+])
+
+
+class ImageManifest:
+    """
+    The poses of the images of a directory (what the images' info files
+    are parsed into), stored in a file in the directory as an array of
+    fixed size records (a NumPy structured array). Rows are appended, so
+    adding an image is a small write, and loading is one sequential
+    read. If an info file changed, its newer row replaces the older one
+    when loading. Once most rows are replaced ones, the file is
+    rewritten with only the latest.
+
+    Info files whose names are longer than a record can hold (255 bytes
+    as UTF-8) aren't kept, so that names are never cut short.
+
+    Not thread safe: use from a single thread (ex. the Watcher's).
+    """
+
+    filename = ".pigeon_manifest_v1"
+    min_compact_rows = 1024  # Replaced rows allowed before rewriting, at least
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, self.filename)
+        self._records = {}  # Info file name -> latest record for it
+        self._rows = 0  # Rows in the file, including replaced ones
+        self.load()
+
+    def __len__(self):
+        return len(self._records)
+
+    def load(self):
+        """
+        Reads the manifest file, if there is one.
+        """
+        try:
+            with open(self.path, "rb") as manifest_file:
+                data = manifest_file.read()
+        except FileNotFoundError:
+            data = b""
+        # Ignoring a partly written last row (ex. after a crash)
+        count = len(data) // record_dtype.itemsize
+        records = np.frombuffer(data, dtype=record_dtype, count=count)
+        self._records = dict(zip(records["info_name"].tolist(), records))
+        self._rows = count
+        logger.debug("Loaded %s records from %s" % (count, self.path))
+
+    def get(self, image_path, info_path):
+        """
+        Returns the arguments of Image.fromRecord() for the provided
+        image, or None if the manifest doesn't have it or its info file
+        changed since.
+        """
+        record = self._records.get(self._key(info_path))
+        if record is None:
+            return None
+        try:
+            info_stat = os.stat(info_path)
+        except OSError:
+            return None
+        if (info_stat.st_mtime_ns != record["info_modified"]
+                or info_stat.st_size != record["info_size"]):
+            return None
+        time = float(record["time"])
+        return (image_path, info_path,
+                geo.Position(float(record["lat"]), float(record["lon"]),
+                             float(record["height"]), float(record["alt"])),
+                geo.Orientation(float(record["pitch"]), float(record["roll"]),
+                                float(record["yaw"])),
+                None if np.isnan(time) else time)
+
+    def append(self, records):
+        """
+        Adds rows for the provided images, described by the arguments
+        of Image.fromRecord() (ex. from Image.record()). Images whose
+        info file can't be found anymore, or whose name is too long,
+        are skipped.
+        """
+        rows = []
+        for _, info_path, position, orientation, time in records:
+            key = self._key(info_path)
+            if key is None:
+                logger.warning("Not adding %s to the manifest: its name is "
+                               "too long" % info_path)
+                continue
+            try:
+                info_stat = os.stat(info_path)
+            except OSError:
+                continue
+            rows.append((key, info_stat.st_mtime_ns, info_stat.st_size,
+                         np.nan if time is None else time, position.lat,
+                         position.lon, position.height, position.alt,
+                         orientation.pitch, orientation.roll, orientation.yaw))
+        if not rows:
+            return
+        rows = np.array(rows, dtype=record_dtype)
+        with open(self.path, "ab") as manifest_file:
+            # Appending after the last whole row, in case a write was cut short
+            manifest_file.truncate(manifest_file.tell() //
+                                   record_dtype.itemsize *
+                                   record_dtype.itemsize)
+            manifest_file.seek(0, os.SEEK_END)
+            manifest_file.write(rows.tobytes())
+        self._records.update(zip(rows["info_name"].tolist(), rows))
+        self._rows += len(rows)
+
+        replaced = self._rows - len(self._records)
+        if replaced > max(len(self._records), self.min_compact_rows):
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrites the file with only the latest row of each info file.
+        The new file replaces the old one at once, so a crash leaves
+        one or the other.
+        """
+        rows = np.array(list(self._records.values()), dtype=record_dtype)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "wb") as manifest_file:
+            manifest_file.write(rows.tobytes())
+        os.replace(temporary_path, self.path)
+        logger.debug("Compacted %s from %s to %s records" %
+                     (self.path, self._rows, len(rows)))
+        self._rows = len(rows)
+
+    def _key(self, info_path):
+        """
+        Returns the key of the provided info file in the manifest (its
+        name as UTF-8), or None if the name is too long to be stored.
+        """
+        key = os.path.basename(info_path).encode()
+        if len(key) > record_dtype["info_name"].itemsize:
+            return None
+        return key
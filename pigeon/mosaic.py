@@ -0,0 +1,432 @@
+"""
+Builds an orthomosaic (a map stitched together from the images) on a
+web mercator tile pyramid while images arrive.
+
+Warping an image onto the tiles it covers is done in worker processes.
+The resulting tiles are blended into the mosaic on a background thread
+that also serves rendered tiles, so the UI thread only has to draw
+them. Communication with the UI is through the engine's updates queue.
+"""
+
+import collections
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+from math import pi
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+tile_size = 256  # Pixels along each side of a tile
+max_latitude = 85.05112878  # Web mercator's limit
+earth_radius = 6378137  # Radius used by web mercator (metres)
+
+
+def lat_lon_to_tile(lat, lon, zoom):
+    """
+    Returns the (fractional) web mercator tile coordinates (x, y) of
+    the provided latitudes and longitudes (scalars or arrays).
+    """
+    count = 2**zoom
+    lat = np.radians(np.clip(lat, -max_latitude, max_latitude))
+    x = (np.asarray(lon) + 180) / 360 * count
+    y = (1 - np.arcsinh(np.tan(lat)) / pi) / 2 * count
+    return x, y
+
+
+def tile_to_lat_lon(x, y, zoom):
+    """
+    Returns the latitudes and longitudes of the provided (fractional)
+    tile coordinates. The inverse of lat_lon_to_tile().
+    """
+    count = 2**zoom
+    lon = np.asarray(x) / count * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(pi * (1 - 2 * np.asarray(y) / count))))
+    return lat, lon
+
+
+def ground_resolution(lat, zoom):
+    """
+    Returns the size of a tile's pixel on the ground (metres) at the
+    provided latitude and zoom level.
+    """
+    return 2 * pi * earth_radius * np.cos(
+        np.radians(lat)) / (tile_size * 2**zoom)
+
+
+def warp_image(path, georeference, location, orientation, zoom, max_tiles=64):
+    """
+    Warps the image at path onto the tiles it covers at the provided
+    zoom level. Runs in a worker process, so everything needed is
+    passed in (rather than the Image).
+
+    Each tile's pixels are traced back into the image with the
+    vectorized inverse geo-reference. Pixels are weighted by how far
+    they are from the edge of the image so that overlapping images
+    blend into each other without visible seams.
+
+    Returns a list of (x, y, color_sum, weight) tuples: the weighted
+    sum of colours (tile_size x tile_size x 3) and the sum of the
+    weights (tile_size x tile_size) for each tile touched.
+    """
+    from PIL import Image as PILImage  # Only needed in the workers
+
+    camera = georeference.camera
+    width, height = camera.image_width, camera.image_height
+
+    # The tiles touched, from the outline of the image (some of which might be sky)
+    steps = np.linspace(0, 1, 17)
+    edge_x = np.concatenate(
+        [steps, np.ones_like(steps), steps[::-1],
+         np.zeros_like(steps)]) * width
+    edge_y = np.concatenate(
+        [np.zeros_like(steps), steps,
+         np.ones_like(steps), steps[::-1]]) * height
+    lats, lons, valid = georeference.pointsInImage(location, orientation,
+                                                   edge_x, edge_y)
+    if not valid.any():
+        return []
+    tile_x, tile_y = lat_lon_to_tile(lats[valid], lons[valid], zoom)
+    x_range = range(int(np.floor(tile_x.min())),
+                    int(np.floor(tile_x.max())) + 1)
+    y_range = range(int(np.floor(tile_y.min())),
+                    int(np.floor(tile_y.max())) + 1)
+    if len(x_range) * len(y_range) > max_tiles:
+        logger.info("Not adding %s to the mosaic: covers too many tiles (%s)" %
+                    (path, len(x_range) * len(y_range)))
+        return []
+
+    # Decoding at a reduced size when the tiles can't show the detail anyway
+    footprint = np.hypot(np.ptp(tile_x), np.ptp(tile_y)) * tile_size
+    image_pixels_per_tile_pixel = np.hypot(width, height) / max(footprint, 1)
+    with PILImage.open(path) as image:
+        reduction = 1
+        while reduction < 8 and reduction * 2 <= image_pixels_per_tile_pixel:
+            reduction *= 2
+        image.draft("RGB",
+                    (image.width // reduction,
+                     image.height // reduction))  # Only JPEGs support this
+        pixels = np.asarray(image.convert("RGB"))
+    scale_x = pixels.shape[1] / width
+    scale_y = pixels.shape[0] / height
+    feather = min(width, height) / 2
+
+    centres = np.arange(tile_size) + 0.5
+    results = []
+    for x in x_range:
+        for y in y_range:
+            pixel_lat, pixel_lon = tile_to_lat_lon(
+                x + centres[np.newaxis, :] / tile_size,
+                y + centres[:, np.newaxis] / tile_size, zoom)
+            pixel_x, pixel_y, valid = georeference.pointsOnImage(
+                location, orientation, pixel_lat, pixel_lon)
+            if not valid.any():
+                continue
+            pixel_x = np.where(valid, pixel_x, 0)
+            pixel_y = np.where(valid, pixel_y, 0)
+            weight = np.minimum(np.minimum(pixel_x, width - pixel_x),
+                                np.minimum(pixel_y, height - pixel_y))
+            weight = np.where(valid, np.clip(weight / feather, 1e-3, 1), 0)
+
+            rows = np.clip((pixel_y * scale_y).astype(int), 0,
+                           pixels.shape[0] - 1)
+            columns = np.clip((pixel_x * scale_x).astype(int), 0,
+                              pixels.shape[1] - 1)
+            color_sum = pixels[rows, columns] * weight[..., np.newaxis]
+            results.append((x, y, color_sum.astype(np.float32),
+                            weight.astype(np.float32)))
+    return results
+
+
+def render_tile(color_sum, weight):
+    """
+    Returns the RGBA (uint8) pixels of a tile from its accumulated
+    colours and weights. Transparent where nothing has been added.
+    """
+    rgba = np.zeros((tile_size, tile_size, 4), dtype=np.uint8)
+    covered = weight > 0
+    rgba[covered, :3] = np.clip(
+        color_sum[covered] / weight[covered, np.newaxis] + 0.5, 0, 255)
+    rgba[covered, 3] = 255
+    return rgba
+
+
+class TileStore:
+    """
+    Accumulated colours and weights of tiles (keyed by (zoom, x, y)),
+    keeping at most max_tiles in memory. The least recently used tiles
+    are written to the directory when evicted and read back as needed.
+    The directory is scratch space: see clear().
+    """
+
+    def __init__(self, directory, max_tiles=64):
+        self.directory = directory
+        self.max_tiles = max_tiles
+        # Key -> [color_sum, weight, dirty], least recently used first
+        self._tiles = collections.OrderedDict()
+
+    def get(self, key, create=False):
+        """
+        Returns the (color_sum, weight) of the tile, reading it from
+        disk if needed. None if the tile doesn't exist (or an empty
+        tile if create is set).
+        """
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            return tile[0], tile[1]
+        path = self._path(key)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                tile = [data["color_sum"], data["weight"], False]
+        elif create:
+            tile = [
+                np.zeros((tile_size, tile_size, 3), dtype=np.float32),
+                np.zeros((tile_size, tile_size), dtype=np.float32), True
+            ]
+        else:
+            return None
+        self._tiles[key] = tile
+        self._evict()
+        return tile[0], tile[1]
+
+    def put(self, key, color_sum, weight):
+        """
+        Replaces the tile's contents.
+        """
+        self._tiles[key] = [color_sum, weight, True]
+        self._tiles.move_to_end(key)
+        self._evict()
+
+    def markChanged(self, key):
+        """
+        Marks a tile returned by get() that was modified in place as
+        needing to be saved.
+        """
+        self._tiles[key][2] = True
+
+    def clear(self):
+        """
+        Removes every tile, in memory and on disk.
+        """
+        self._tiles.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def flush(self):
+        """
+        Writes all modified tiles to disk.
+        """
+        for key, tile in self._tiles.items():
+            if tile[2]:
+                self._save(key, tile)
+
+    def _evict(self):
+        while len(self._tiles) > self.max_tiles:
+            key, tile = self._tiles.popitem(last=False)
+            if tile[2]:
+                self._save(key, tile)
+
+    def _save(self, key, tile):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, color_sum=tile[0], weight=tile[1])
+        tile[2] = False
+
+    def _path(self, key):
+        zoom, x, y = key
+        return os.path.join(self.directory, str(zoom), str(x), "%d.npz" % y)
+
+
+class MosaicEngine:
+    """
+    Builds the mosaic in the background. Images are warped at the base
+    zoom level by a pool of worker processes; the tiles of the other
+    levels of the pyramid (down to min_zoom) are built from the base
+    tiles when they're requested after a change.
+
+    Use addImage() to add images and requestTiles() to ask for rendered
+    tiles. Both return immediately: results come through the updates
+    queue as tuples of either:
+        ("changed", set of tile keys) - tiles that should be requested
+                again if shown
+        ("tiles", list of (key, rgba array)) - requested tiles that
+                have something in them
+    Tile keys are (zoom, x, y) tuples.
+
+    The mosaic is of the images added in this session: the tiles left
+    in the directory by an earlier run are cleared when the engine
+    first starts, since its images are added again (ex. by "Load
+    Existing Images") and would otherwise be blended in twice.
+    """
+
+    def __init__(self,
+                 directory=os.path.join("data", "mosaic"),
+                 zoom=19,
+                 min_zoom=13,
+                 max_memory_tiles=64,
+                 workers=None):
+        self.directory = directory
+        self.zoom = zoom
+        self.min_zoom = min_zoom
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.store = TileStore(directory, max_memory_tiles)
+        self.updates = queue.Queue()
+
+        self._commands = queue.Queue()
+        # Keys of pyramid tiles that need rebuilding from their children
+        self._stale = set()
+        self._executor = None
+        self._thread = None
+        self._cleared = False  # Whether the tiles of earlier runs were cleared
+
+    def start(self):
+        """
+        Starts the worker processes and the blending thread, if they
+        aren't already running. The first time, clears the tiles left
+        by an earlier run.
+        """
+        if self._thread:
+            return
+        if not self._cleared:
+            self.store.clear()
+            self._stale.clear()
+            self._cleared = True
+        # Spawning rather than forking, since this process has threads (ex. the UI's)
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self._thread = threading.Thread(target=self._run,
+                                        name="MosaicEngine",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the workers (dropping images not yet warped) and saves
+        the tiles in memory.
+        """
+        if not self._thread:
+            return
+        self._commands.put(("stop", None))
+        self._thread.join()
+        self._executor.shutdown(cancel_futures=True)
+        self._thread = None
+        self._executor = None
+        self.store.flush()
+
+    def addImage(self, image):
+        """
+        Queues the provided image to be added to the mosaic. The image
+        must be saved to disk and be able to be geo-referenced.
+        """
+        if not image.path:
+            return
+        self.start()
+        image._requireGeo()
+        future = self._executor.submit(warp_image, image.path,
+                                       image.georeference,
+                                       image.plane_position,
+                                       image.plane_orientation, self.zoom)
+        future.image = image
+        future.add_done_callback(lambda future: self._commands.put(
+            ("warped", future)))
+
+    def requestTiles(self, keys):
+        """
+        Asks for the provided tiles to be rendered and put on the
+        updates queue.
+        """
+        self.start()
+        self._commands.put(("request", list(keys)))
+
+    def _run(self):
+        while True:
+            command, argument = self._commands.get()
+            if command == "stop":
+                break
+            try:
+                if command == "warped":
+                    self._blend(argument)
+                elif command == "request":
+                    self._render(argument)
+            except Exception:
+                logger.exception("Mosaic failed to handle %s" % command)
+
+    def _blend(self, future):
+        """
+        Adds the warped tiles of an image to the mosaic.
+        """
+        try:
+            warped = future.result()
+        except concurrent.futures.CancelledError:
+            return
+        except Exception as e:
+            logger.warning("Couldn't add %s to the mosaic: %s" %
+                           (future.image, e))
+            return
+
+        changed = set()
+        for x, y, color_sum, weight in warped:
+            key = (self.zoom, x, y)
+            tile_color_sum, tile_weight = self.store.get(key, create=True)
+            tile_color_sum += color_sum
+            tile_weight += weight
+            self.store.markChanged(key)
+            changed.add(key)
+
+            # Everything above this tile in the pyramid is now out of date
+            for zoom in range(self.zoom - 1, self.min_zoom - 1, -1):
+                x //= 2
+                y //= 2
+                self._stale.add((zoom, x, y))
+                changed.add((zoom, x, y))
+        if changed:
+            self.updates.put(("changed", changed))
+
+    def _render(self, keys):
+        rendered = []
+        for key in keys:
+            tile = self._tile(key)
+            if tile is not None:
+                rendered.append((key, render_tile(*tile)))
+        if rendered:
+            self.updates.put(("tiles", rendered))
+
+    def _tile(self, key):
+        """
+        Returns the (color_sum, weight) of a tile, rebuilding it from
+        its children first if it's out of date. None if it's empty.
+        """
+        zoom, x, y = key
+        if zoom > self.zoom or zoom < self.min_zoom:
+            return None
+        if zoom == self.zoom or key not in self._stale:
+            return self.store.get(key)
+
+        # Each child becomes a quarter of this tile, summing each 2x2 block of pixels
+        half = tile_size // 2
+        color_sum = np.zeros((tile_size, tile_size, 3), dtype=np.float32)
+        weight = np.zeros((tile_size, tile_size), dtype=np.float32)
+        for dx in (0, 1):
+            for dy in (0, 1):
+                child = self._tile((zoom + 1, 2 * x + dx, 2 * y + dy))
+                if child is None:
+                    continue
+                child_color_sum, child_weight = child
+                rows = slice(dy * half, (dy + 1) * half)
+                columns = slice(dx * half, (dx + 1) * half)
+                color_sum[rows, columns] = child_color_sum.reshape(
+                    half, 2, half, 2, 3).sum(axis=(1, 3))
+                weight[rows,
+                       columns] = child_weight.reshape(half, 2, half,
+                                                       2).sum(axis=(1, 3))
+        self._stale.discard(key)
+        self.store.put(key, color_sum, weight)
+        return color_sum, weight
+
+
+mosaic_engine = MosaicEngine()  # Mosaic of all images shown in the UI
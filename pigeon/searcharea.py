@@ -0,0 +1,236 @@
+"""
+Keeps track of which parts of the area to be searched have been
+photographed.
+"""
+
+import json
+import logging
+
+import numpy as np
+
+from pigeon import geo
+
+logger = logging.getLogger(__name__)
+
+
+def points_in_polygon(x, y, vertices):
+    """
+    Returns a boolean array of whether each point is inside the polygon
+    (even-odd rule). Vectorized over the points, which is where the
+    numbers are: polygons here only have a handful of vertices.
+
+    x, y - arrays of the coordinates of the points
+    vertices - array with one row of (x, y) per vertex of the polygon
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    vertices = np.asarray(vertices, dtype=np.float64)
+    inside = np.zeros(np.broadcast(x, y).shape, dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for (x1, y1), (x2, y2) in zip(vertices, np.roll(vertices, -1, axis=0)):
+            crosses = (y1 > y) != (y2 > y)
+            crossing_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+            inside ^= crosses & (x < crossing_x)
+    return inside
+
+
+class SearchArea:
+    """
+    The area the operator wants searched, rasterized into a grid of
+    square cells (in a LocalFrame, metres east and north) that are
+    marked covered as the footprints of images come in.
+
+    Marking a footprint only tests the cells in its bounding box, so it
+    costs the same on the hundredth image as on the first, unlike
+    subtracting every footprint from the search polygon. The price is
+    that areas are only accurate to a cell.
+
+    Not thread safe: use from a single thread (the UI thread).
+    """
+
+    def __init__(self, outline, cell_size=5):
+        """
+        outline - PositionCollection of the area (holes are excluded)
+        cell_size - width of the cells, in metres
+        """
+        self.outline = outline
+        self.cell_size = cell_size
+        self.frame = geo.LocalFrame(*outline.center().latLon())
+
+        exterior = self._toLocal(outline.positions)
+        holes = [
+            self._toLocal(interior)
+            for interior in outline.interior_positions_list or []
+        ]
+        self.origin = exterior.min(axis=0)  # South west corner of the grid
+        columns, rows = np.maximum(
+            np.ceil((exterior.max(axis=0) - self.origin) / cell_size),
+            1).astype(int)
+
+        east, north = self.cellCenters(
+            np.arange(rows)[:, np.newaxis],
+            np.arange(columns)[np.newaxis, :])
+        self.inside = points_in_polygon(east, north, exterior)
+        for hole in holes:
+            self.inside &= ~points_in_polygon(east, north, hole)
+        self.covered = np.zeros_like(self.inside)  # Only ever set inside
+        self._inside_count = int(np.count_nonzero(self.inside))
+        self._covered_count = 0
+        self.version = 0  # Incremented on every change, ex. to know when to redraw
+
+    @classmethod
+    def load(cls, path, cell_size=5):
+        """
+        Returns the SearchArea outlined in a JSON file of a list of
+        [lat, lon] vertices.
+        """
+        with open(path) as search_area_file:
+            data = json.load(search_area_file)
+        if len(data) < 3:
+            raise ValueError("A search area needs at least 3 vertices.")
+        return cls(
+            geo.PositionCollection(
+                [geo.Position(float(lat), float(lon)) for lat, lon in data]),
+            cell_size)
+
+    @property
+    def shape(self):
+        """
+        The (rows, columns) of the grid. Row 0 is the southern edge.
+        """
+        return self.inside.shape
+
+    def cellCenters(self, rows, columns):
+        """
+        Returns the east and north coordinates of the centres of cells.
+        """
+        east = self.origin[0] + (columns + 0.5) * self.cell_size
+        north = self.origin[1] + (rows + 0.5) * self.cell_size
+        return east, north
+
+    def insert(self, image, outline=None):
+        """
+        Marks the footprint of the provided image covered. Returns how
+        many cells were newly covered (0 if the footprint couldn't be
+        determined, ex. part of the image shows the sky). The image's
+        outline can be provided if it's already known (see
+        Image.getImageOutline()).
+        """
+        try:
+            outline = outline or image.getImageOutline()
+        except Exception as e:
+            logger.debug("Can't add footprint of %s to search area: %s" %
+                         (image, e))
+            return 0
+        if None in outline.positions:
+            return 0
+        return self.insertPolygon(
+            [position.latLon() for position in outline.positions])
+
+    def insertPolygon(self, lat_lons):
+        """
+        Marks a footprint described by a list of (lat, lon) tuples
+        covered. Returns how many cells were newly covered.
+        """
+        lats, lons = np.array(lat_lons, dtype=np.float64).T
+        vertices = np.column_stack(self.frame.fromLatLon(lats, lons))
+        rows, columns = self.shape
+        first_column, first_row = np.clip(
+            np.floor((vertices.min(axis=0) - self.origin) / self.cell_size), 0,
+            (columns, rows)).astype(int)
+        last_column, last_row = np.clip(
+            np.ceil((vertices.max(axis=0) - self.origin) / self.cell_size), 0,
+            (columns, rows)).astype(int)
+        if first_row >= last_row or first_column >= last_column:
+            return 0
+
+        window = (slice(first_row, last_row), slice(first_column, last_column))
+        east, north = self.cellCenters(
+            np.arange(first_row, last_row)[:, np.newaxis],
+            np.arange(first_column, last_column)[np.newaxis, :])
+        newly_covered = (points_in_polygon(east, north, vertices)
+                         & self.inside[window] & ~self.covered[window])
+        count = int(np.count_nonzero(newly_covered))
+        if count:
+            self.covered[window] |= newly_covered
+            self._covered_count += count
+            self.version += 1
+        return count
+
+    def area(self):
+        """
+        Returns the (exact) area to be searched, in square metres.
+        """
+        return self.outline.area()
+
+    def coveredFraction(self):
+        """
+        Returns the fraction of the area that's been photographed.
+        """
+        if not self._inside_count:
+            return 0
+        return self._covered_count / self._inside_count
+
+    def coveredArea(self):
+        """
+        Returns the area that's been photographed, in square metres.
+        """
+        return self._covered_count * self.cell_size**2
+
+    def uncoveredArea(self):
+        """
+        Returns the area that's yet to be photographed, in square
+        metres.
+        """
+        return (self._inside_count - self._covered_count) * self.cell_size**2
+
+    def uncoveredMask(self):
+        """
+        Returns a boolean array (see shape) of the cells that are in
+        the area and haven't been photographed.
+        """
+        return self.inside & ~self.covered
+
+    def uncoveredCells(self):
+        """
+        Returns the latitudes and longitudes (as arrays) of the centres
+        of the cells that haven't been photographed.
+        """
+        rows, columns = np.nonzero(self.uncoveredMask())
+        return self.frame.toLatLon(*self.cellCenters(rows, columns))
+
+    def nearestUncovered(self, position):
+        """
+        Returns (distance in metres, Position) of the centre of the
+        closest cell to the provided position that hasn't been
+        photographed, or None if everything has been.
+        """
+        rows, columns = np.nonzero(self.uncoveredMask())
+        if not rows.size:
+            return None
+        east, north = self.cellCenters(rows, columns)
+        x, y = self.frame.fromLatLon(position.lat, position.lon)
+        distances = np.hypot(east - x, north - y)
+        nearest = int(np.argmin(distances))
+        return (float(distances[nearest]),
+                geo.Position(*self.frame.toLatLon(float(east[nearest]),
+                                                  float(north[nearest]))))
+
+    def corners(self):
+        """
+        Returns the latitudes and longitudes (as arrays) of the south
+        west, south east, north east and north west corners of the
+        grid, ex. for drawing the mask.
+        """
+        rows, columns = self.shape
+        west, south = self.origin
+        east = west + columns * self.cell_size
+        north = south + rows * self.cell_size
+        return self.frame.toLatLon(np.array([west, east, east, west]),
+                                   np.array([south, south, north, north]))
+
+    def _toLocal(self, positions):
+        return np.array([
+            self.frame.fromLatLon(position.lat, position.lon)
+            for position in positions
+        ])
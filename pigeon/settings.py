@@ -9,10 +9,17 @@ import logging
 location = os.path.join("data", "settings.json")
 default_settings_data = {
     "Load Existing Images": True,
+    "Image Directory": "data/images",
     "Follow Images": True,
     "Feature Export Path": "data/exports",
     "UAV Device": "tcp:127.0.0.1:14551",
     "GCS Device": "tcpin:127.0.0.1:14550",
+    "DEM Directory": "",
+    "Ground Control Points": "data/ground_control_points.json",
+    "Search Area": "",
+    "Build Mosaic": True,
+    "Pixmap Cache Megabytes": "512",
+    "Thumbnail Cache": "data/thumbnails.sqlite",
 }
 
 settings_data = default_settings_data.copy()  # Global settings data.
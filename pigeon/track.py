@@ -0,0 +1,192 @@
+"""
+Keeps the positions reported by the plane, for drawing its flight path.
+"""
+
+import logging
+import time
+from math import floor, log2
+from threading import Lock
+
+import numpy as np
+
+from pigeon import geo
+
+logger = logging.getLogger(__name__)
+
+# Columns of the chunks
+TIME = 0
+LAT = 1
+LON = 2
+ALT = 3
+
+
+def simplify(points, tolerance):
+    """
+    Douglas-Peucker simplification of a polyline. Returns the (sorted)
+    indices of the points to keep so that no point that's dropped is
+    further than tolerance from the simplified line. The first and
+    last points are always kept.
+
+    points - array with one row of (x, y) per point
+    """
+    count = len(points)
+    if count < 3:
+        return np.arange(count)
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        offsets = points[start + 1:end] - points[start]
+        direction = points[end] - points[start]
+        length = np.hypot(*direction)
+        if length > 0:
+            distances = np.abs(offsets[:, 0] * direction[1] -
+                               offsets[:, 1] * direction[0]) / length
+        else:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        furthest = int(np.argmax(distances))
+        if distances[furthest] > tolerance:
+            middle = start + 1 + furthest
+            keep[middle] = True
+            stack.append((start, middle))
+            stack.append((middle, end))
+    return np.flatnonzero(keep)
+
+
+class FlightTrack:
+    """
+    The positions reported by the plane, in the order they arrived.
+
+    Positions are appended into fixed size NumPy chunks, so a long
+    flight never has to be copied into a bigger array. For drawing,
+    simplified() returns the track with detail that wouldn't be visible
+    at a given tolerance removed. The simplifications are cached per
+    level of detail (tolerances are rounded down to a power of 2
+    metres) and per chunk: a chunk that is full never changes, so only
+    the last one needs simplifying again after positions are appended.
+
+    append() may be called from any thread (ex. the UAV's event loop).
+    simplified() should only be called from a single thread (the UI
+    thread).
+    """
+
+    def __init__(self, chunk_size=4096):
+        self.chunk_size = chunk_size
+        self.frame = None  # LocalFrame anchored at the first position, for measuring
+        self.version = 0  # Incremented on every change, ex. to know when to redraw
+        self._lock = Lock()
+        self._chunks = []  # Arrays of chunk_size rows of (time, lat, lon, alt)
+        self._count = 0
+        # Level -> list of (lats, lons) simplifications of the full chunks
+        self._full_lods = {}
+        # Level -> (count, lats, lons) simplification of the last chunk
+        self._last_lods = {}
+        # Level -> (count, lats, lons) of the whole track
+        self._lods = {}
+
+    def __len__(self):
+        return self._count
+
+    def append(self, lat, lon, alt, timestamp=None):
+        """
+        Adds a position (altitude in metres) reported at the provided
+        time (seconds since the epoch, by default now).
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            if not self.frame:
+                self.frame = geo.LocalFrame(lat, lon)
+            row = self._count % self.chunk_size
+            if row == 0:
+                self._chunks.append(np.empty((self.chunk_size, 4)))
+            self._chunks[-1][row] = (timestamp, lat, lon, alt)
+            self._count += 1
+            self.version += 1
+
+    def clear(self):
+        """
+        Forgets every position.
+        """
+        with self._lock:
+            self.frame = None
+            self._chunks = []
+            self._count = 0
+            self._full_lods = {}
+            self._last_lods = {}
+            self._lods = {}
+            self.version += 1
+
+    def latest(self):
+        """
+        Returns the last (time, lat, lon, alt) reported, or None.
+        """
+        with self._lock:
+            if not self._count:
+                return None
+            return tuple(self._chunks[-1][(self._count - 1) %
+                                          self.chunk_size].tolist())
+
+    def positions(self):
+        """
+        Returns an array with one row of (time, lat, lon, alt) per
+        position (a copy).
+        """
+        chunks, count = self._snapshot()
+        if not chunks:
+            return np.empty((0, 4))
+        return np.concatenate(chunks)[:count]
+
+    def simplified(self, tolerance):
+        """
+        Returns the latitudes and longitudes (as arrays) of the track
+        simplified so that it's off by at most tolerance metres.
+        """
+        chunks, count = self._snapshot()
+        level = floor(log2(max(tolerance, 1e-3)))
+        cached = self._lods.get(level)
+        if cached and cached[0] == count:
+            return cached[1], cached[2]
+        if not chunks:
+            return np.empty(0), np.empty(0)
+
+        tolerance = 2.0**level
+        full_count = count // self.chunk_size
+        full = self._full_lods.setdefault(level, [])
+        while len(full) < full_count:
+            full.append(self._simplifyChunk(chunks[len(full)], tolerance))
+        parts = list(full)
+        if full_count < len(chunks):
+            last = self._last_lods.get(level)
+            if not last or last[0] != count:
+                last = (count, *self._simplifyChunk(
+                    chunks[-1][:count % self.chunk_size], tolerance))
+                self._last_lods[level] = last
+            parts.append(last[1:])
+
+        lats = np.concatenate([lats for lats, _ in parts])
+        lons = np.concatenate([lons for _, lons in parts])
+        self._lods[level] = (count, lats, lons)
+        return lats, lons
+
+    def _snapshot(self):
+        """
+        Returns the chunks and the number of positions in them. Only
+        the rows before the count are safe to read.
+        """
+        with self._lock:
+            return list(self._chunks), self._count
+
+    def _simplifyChunk(self, chunk, tolerance):
+        """
+        Returns the latitudes and longitudes of the points of a chunk
+        kept by simplify().
+        """
+        east, north = self.frame.fromLatLon(chunk[:, LAT], chunk[:, LON])
+        keep = simplify(np.column_stack((east, north)), tolerance)
+        return chunk[keep, LAT], chunk[keep, LON]
+
+
+flight_track = FlightTrack()  # Positions reported by the UAV
@@ -2,9 +2,13 @@ from PyQt6 import QtCore, QtWidgets
 
 translate = QtCore.QCoreApplication.translate
 
-from pigeon.ui.common import ImageArea
+from pigeon.ui.areas.imageview import ImageView
+from pigeon.ui.areas.mapview import MapView
 
 from pigeon.image import Image
+from pigeon.landmarks import landmarks
+from pigeon.mosaic import mosaic_engine
+from pigeon.track import flight_track
 
 
 class ImageMapArea(QtWidgets.QWidget):
@@ -41,7 +45,7 @@ class ImageMapArea(QtWidgets.QWidget):
         image_layout = QtWidgets.QVBoxLayout(image_tab)
         image_tab.setLayout(image_layout)
 
-        self.image_area = ImageArea(interactive=True)
+        self.image_area = ImageView()
         size_policy = QtWidgets.QSizePolicy(
             QtWidgets.QSizePolicy.Policy.Ignored,
             QtWidgets.QSizePolicy.Policy.Ignored)
@@ -49,8 +53,23 @@ class ImageMapArea(QtWidgets.QWidget):
         size_policy.setVerticalStretch(100)
         self.image_area.setSizePolicy(size_policy)
         self.image_area.setMinimumSize(QtCore.QSize(50, 50))
-        self.image_area.setAlignment(QtCore.Qt.AlignmentFlag.AlignHCenter)
         image_layout.addWidget(self.image_area)
+        self.image_area.clicked.connect(self._imageClicked)
+        self.image_area.right_clicked.connect(self._imageRightClicked)
+
+        # Showing the position on the ground under the cursor
+        self.cursor_position_label = QtWidgets.QLabel()
+        self.cursor_position_label.setAlignment(
+            QtCore.Qt.AlignmentFlag.AlignHCenter)
+        image_layout.addWidget(self.cursor_position_label)
+        self.image_area.setMouseTracking(True)
+        self.image_area.cursor_moved.connect(self._showCursorPosition)
+
+        # Listing the GCPs and targets that should be visible in the image
+        self.landmarks_label = QtWidgets.QLabel()
+        self.landmarks_label.setAlignment(QtCore.Qt.AlignmentFlag.AlignHCenter)
+        self.landmarks_label.setWordWrap(True)
+        image_layout.addWidget(self.landmarks_label)
 
         self.image = None
 
@@ -58,6 +77,9 @@ class ImageMapArea(QtWidgets.QWidget):
         map_layout = QtWidgets.QVBoxLayout(map_tab)
         map_tab.setLayout(map_layout)
 
+        self.map_view = MapView(mosaic=mosaic_engine, track=flight_track)
+        map_layout.addWidget(self.map_view)
+
         tab_widget.addTab(map_tab, translate("ImageMapArea", "Map"))
         tab_widget.addTab(image_tab, translate("ImageMapArea", "Image"))
 
@@ -69,23 +91,41 @@ class ImageMapArea(QtWidgets.QWidget):
     def showImage(self, image):
         self.image = image
         self.image_area.setPixmap(image.pixmap_loader)
+        self._showLandmarks()
         self.imageChanged.emit()
 
+    def _showCursorPosition(self, point):
+        """
+        Updates the readout of the position under the cursor. Uses the
+        image's georeference grid since this runs on every mouse move.
+        """
+        try:
+            position = self.image.approxGeoReferencePoint(point.x(), point.y())
+        except Exception:
+            position = None  # Ex. no image yet or it can't be geo-referenced
+        self.cursor_position_label.setText(
+            position.dispLatLon() if position else "")
+
+    def _showLandmarks(self):
+        """
+        Updates the list of landmarks (GCPs and targets) in the image.
+        """
+        names = sorted(landmark.name
+                       for landmark, _, _ in landmarks.visibleIn(self.image))
+        if names:
+            self.landmarks_label.setText(
+                translate("ImageMapArea", "In view: %s") % ", ".join(names))
+        else:
+            self.landmarks_label.setText("")
+
     def getImage(self):
         """Gets the current image being displayed"""
         return self.image
 
-    def mouseReleaseEvent(self, event):
-        """
-        Called by Qt when the user releases clicks on the image.
+    def _imageClicked(self, point):
+        if self.image:
+            self.image_clicked.emit(self.image, point)
 
-        Emitting an image_right_clicked event with the point if it was a
-        right click.
-        """
-        try:
-            point = QtCore.QPoint(event.x(), event.y())
-            point = self.image_area.pointOnOriginal(point)
-            if event.button() == QtCore.Qt.LeftButton and point:
-                self.image_clicked.emit(self.image, point)
-        except AttributeError:
-            pass
+    def _imageRightClicked(self, point):
+        if self.image:
+            self.image_right_clicked.emit(self.image, point)
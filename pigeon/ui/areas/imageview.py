@@ -0,0 +1,407 @@
+from PyQt6 import QtCore, QtGui, QtWidgets
+
+translate = QtCore.QCoreApplication.translate
+
+import collections
+from math import floor, log2
+
+from pigeon.ui.pixmaploader import pixmap_decoder
+
+
+class ImageView(QtWidgets.QWidget):
+    """
+    Shows an image (through its PixmapLoader) fitted to the widget.
+    Zoom with the scroll wheel and pan by dragging; double click to go
+    back to fitting the image.
+
+    The whole image is drawn from a pixmap decoded at the widget's size
+    (the one the pixmap_cache and Prefetcher deal in). Once zoomed in
+    past that pixmap's resolution, the part in view is drawn from tiles
+    of tile_size pixels, decoded at the coarsest level (the image
+    scaled down by 2**level) with enough detail for the zoom. Only the
+    tiles in view are decoded and only a few more than fit in the view
+    are kept, so memory depends on the size of the widget rather than
+    of the image. Tiles are decoded in the background, with the fitted
+    pixmap scaled up in their place until they're ready.
+
+    A JPEG can only be decoded from its start, so a tile costs as much
+    as everything above its bottom edge. The missing tiles in view are
+    therefore decoded a row at a time rather than one by one.
+
+    Points are in the pixels of the original image, as with ImageArea.
+    """
+    cursor_moved = QtCore.pyqtSignal(QtCore.QPoint)
+    clicked = QtCore.pyqtSignal(QtCore.QPoint)
+    right_clicked = QtCore.pyqtSignal(QtCore.QPoint)
+
+    decode_priority = 2  # The main image is what the user is looking at
+    tile_size = 512
+    max_scale = 8  # Screen pixels per image pixel when zoomed in all the way
+    min_cached_tiles = 16
+    click_distance = 4  # Pixels the mouse may move for a press to count as a click
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pixmap_loader = None
+        self._base = None  # Pixmap of the whole image
+        self._base_request = None  # DecodeRequest of the base pixmap, if pending
+        # (level, column, row) -> QPixmap, least recently used first
+        self._tiles = collections.OrderedDict()
+        self._max_tiles = self.min_cached_tiles
+        # (level, row) -> (DecodeRequest, first column, last column) of the rows being decoded
+        self._pending = {}
+
+        self.center = QtCore.QPointF(0, 0)  # In image pixels
+        self.scale = 1  # Screen pixels per image pixel
+        self.fit = True  # Whether to keep fitting the view to the image
+        self._drag_start = None
+        self._press_position = None
+        self._dragging = False  # Whether the mouse moved far enough to pan
+
+        self.setMinimumSize(QtCore.QSize(50, 50))
+        self.setAutoFillBackground(True)
+
+    def setPixmap(self, pixmap_loader):
+        """
+        Shows the image of the provided PixmapLoader, fitted.
+        """
+        self._cancelDecoding()
+        self._tiles.clear()
+        self.pixmap_loader = pixmap_loader
+        self.fit = True
+        self._base = None
+        self._requestBase()
+        self.update()
+
+    def imageRect(self):
+        """
+        Returns the QRectF of the image, in image pixels.
+        """
+        if not self.pixmap_loader:
+            return QtCore.QRectF()
+        return QtCore.QRectF(0, 0, self.pixmap_loader.width(),
+                             self.pixmap_loader.height())
+
+    def pointOnOriginal(self, point):
+        """
+        Given a point on this widget's parent, returns a QPoint
+        object describing the location on the original pixmap at this
+        point, or None if it's not on the image.
+        """
+        return self._mapPointToOriginal(self.mapFromParent(point))
+
+    def pointOnDisplay(self, point, offset):
+        """
+        Given a point on the original pixmap, returns a QPoint
+        object describing the location on this widget's parent, or
+        None if it's not on the image.
+        """
+        if not self.imageRect().contains(QtCore.QPointF(point)):
+            return None
+        return self.mapToParent(self._transform().map(
+            QtCore.QPointF(point)).toPoint()) + offset
+
+    def _mapPointToOriginal(self, point):
+        """
+        Maps a point on the widget to the original pixmap. Returns None
+        if the point isn't on the image.
+        """
+        if not self.pixmap_loader:
+            return None
+        inverse, _ = self._transform().inverted()
+        mapped = inverse.map(QtCore.QPointF(point))
+        rect = self.imageRect()
+        if not rect.contains(mapped):
+            return None
+        return QtCore.QPoint(min(int(mapped.x()),
+                                 int(rect.width()) - 1),
+                             min(int(mapped.y()),
+                                 int(rect.height()) - 1))
+
+    def _fitScale(self):
+        rect = self.imageRect()
+        if rect.isEmpty():
+            return 1
+        return min(self.width() / rect.width(), self.height() / rect.height())
+
+    def _fitView(self):
+        self.center = self.imageRect().center()
+        self.scale = self._fitScale()
+
+    def _transform(self):
+        """
+        Returns the QTransform from image pixels to widget pixels.
+        """
+        transform = QtGui.QTransform()
+        transform.translate(self.width() / 2, self.height() / 2)
+        transform.scale(self.scale, self.scale)
+        transform.translate(-self.center.x(), -self.center.y())
+        return transform
+
+    def _requestBase(self):
+        """
+        Requests the pixmap of the whole image at the widget's size,
+        showing a placeholder until it's decoded.
+        """
+        if not self.pixmap_loader or self.size().isEmpty():
+            return
+        if self._base_request:
+            self._base_request.cancel()
+        self._base_request = self.pixmap_loader.requestPixmapForSize(
+            self.size(), self._baseDecoded, self.decode_priority)
+        if self._base_request:
+            self._base = self.pixmap_loader.placeholderForSize(self.size())
+
+    def _baseDecoded(self, pixmap):
+        self._base_request = None
+        if pixmap is None:
+            return  # Keeping the placeholder: the tiles can still be decoded
+        self._base = pixmap
+        self.update()
+
+    def _cancelDecoding(self):
+        if self._base_request:
+            self._base_request.cancel()
+            self._base_request = None
+        for request, _, _ in self._pending.values():
+            request.cancel()
+        self._pending.clear()
+
+    def _visibleTiles(self):
+        """
+        Returns the level with enough detail for the zoom and a list of
+        the (level, column, row) of its tiles in view. Returns
+        (None, []) if the base pixmap has enough detail.
+        """
+        if not self._base or self._base_request:
+            return None, []
+        rect = self.imageRect()
+        if self.scale <= self._base.width() / rect.width() * 1.01:
+            return None, []
+        level = max(floor(log2(1 / self.scale)), 0)
+        inverse, _ = self._transform().inverted()
+        visible = inverse.mapRect(QtCore.QRectF(self.rect())).intersected(rect)
+        if visible.isEmpty():
+            return None, []
+
+        level_size = self.pixmap_loader.levelSize(level)
+        # Image pixels per tile
+        tile_width = self.tile_size * rect.width() / level_size.width()
+        tile_height = self.tile_size * rect.height() / level_size.height()
+        columns = range(
+            int(visible.left() // tile_width),
+            min(int(-(-visible.right() // tile_width)),
+                -(-level_size.width() // self.tile_size)))
+        rows = range(
+            int(visible.top() // tile_height),
+            min(int(-(-visible.bottom() // tile_height)),
+                -(-level_size.height() // self.tile_size)))
+        return level, [(level, column, row) for row in rows
+                       for column in columns]
+
+    def _tileRect(self, level, column, row):
+        """
+        Returns the QRect of a tile in the pixels of its level.
+        """
+        level_size = self.pixmap_loader.levelSize(level)
+        left = column * self.tile_size
+        top = row * self.tile_size
+        return QtCore.QRect(left, top,
+                            min(self.tile_size,
+                                level_size.width() - left),
+                            min(self.tile_size,
+                                level_size.height() - top))
+
+    def _requestTiles(self, level, keys):
+        """
+        Requests the missing tiles (of the provided level) in view, a
+        row of them at a time. Rows being decoded that aren't in view
+        anymore are cancelled.
+        """
+        missing = collections.defaultdict(list)
+        for key in keys:
+            if key not in self._tiles:
+                missing[key[2]].append(key[1])
+        for row_key in list(self._pending):
+            request, _, _ = self._pending[row_key]
+            if row_key[0] != level or row_key[1] not in missing:
+                request.cancel()
+                del self._pending[row_key]
+
+        for row, columns in missing.items():
+            first, last = min(columns), max(columns)
+            pending = self._pending.get((level, row))
+            if pending:
+                _, pending_first, pending_last = pending
+                if pending_first <= first and last <= pending_last:
+                    continue
+                pending[0].cancel()
+                first = min(first, pending_first)
+                last = max(last, pending_last)
+            rect = self._tileRect(level, first,
+                                  row).united(self._tileRect(level, last, row))
+            request = pixmap_decoder.decodeRegion(
+                self.pixmap_loader,
+                level,
+                rect,
+                lambda image, level=level, row=row, first=first: self.
+                _rowDecoded(level, row, first, image),
+                self.decode_priority)
+            self._pending[(level, row)] = (request, first, last)
+
+    def _rowDecoded(self, level, row, first, image):
+        """
+        Splits a decoded row of tiles into the tile cache. If it
+        couldn't be decoded, it's requested again the next time it's
+        drawn.
+        """
+        self._pending.pop((level, row), None)
+        if image is None:
+            return
+        for column in range(first,
+                            first + -(-image.width() // self.tile_size)):
+            rect = self._tileRect(level, column, row)
+            rect.moveLeft(rect.left() - first * self.tile_size)
+            rect.moveTop(0)
+            self._tiles[(level, column,
+                         row)] = QtGui.QPixmap.fromImage(image.copy(rect))
+        while len(self._tiles) > self._max_tiles:
+            self._tiles.popitem(last=False)
+        self.update()
+
+    def _drawTiles(self, painter):
+        """
+        Draws the tiles in view that are decoded, requesting the ones
+        that are missing.
+        """
+        level, keys = self._visibleTiles()
+        self._max_tiles = max(2 * len(keys), self.min_cached_tiles)
+        self._requestTiles(level, keys)
+        if not keys:
+            return
+        rect = self.imageRect()
+        level_size = self.pixmap_loader.levelSize(level)
+        x_scale = rect.width() / level_size.width()
+        y_scale = rect.height() / level_size.height()
+        for key in keys:
+            pixmap = self._tiles.get(key)
+            if pixmap is None:
+                continue
+            self._tiles.move_to_end(key)
+            tile_rect = self._tileRect(*key)
+            painter.drawPixmap(
+                QtCore.QRectF(tile_rect.left() * x_scale,
+                              tile_rect.top() * y_scale,
+                              tile_rect.width() * x_scale,
+                              tile_rect.height() * y_scale), pixmap,
+                QtCore.QRectF(pixmap.rect()))
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        if not self.pixmap_loader:
+            painter.drawText(self.rect(), QtCore.Qt.AlignmentFlag.AlignCenter,
+                             translate("ImageView", "NO IMAGE RECEIVED YET"))
+            painter.end()
+            return
+        if self.fit:
+            self._fitView()
+
+        painter.setRenderHint(QtGui.QPainter.RenderHint.SmoothPixmapTransform)
+        painter.setTransform(self._transform())
+        if self._base:
+            painter.drawPixmap(self.imageRect(), self._base,
+                               QtCore.QRectF(self._base.rect()))
+        self._drawTiles(painter)
+        painter.end()
+
+    def resizeEvent(self, resize_event):
+        if not self.pixmap_loader:
+            return
+        fitted = self.pixmap_loader.size().scaled(
+            self.size(), QtCore.Qt.AspectRatioMode.KeepAspectRatio)
+        if (self._base_request or not self._base
+                or fitted.width() > self._base.width()):
+            self._requestBase()  # Need a bigger pixmap
+
+    def wheelEvent(self, event):
+        """
+        Zooms in or out, keeping the point under the cursor in place.
+        """
+        if not self.pixmap_loader:
+            return
+        point = event.position()
+        inverse, _ = self._transform().inverted()
+        before = inverse.map(point)
+        fit_scale = self._fitScale()
+        self.scale = min(
+            max(self.scale * 1.25**(event.angleDelta().y() / 120), fit_scale),
+            max(self.max_scale, fit_scale))
+        self.fit = self.scale == fit_scale
+        inverse, _ = self._transform().inverted()
+        self.center += before - inverse.map(point)
+        self._clampCenter()
+        self.update()
+
+    def _clampCenter(self):
+        """
+        Keeps the image from being panned out of view.
+        """
+        rect = self.imageRect()
+        self.center = QtCore.QPointF(
+            min(max(self.center.x(), rect.left()), rect.right()),
+            min(max(self.center.y(), rect.top()), rect.bottom()))
+
+    def mousePressEvent(self, event):
+        self._drag_start = event.position()
+        self._press_position = event.position()
+        self._dragging = False
+
+    def mouseMoveEvent(self, event):
+        """
+        Pans while a button is held down. Emits cursor_moved with the
+        point on the original pixmap under the cursor (enable mouse
+        tracking to get this without a button held down).
+        """
+        point = self._mapPointToOriginal(event.position())
+        if point:
+            self.cursor_moved.emit(point)
+        if self._drag_start is None:
+            return
+        if not self._dragging:
+            if (event.position() - self._press_position
+                ).manhattanLength() < self.click_distance:
+                return  # Not a drag (yet)
+            self._dragging = True
+        self.fit = False
+        delta = event.position() - self._drag_start
+        self._drag_start = event.position()
+        self.center -= delta / self.scale
+        self._clampCenter()
+        self.update()
+
+    def mouseReleaseEvent(self, event):
+        """
+        Emits clicked or right_clicked with the point on the original
+        pixmap, unless the mouse was dragged.
+        """
+        pressed = self._press_position
+        dragged = self._dragging
+        self._drag_start = None
+        self._press_position = None
+        self._dragging = False
+        if pressed is None or dragged:
+            return
+        point = self._mapPointToOriginal(event.position())
+        if not point:
+            return
+        if event.button() == QtCore.Qt.MouseButton.LeftButton:
+            self.clicked.emit(point)
+        elif event.button() == QtCore.Qt.MouseButton.RightButton:
+            self.right_clicked.emit(point)
+
+    def mouseDoubleClickEvent(self, event):
+        """
+        Goes back to fitting the image.
+        """
+        self.fit = True
+        self.update()
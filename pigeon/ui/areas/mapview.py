@@ -0,0 +1,457 @@
+from PyQt6 import QtCore, QtGui, QtWidgets
+
+translate = QtCore.QCoreApplication.translate
+
+import collections
+from math import ceil, floor, log2
+
+import numpy as np
+from shapely.geometry import Polygon
+
+from pigeon import geo, mosaic
+from pigeon.coverage import coverage_map
+
+
+def _polygon_path(polygon):
+    """
+    Returns a QPainterPath of a shapely Polygon (including its holes).
+    """
+    path = QtGui.QPainterPath()
+    path.setFillRule(QtCore.Qt.FillRule.OddEvenFill)
+    for ring in [polygon.exterior, *polygon.interiors]:
+        path.addPolygon(
+            QtGui.QPolygonF(
+                [QtCore.QPointF(east, north) for east, north in ring.coords]))
+    return path
+
+
+def _geometry_path(geometry):
+    """
+    Returns a QPainterPath of a shapely Polygon or MultiPolygon (other
+    types of geometry are skipped).
+    """
+    path = QtGui.QPainterPath()
+    path.setFillRule(QtCore.Qt.FillRule.OddEvenFill)
+    for polygon in getattr(geometry, "geoms", [geometry]):
+        if polygon.geom_type == "Polygon":
+            path.addPath(_polygon_path(polygon))
+    return path
+
+
+class MapView(QtWidgets.QWidget):
+    """
+    Top down map of the ground covered by the images, drawn in the
+    coverage map's local frame (metres east and north). Zoom with the
+    scroll wheel and pan by dragging. Until the user does either, the
+    view keeps everything covered in sight.
+
+    If a MosaicEngine is provided, the mosaic's tiles are drawn over
+    the covered area as they become available: connect the engine's
+    updates queue to mosaicUpdate().
+
+    If a SearchArea is set, its outline is drawn with the parts that
+    haven't been photographed yet highlighted.
+
+    If a FlightTrack is provided, the plane's path is drawn on top,
+    simplified to what's visible at the current zoom.
+    """
+
+    covered_brush = QtGui.QColor(40, 120, 220, 110)
+    search_area_pen = QtGui.QColor(255, 165, 0)
+    gap_brush = QtGui.QColor(220, 40, 40, 90)
+    track_pen = QtGui.QColor(40, 200, 80)
+
+    track_tolerance = 0.5  # Pixels the simplified track may be off by
+    track_check_interval = 1000  # ms between checks for new positions
+
+    max_visible_tiles = 64  # Not drawing the mosaic when zoomed out further than this
+    max_cached_tiles = 256
+
+    def __init__(self,
+                 *args,
+                 coverage=coverage_map,
+                 mosaic=None,
+                 track=None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.coverage = coverage
+        self.mosaic = mosaic
+        self.track = track
+        # Tile key -> QImage, least recently used first
+        self._tiles = collections.OrderedDict()
+        self._requested = set()  # Keys of tiles requested but not received yet
+
+        self.center = QtCore.QPointF(0, 0)  # In metres, in the local frame
+        self.scale = 1  # Pixels per metre
+        self.follow = True  # Whether to keep fitting the view to the coverage
+        self._drag_start = None
+
+        self.search_area = None  # SearchArea, if any
+        self._coverage_version = None
+        self._covered_path = QtGui.QPainterPath()
+        self._search_area_version = None
+        self._search_area_path = QtGui.QPainterPath()
+        self._uncovered_image = None  # QImage of the uncovered cells
+        self._uncovered_corners = None  # QPolygonF the image is drawn into
+        self._track_key = None  # (Version, tolerance) the polygon was built for
+        self._track_polygon = QtGui.QPolygonF()
+
+        if self.track is not None:
+            self._track_version = self.track.version
+            self._track_timer = QtCore.QTimer(self)
+            self._track_timer.timeout.connect(self._checkTrack)
+            self._track_timer.start(self.track_check_interval)
+
+        self.setMinimumSize(QtCore.QSize(50, 50))
+        self.setAutoFillBackground(True)
+
+    def setSearchArea(self, search_area):
+        """
+        Sets the SearchArea to show, or None to clear it.
+        """
+        self.search_area = search_area
+        self._search_area_version = None
+        self.update()
+
+    def coverageChanged(self):
+        """
+        Call after adding footprints to the coverage map (or search
+        area) to redraw.
+        """
+        self.update()
+
+    def mosaicUpdate(self, update):
+        """
+        Handles an update from the mosaic engine's updates queue.
+        """
+        kind, data = update
+        if kind == "changed":
+            # Dropping the old versions once they're not visible, re-requesting the visible ones
+            stale = data & (set(self._tiles) | self._requested)
+            visible = set(self._visibleTiles())
+            for key in stale - visible:
+                self._tiles.pop(key, None)
+            self._requested -= stale
+            self._requestTiles(sorted(stale & visible))
+        elif kind == "tiles":
+            for key, rgba in data:
+                self._requested.discard(key)
+                image = QtGui.QImage(rgba.data, mosaic.tile_size,
+                                     mosaic.tile_size, mosaic.tile_size * 4,
+                                     QtGui.QImage.Format.Format_RGBA8888)
+                # Copying so as not to keep a reference to the array
+                self._tiles[key] = image.copy()
+                self._tiles.move_to_end(key)
+            while len(self._tiles) > self.max_cached_tiles:
+                self._tiles.popitem(last=False)
+            self.update()
+
+    def _checkTrack(self):
+        """
+        Redraws if positions were added to the track.
+        """
+        if self._track_version != self.track.version:
+            self._track_version = self.track.version
+            self.update()
+
+    def _updateTrack(self):
+        """
+        Rebuilds the polygon of the track if positions were added or
+        the zoom changed enough to need another level of detail.
+        """
+        if self.track is None or not len(self.track):
+            self._track_polygon = QtGui.QPolygonF()
+            return
+        tolerance = 2.0**floor(log2(self.track_tolerance / self.scale))
+        key = (self.track.version, tolerance)
+        if key == self._track_key:
+            return
+        self._track_key = key
+        lats, lons = self.track.simplified(tolerance)
+        if not lats.size:
+            return
+        if not self.coverage.frame:
+            # Sharing the frame so the track lines up with later footprints
+            self.coverage.frame = geo.LocalFrame(float(lats[0]),
+                                                 float(lons[0]))
+        east, north = self.coverage.frame.fromLatLon(lats, lons)
+        self._track_polygon = QtGui.QPolygonF([
+            QtCore.QPointF(e, n) for e, n in zip(east.tolist(), north.tolist())
+        ])
+
+    def _requestTiles(self, keys):
+        keys = [key for key in keys if key not in self._requested]
+        if keys and self.mosaic:
+            self._requested.update(keys)
+            self.mosaic.requestTiles(keys)
+
+    def _visibleTiles(self):
+        """
+        Returns a list of the keys of the mosaic tiles in view, at the
+        zoom level closest to the view's scale.
+        """
+        frame = self.coverage.frame
+        if not self.mosaic or not frame or self.width() <= 0:
+            return []
+        metres_per_tile_pixel = mosaic.ground_resolution(frame.anchor_lat, 0)
+        zoom = ceil(log2(max(metres_per_tile_pixel * self.scale, 1)))
+        zoom = min(max(zoom, self.mosaic.min_zoom), self.mosaic.zoom)
+
+        inverse, _ = self._transform().inverted()
+        corners = [
+            inverse.map(QtCore.QPointF(x, y)) for x in (0, self.width())
+            for y in (0, self.height())
+        ]
+        lats, lons = frame.toLatLon(
+            np.array([corner.x() for corner in corners]),
+            np.array([corner.y() for corner in corners]))
+        tile_x, tile_y = mosaic.lat_lon_to_tile(lats, lons, zoom)
+        x_range = range(int(tile_x.min()), int(tile_x.max()) + 1)
+        y_range = range(int(tile_y.min()), int(tile_y.max()) + 1)
+        if len(x_range) * len(y_range) > self.max_visible_tiles:
+            return []
+        return [(zoom, x, y) for x in x_range for y in y_range]
+
+    def _drawTiles(self, painter):
+        """
+        Draws the mosaic tiles in view, requesting the ones that are
+        missing.
+        """
+        frame = self.coverage.frame
+        view_transform = self._transform()
+        keys = self._visibleTiles()
+        self._requestTiles([key for key in keys if key not in self._tiles])
+        source = QtGui.QPolygonF([
+            QtCore.QPointF(0, 0),
+            QtCore.QPointF(mosaic.tile_size, 0),
+            QtCore.QPointF(mosaic.tile_size, mosaic.tile_size),
+            QtCore.QPointF(0, mosaic.tile_size)
+        ])
+        # Antialiasing the edges of the tiles would show the seams between them
+        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing, False)
+        painter.setRenderHint(QtGui.QPainter.RenderHint.SmoothPixmapTransform)
+        for key in keys:
+            image = self._tiles.get(key)
+            if image is None:
+                continue
+            self._tiles.move_to_end(key)
+            zoom, x, y = key
+            lats, lons = mosaic.tile_to_lat_lon(np.array([x, x + 1, x + 1, x]),
+                                                np.array([y, y, y + 1, y + 1]),
+                                                zoom)
+            east, north = frame.fromLatLon(lats, lons)
+            target = QtGui.QPolygonF([
+                QtCore.QPointF(e, n)
+                for e, n in zip(east.tolist(), north.tolist())
+            ])
+            tile_transform = QtGui.QTransform()
+            if QtGui.QTransform.quadToQuad(source, target, tile_transform):
+                painter.setTransform(tile_transform * view_transform)
+                painter.drawImage(0, 0, image)
+        painter.setTransform(view_transform)
+        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+
+    def statusText(self):
+        """
+        Returns a short summary of the coverage.
+        """
+        self._updatePaths()
+        text = translate("MapView", "Covered: %.2f ha, Overlap: %.0f%%") % (
+            self.coverage.coveredArea() / 10000,
+            self.coverage.overlapRatio() * 100)
+        if self.search_area:
+            text += translate("MapView", ", Searched: %.0f%%") % (
+                self.search_area.coveredFraction() * 100)
+            latest = self.track.latest() if self.track is not None else None
+            if latest:
+                nearest = self.search_area.nearestUncovered(
+                    geo.Position(latest[1], latest[2]))
+                if nearest:
+                    text += translate(
+                        "MapView", ", Nearest unsearched: %.0f m") % nearest[0]
+        return text
+
+    def _updatePaths(self):
+        """
+        Rebuilds the cached paths if the coverage changed since they
+        were last built.
+        """
+        if self._coverage_version == self.coverage.version:
+            return
+        self._coverage_version = self.coverage.version
+
+        self._covered_path = QtGui.QPainterPath()
+        for geometry in self.coverage.geometries():
+            self._covered_path.addPath(_geometry_path(geometry))
+
+    def _updateSearchArea(self):
+        """
+        Rebuilds the outline of the search area and the image of its
+        uncovered cells if it changed since they were last built.
+        """
+        search_area = self.search_area
+        version = search_area.version if search_area else None
+        if (search_area, version) == self._search_area_version:
+            return
+        self._search_area_version = (search_area, version)
+        self._search_area_path = QtGui.QPainterPath()
+        self._uncovered_image = None
+        if not search_area:
+            return
+        if not self.coverage.frame:
+            self.coverage.frame = search_area.frame
+
+        outline = search_area.outline
+        exterior = self.coverage.toLocal(
+            [position.latLon() for position in outline.positions])
+        holes = [
+            self.coverage.toLocal([position.latLon() for position in interior])
+            for interior in outline.interior_positions_list or []
+        ]
+        self._search_area_path = _polygon_path(
+            Polygon(exterior.exterior, [hole.exterior for hole in holes]))
+
+        # Row 0 of the mask is the southern edge but the top of an image
+        rows, columns = search_area.shape
+        pixels = np.zeros((rows, columns), dtype=np.uint32)
+        pixels[search_area.uncoveredMask()[::-1]] = self.gap_brush.rgba()
+        self._uncovered_image = QtGui.QImage(
+            pixels.data, columns, rows, columns * 4,
+            QtGui.QImage.Format.Format_ARGB32).copy()
+        east, north = self.coverage.frame.fromLatLon(*search_area.corners())
+        south_west, south_east, north_east, north_west = [
+            QtCore.QPointF(e, n) for e, n in zip(east.tolist(), north.tolist())
+        ]
+        self._uncovered_corners = QtGui.QPolygonF(
+            [north_west, north_east, south_east, south_west])
+
+    def _drawUncovered(self, painter):
+        """
+        Draws the cells of the search area that haven't been
+        photographed.
+        """
+        image = self._uncovered_image
+        if image is None:
+            return
+        source = QtGui.QPolygonF([
+            QtCore.QPointF(0, 0),
+            QtCore.QPointF(image.width(), 0),
+            QtCore.QPointF(image.width(), image.height()),
+            QtCore.QPointF(0, image.height())
+        ])
+        view_transform = painter.transform()
+        image_transform = QtGui.QTransform()
+        if QtGui.QTransform.quadToQuad(source, self._uncovered_corners,
+                                       image_transform):
+            # Keeping the cells sharp
+            painter.setRenderHint(
+                QtGui.QPainter.RenderHint.SmoothPixmapTransform, False)
+            painter.setTransform(image_transform * view_transform)
+            painter.drawImage(0, 0, image)
+            painter.setTransform(view_transform)
+
+    def _fitView(self):
+        """
+        Centres the view on everything drawn, at a scale that shows
+        all of it.
+        """
+        bounds = self._covered_path.boundingRect().united(
+            self._search_area_path.boundingRect()).united(
+                self._track_polygon.boundingRect())
+        if bounds.isEmpty():
+            return
+        self.center = bounds.center()
+        margin = 0.9
+        self.scale = margin * min(self.width() / bounds.width(),
+                                  self.height() / bounds.height())
+
+    def _transform(self):
+        """
+        Returns the QTransform from the local frame to widget pixels
+        (north is up, so y is flipped).
+        """
+        transform = QtGui.QTransform()
+        transform.translate(self.width() / 2, self.height() / 2)
+        transform.scale(self.scale, -self.scale)
+        transform.translate(-self.center.x(), -self.center.y())
+        return transform
+
+    def paintEvent(self, event):
+        self._updatePaths()
+        self._updateSearchArea()
+        self._updateTrack()
+        if self.follow:
+            self._fitView()
+            self._updateTrack()  # The scale may have changed
+
+        painter = QtGui.QPainter(self)
+        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+        painter.setTransform(self._transform())
+
+        # Not outlining the covered area, which would show the seams between cells
+        painter.setPen(QtCore.Qt.PenStyle.NoPen)
+        painter.setBrush(self.covered_brush)
+        painter.drawPath(self._covered_path)
+
+        self._drawTiles(painter)
+
+        self._drawUncovered(painter)
+        pen = QtGui.QPen(self.search_area_pen, 2)
+        pen.setCosmetic(True)  # Constant width no matter the zoom
+        painter.setPen(pen)
+        painter.setBrush(QtCore.Qt.BrushStyle.NoBrush)
+        painter.drawPath(self._search_area_path)
+
+        if not self._track_polygon.isEmpty():
+            pen = QtGui.QPen(self.track_pen, 2)
+            pen.setCosmetic(True)
+            painter.setPen(pen)
+            painter.drawPolyline(self._track_polygon)
+            # Marking the last known position of the plane
+            painter.setBrush(self.track_pen)
+            radius = 5 / self.scale
+            painter.drawEllipse(self._track_polygon.last(), radius, radius)
+
+        painter.resetTransform()
+        painter.setPen(self.palette().color(QtGui.QPalette.ColorRole.Text))
+        painter.drawText(
+            self.rect().adjusted(5, 5, -5, -5),
+            QtCore.Qt.AlignmentFlag.AlignLeft
+            | QtCore.Qt.AlignmentFlag.AlignTop, self.statusText())
+        painter.end()
+
+    def wheelEvent(self, event):
+        """
+        Zooms in or out, keeping the point under the cursor in place.
+        """
+        self.follow = False
+        point = event.position()
+        inverse, _ = self._transform().inverted()
+        before = inverse.map(point)
+        self.scale *= 1.25**(event.angleDelta().y() / 120)
+        inverse, _ = self._transform().inverted()
+        self.center += before - inverse.map(point)
+        self.update()
+
+    def mousePressEvent(self, event):
+        self._drag_start = event.position()
+
+    def mouseMoveEvent(self, event):
+        if self._drag_start is None:
+            return
+        self.follow = False
+        delta = event.position() - self._drag_start
+        self._drag_start = event.position()
+        self.center -= QtCore.QPointF(delta.x() / self.scale,
+                                      -delta.y() / self.scale)
+        self.update()
+
+    def mouseReleaseEvent(self, event):
+        self._drag_start = None
+
+    def mouseDoubleClickEvent(self, event):
+        """
+        Goes back to following the coverage.
+        """
+        self.follow = True
+        self.update()
@@ -39,6 +39,7 @@ class ThumbnailArea(QtWidgets.QWidget):
         # self.title.setText(translate("ThumbnailArea", "Thumbnail List"))
 
         self.images = []
+        self._item_to_follow = None  # Newest item, until it's selected
 
     def addImage(self, image, index=None):
         if index:
@@ -49,9 +50,18 @@ class ThumbnailArea(QtWidgets.QWidget):
         item.setToolTip(image.name)
 
         if self.settings_data.get("Follow Images", False):
-            item.setSelected(True)
-            self.contents.scrollToItem(item)
+            # Selecting once the images that came with it have been added
+            # too: selecting takes longer the more items there are
+            if self._item_to_follow is None:
+                QtCore.QTimer.singleShot(0, self._selectFollowedItem)
+            self._item_to_follow = item
 
         self.logger.debug("Setting recent image pixmap")
         self.recent_image.setPixmap(image.pixmap_loader)
         self.recent_image.image = image
+
+    def _selectFollowedItem(self):
+        item, self._item_to_follow = self._item_to_follow, None
+        if item is not None:
+            item.setSelected(True)
+            self.contents.scrollToItem(item)
@@ -1,8 +1,11 @@
 from PyQt6 import QtCore, QtWidgets, QtGui
 import queue as queue_module
 import logging
+import time
 import uuid
 
+from pigeon.catalog import image_catalog
+
 # Creating a mimetype for dragging PixmapLabelMarkers within this application:
 internal_pimap_label_marker_mimetype = "application/vnd.uaarg-%s-pixmap-label-marker" % uuid.uuid4(
 )
@@ -20,13 +23,19 @@ class BasePixmapLabel(QtWidgets.QLabel):
     * Resizing the pixmap for display (in subclasses).
     * Mapping points on the displayed pixmap to points on the
       original pixmap (and back).
+    * Decoding the pixmap in the background, showing a placeholder
+      until it's ready.
     """
     pixmap_label_marker_dropped = QtCore.pyqtSignal(str, QtCore.QPoint)
 
+    decode_priority = 1  # Relative to other images waiting to be decoded
+
     def __init__(self, *args, pixmap_loader=None, interactive=False, **kwargs):
         self.logger = logging.getLogger(__name__ + "." +
                                         self.__class__.__name__)
         self.pixmap_loader = pixmap_loader
+        self._decode_request = None
+        self._pixmap_ready = False  # Whether the pixmap shown isn't a placeholder
         if self.pixmap_loader:
             self.original_pixmap_width = pixmap_loader.width()
             self.original_pixmap_height = pixmap_loader.height()
@@ -56,10 +65,10 @@ class BasePixmapLabel(QtWidgets.QLabel):
             return None
         else:
             return QtCore.QPoint(
-                corrected_x / self.pixmap().width() *
-                self.original_pixmap_width,
-                point.y() / self.pixmap().height() *
-                self.original_pixmap_height)
+                int(corrected_x / self.pixmap().width() *
+                    self.original_pixmap_width),
+                int(point.y() / self.pixmap().height() *
+                    self.original_pixmap_height))
 
     def _mapPointToDisplay(self, point):
         """
@@ -116,6 +125,40 @@ class BasePixmapLabel(QtWidgets.QLabel):
                                  (size.width(), size.height())))
             return pixmap
 
+    def _showPixmapForSize(self, size):
+        """
+        Shows the pixmap at the provided size. If it needs decoding, a
+        placeholder is shown until it's been decoded in the background.
+        A pending decode of a pixmap that's no longer needed (ex. of
+        the previous image) is cancelled.
+        """
+        if self._decode_request:
+            self._decode_request.cancel()
+            self._decode_request = None
+        if self._pixmap_ready and self.pixmap() and (
+                size.width() <= self.pixmap().width()
+                and size.height() <= self.pixmap().height()):
+            # Just need to shrink our existing pixmap
+            self._setDisplayedPixmap(self.pixmap().scaled(
+                size, QtCore.Qt.AspectRatioMode.KeepAspectRatio))
+            return
+        self._pixmap_ready = False
+        self._decode_request = self.pixmap_loader.requestPixmapForSize(
+            size, self._pixmapDecoded, self.decode_priority)
+        if self._decode_request:
+            self._setDisplayedPixmap(
+                self.pixmap_loader.placeholderForSize(size))
+
+    def _pixmapDecoded(self, pixmap):
+        self._decode_request = None
+        if pixmap is None:
+            return  # Keeping the placeholder: it's tried again on the next resize
+        self._pixmap_ready = True
+        self._setDisplayedPixmap(pixmap)
+
+    def _setDisplayedPixmap(self, pixmap):
+        super().setPixmap(pixmap)
+
     def _processDropEvent(self, event):
         # Offset to account for cursor size:
         pos_offset_x = 20
@@ -163,10 +206,13 @@ class ImageArea(BasePixmapLabel):
     This QLabel automatically scales the inserted pixmap while maintaining its aspect ratio.
     designed to be used as the image area in pigeon
     """
+    cursor_moved = QtCore.pyqtSignal(QtCore.QPoint)
+
+    decode_priority = 2  # The main image is what the user is looking at
 
     def _resize(self):
         if self.pixmap_loader:
-            super().setPixmap(self.getPixmapForSize(self.size()))
+            self._showPixmapForSize(self.size())
         else:
             self.setText("NO IMAGE RECEIVED YET")
 
@@ -174,11 +220,23 @@ class ImageArea(BasePixmapLabel):
         self.pixmap_loader = pixmap_loader
         self.original_pixmap_width = self.pixmap_loader.width()
         self.original_pixmap_height = self.pixmap_loader.height()
+        self._pixmap_ready = False
         self._resize()
 
     def resizeEvent(self, resize_event):
         self._resize()
 
+    def mouseMoveEvent(self, event):
+        """
+        Emits cursor_moved with the point on the original pixmap under
+        the cursor. Enable mouse tracking to get this without a button
+        held down.
+        """
+        point = self._mapPointToOriginal(event.position().toPoint())
+        if point:
+            self.cursor_moved.emit(point)
+        super().mouseMoveEvent(event)
+
 
 class WidthForHeightPixmapLabel(BasePixmapLabel):
     """
@@ -194,16 +252,19 @@ class WidthForHeightPixmapLabel(BasePixmapLabel):
     def _resize(self):
         if self.pixmap_loader:
             large_width = 50000
-            pixmap = self.getPixmapForSize(
+            self._showPixmapForSize(
                 QtCore.QSize(large_width, self.height())
             )  # The large width value is a hack for infinity to get scale-to-height functionality
-            self.setMinimumWidth(pixmap.width())
-            super().setPixmap(pixmap)
+
+    def _setDisplayedPixmap(self, pixmap):
+        self.setMinimumWidth(pixmap.width())
+        super()._setDisplayedPixmap(pixmap)
 
     def setPixmap(self, pixmap_loader):
         self.pixmap_loader = pixmap_loader
         self.original_pixmap_width = self.pixmap_loader.width()
         self.original_pixmap_height = self.pixmap_loader.height()
+        self._pixmap_ready = False
         self._resize()
 
     def resizeEvent(self, resize_event):
@@ -379,20 +440,54 @@ class ScaledListWidget(BaseQListWidget):
 
 
 class ListImageItem(QtWidgets.QListWidgetItem):
+    """
+    Thumbnail of an image in a list. Shows a placeholder until the
+    thumbnail has been decoded in the background.
+
+    Only the id of the image is kept, so that the images of a long
+    mission aren't all held in memory. The Image is fetched from the
+    image_catalog when asked for, made again from the catalog if it was
+    freed (and then given this item's PixmapLoader).
+    """
+
+    decode_priority = 0
 
     def __init__(self, pixmap_loader, list_widget):
         self.pixmap_loader = pixmap_loader
-        icon = QtGui.QIcon(
-            self.pixmap_loader.getPixmapForSize(
-                list_widget.calculateIconSize()))
+        self.image_id = None
+        self._decode_request = None
         super().__init__("", list_widget)
-        self.setIcon(icon)
+        self._requestIcon(list_widget.calculateIconSize())
+
+    @property
+    def image(self):
+        if self.image_id is None:
+            return None
+        image = image_catalog.get(self.image_id)
+        if image is not None and image.pixmap_loader is None:
+            image.pixmap_loader = self.pixmap_loader
+        return image
+
+    @image.setter
+    def image(self, image):
+        self.image_id = None if image is None else image.id
 
     def updateIconSize(self):
-        icon = QtGui.QIcon(
-            self.pixmap_loader.getPixmapForSize(
-                self.listWidget().calculateIconSize()))
-        self.setIcon(icon)
+        self._requestIcon(self.listWidget().calculateIconSize())
+
+    def _requestIcon(self, size):
+        if self._decode_request:
+            self._decode_request.cancel()
+        self._decode_request = self.pixmap_loader.requestPixmapForSize(
+            size, self._iconDecoded, self.decode_priority)
+        if self._decode_request:
+            self.setIcon(
+                QtGui.QIcon(self.pixmap_loader.placeholderForSize(size)))
+
+    def _iconDecoded(self, pixmap):
+        self._decode_request = None
+        if pixmap is not None:
+            self.setIcon(QtGui.QIcon(pixmap))
 
 
 class QueueMixin:
@@ -400,6 +495,8 @@ class QueueMixin:
     This is a mixin class that allows queues to be hooked up to slots.
     """
 
+    max_check_seconds = 0.05  # Per check of the queues (every 100 ms)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.connected_queues = []
@@ -413,13 +510,21 @@ class QueueMixin:
         self.connected_queues.append((queue, slot))
 
     def _checkConnectedQueues(self):
+        """
+        Calls the slots with what's in their queues, for up to
+        max_check_seconds so that a burst (ex. a bulk import of images)
+        is handled in batches without freezing the UI.
+        """
+        deadline = time.monotonic() + self.max_check_seconds
         for queue, slot in self.connected_queues:
-            try:
-                value = queue.get(block=False)
-            except queue_module.Empty:
-                pass
-            else:
+            while True:
+                try:
+                    value = queue.get(block=False)
+                except queue_module.Empty:
+                    break
                 slot(value)
+                if time.monotonic() > deadline:
+                    break
 
     def startQueueMonitoring(self):
         self.timer = QtCore.QTimer()
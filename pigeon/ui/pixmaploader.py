@@ -1,40 +1,183 @@
+import collections
+import itertools
 import logging
+import os
+import queue
+from threading import Thread
+
 from PyQt6 import QtCore, QtGui
 
+from pigeon.ui.thumbnailcache import thumbnail_cache
+
 logger = logging.getLogger(__name__)
 
 
+def pixmap_bytes(size, depth):
+    """
+    Returns an estimate of the memory (in bytes) used by a pixmap of
+    the provided size and depth.
+    """
+    # Calculation from https://forum.qt.io/topic/4876/how-much-memory/5
+    # Measured too and seems accurate enough.
+    return size.width() * size.height() * depth // 8
+
+
+class PixmapCache:
+    """
+    Keeps the pixmaps of all the PixmapLoaders, evicting the least
+    recently used ones once their total memory goes over a budget. This
+    way memory stays flat no matter how many images a mission has, and
+    the images that were viewed recently are still in memory.
+
+    Pinned pixmaps (ex. the original of the image being shown) are
+    never evicted, but do count towards the budget.
+
+    Not thread safe: use from a single thread (the UI thread).
+    """
+
+    max_entry_fraction = 0.1  # Of the budget that one pixmap may use when it's not pinned
+
+    def __init__(self, budget=512 * 1024 * 1024):
+        self.budget = budget  # In bytes
+        # PixmapLoader -> (QPixmap, bytes), least recently used first
+        self._entries = collections.OrderedDict()
+        self._pinned = set()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, loader):
+        return loader in self._entries
+
+    def get(self, loader):
+        """
+        Returns the pixmap kept for the provided loader (marking it
+        recently used), or None.
+        """
+        entry = self._entries.get(loader)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(loader)
+        return entry[0]
+
+    def peek(self, loader):
+        """
+        Like get(), but without counting it as a use.
+        """
+        entry = self._entries.get(loader)
+        return entry[0] if entry else None
+
+    def put(self, loader, pixmap):
+        """
+        Keeps the provided pixmap for the loader, replacing what was
+        kept for it before. None removes it.
+        """
+        self.discard(loader)
+        if pixmap is None:
+            return
+        size = pixmap_bytes(pixmap.size(), pixmap.depth())
+        self._entries[loader] = (pixmap, size)
+        self.bytes += size
+        self._evict()
+
+    def discard(self, loader):
+        """
+        Removes the pixmap kept for the provided loader, if any.
+        """
+        entry = self._entries.pop(loader, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def pin(self, loader):
+        """
+        Prevents the pixmap of the provided loader from being evicted.
+        """
+        self._pinned.add(loader)
+
+    def unpin(self, loader):
+        """
+        Allows the pixmap of the provided loader to be evicted again.
+        """
+        self._pinned.discard(loader)
+        self._evict()
+
+    def fits(self, size):
+        """
+        Returns whether a pixmap of size bytes is small enough to be
+        worth keeping after it's used.
+        """
+        return size <= self.budget * self.max_entry_fraction
+
+    def setBudget(self, budget):
+        """
+        Changes the total memory (in bytes) the pixmaps may use.
+        """
+        self.budget = budget
+        self._evict()
+
+    def stats(self):
+        """
+        Returns a dictionary of the cache's counters and memory use.
+        """
+        return {
+            "Pixmaps": len(self._entries),
+            "Megabytes": self.bytes / 1024 / 1024,
+            "Budget Megabytes": self.budget / 1024 / 1024,
+            "Hits": self.hits,
+            "Misses": self.misses,
+            "Evictions": self.evictions,
+        }
+
+    def _evict(self):
+        if self.bytes <= self.budget:
+            return
+        for loader in list(self._entries):
+            if self.bytes <= self.budget:
+                break
+            if loader in self._pinned:
+                continue
+            _, size = self._entries.pop(loader)
+            self.bytes -= size
+            self.evictions += 1
+        logger.debug("Evicted pixmaps down to %.1f MB: %s" %
+                     (self.bytes / 1024 / 1024, self.stats()))
+
+
 class PixmapLoader:
     """
     Class for efficiently loading and displaying images.
     Handles loading this mage file and providing a pixmap at the
     requested size. Tries to optimize performance by balancing
     memory usage and disk access.
+
+    The pixmap is kept in the shared pixmap_cache, which decides when
+    to free it based on the memory used by all the images. Only the
+    path of the image is kept, so that a loader (ex. of a thumbnail)
+    doesn't keep its Image in memory.
     """
 
+    max_used_sizes = 4
+    placeholder_color = QtGui.QColor(128, 128, 128)
+
     def __init__(self, image):
-        self.image = image
-        self.pixmap = None  # This is where the pixmap is cached in memory
+        self.path = image.path
         self.image_width = None
         self.image_height = None
         self.image_size = None
 
         self.hold_original = False  # A hint indicating the the original image should be held.
-        self.used_sizes = []
-        # A history of sizes of the pixamp used; a hint for what sizes to potentially keep when freeing memory.
-        # Each entry is a tuple, with the second element being the requested size and the first the used size.
+        self.used_sizes = collections.OrderedDict()
+        # The most recent sizes of the pixamp used (up to max_used_sizes); a hint for what sizes to potentially keep
+        # when freeing memory. Keyed by the requested width and height, each value is a tuple with the second element
+        # being the requested size and the first the used size.
         # (they are likley different because getPixmapForSize will keep the original pixmap's aspect ratio)
 
-        self.maximum_megabytes_to_safely_keep = 1
-        # Pixmaps under this size (in MB) will be kept in memory to avoid raving to re-load from disk.
-        # Although you probably don't need to change it, if you want to tune things:
-        #   For a given number of images:
-        #     * If your computer is running out of memory, decrease this.
-        #     * If you experience lag while performing operations that result in a new image being displayed somewhere,
-        #       and your computer has enough memroy, increase this.
-        #
-        #   Typical numbers are likely: 1000 images * 1 MB/image (this number above) = 1 GB
-
         self.slightly_large_size_factor = 2
 
     def __getstate__(self):
@@ -42,11 +185,21 @@ class PixmapLoader:
         Called during pickling.
         """
         state = self.__dict__.copy()
-        state["pixmap"] = None
         state["hold_original"] = False
-        state["used_sizes"] = []
+        state["used_sizes"] = collections.OrderedDict()
         return state
 
+    @property
+    def pixmap(self):
+        """
+        The pixmap kept in memory, if any.
+        """
+        return pixmap_cache.peek(self)
+
+    @pixmap.setter
+    def pixmap(self, pixmap):
+        pixmap_cache.put(self, pixmap)
+
     def getPixmapForSize(self, size):
         """
         Returns a pixmap for the requested size. This is the most
@@ -56,24 +209,119 @@ class PixmapLoader:
         and it's behaviour.
         If the provided size is None, returns the original pixmap.
         """
-        if not size:
-            size = QtCore.QSize(self.image_width, self.image_height)
+        size = self._requestedSize(size)
+        kept = self._keptFor(size)
+        if not kept:
+            kept = self._storeImage(self.readImage(self._decodeSize(size)))
+        return self._scaledFor(kept, size)
+
+    def requestPixmapForSize(self, size, callback, priority=0):
+        """
+        Like getPixmapForSize(), but if the image has to be loaded it's
+        decoded in the background by the pixmap_decoder. The callback
+        is called with the pixmap in the UI thread: right away if
+        nothing needs decoding (returning None), otherwise once it's
+        been decoded (returning a DecodeRequest, to be cancelled if the
+        pixmap stops being needed). The callback is called with None if
+        the image couldn't be decoded. Requests with a higher priority
+        are decoded first.
+        """
+        size = self._requestedSize(size)
+        kept = self._keptFor(size)
+        if kept:
+            callback(self._scaledFor(kept, size))
+            return None
+
+        def decoded(image):
+            if image is None:
+                callback(None)
+            else:
+                callback(self._scaledFor(self._storeImage(image), size))
+
+        return pixmap_decoder.decode(self, self._decodeSize(size), decoded,
+                                     priority)
+
+    def placeholderForSize(self, size):
+        """
+        Returns a pixmap to show at the requested size while the real
+        one is decoded: the pixmap kept in memory scaled up (ex. from
+        a thumbnail), or a blank one.
+        """
+        size = self._requestedSize(size)
+        kept = pixmap_cache.peek(self)
+        if kept:
+            return kept.scaled(size, QtCore.Qt.AspectRatioMode.KeepAspectRatio)
+        placeholder = QtGui.QPixmap(
+            QtCore.QSize(self.image_width, self.image_height).scaled(
+                size, QtCore.Qt.AspectRatioMode.KeepAspectRatio))
+        placeholder.fill(self.placeholder_color)
+        return placeholder
+
+    def readImage(self, size=None):
+        """
+        Decodes the image into a QImage, at the provided (smaller) size
+        if any. Decoders that can (ex. JPEG's, by scaling the DCT) skip
+        most of the work of decoding at full resolution. Small sizes
+        are made from the thumbnail_cache when possible. Safe to call
+        from any thread: doesn't touch the kept pixmap.
+        """
+        if size and thumbnail_cache.covers(size):
+            thumbnail = thumbnail_cache.get(self.path, size)
+            if thumbnail is not None:
+                return thumbnail
+            self._requireLoad()
+            thumbnail = self._decode(
+                thumbnail_cache.thumbnailSize(self.image_width,
+                                              self.image_height))
+            thumbnail_cache.put(self.path, thumbnail)
+            return thumbnail.scaled(
+                size, QtCore.Qt.AspectRatioMode.KeepAspectRatio,
+                QtCore.Qt.TransformationMode.SmoothTransformation)
+        return self._decode(size)
+
+    def readRegion(self, level, rect):
+        """
+        Decodes the part of the image in rect (a QRect in the pixels of
+        the image scaled to levelSize(level)) into a QImage. Only the
+        region is kept in memory, though decoders may still need to
+        decode what comes before it in the file (for JPEGs, the rows
+        above it). Safe to call from any thread.
+        """
+        if not self.path:
+            raise (ValueError("Don't have a path to load image."))
         self._requireLoad()
-        if not self.pixmap or ((size.width() > self.pixmap.width()
-                                and size.height() > self.pixmap.height()) and
-                               (self.pixmap.width() < self.image_width
-                                or self.pixmap.height() < self.image_height)):
-            logger.debug(
-                "Performing load to get bigger pixmap (have: %s need: %s, %s)"
-                % ("%s, %s" % (self.pixmap.width(), self.pixmap.height())
-                   if self.pixmap else None, size.width(), size.height()))
-            self._loadOriginalPixmap()
-        pixmap = self.pixmap.scaled(size,
-                                    QtCore.Qt.AspectRatioMode.KeepAspectRatio)
-        self.used_sizes.append((pixmap.size(), size))
-        # Note that this returned pixmap is now owned by the caller: PixmapLoader isn't responsible for
-        # freeing that memory (and in fact can't)
-        return pixmap
+        reader = QtGui.QImageReader(self.path)
+        if level:
+            reader.setScaledSize(self.levelSize(level))
+            reader.setScaledClipRect(rect)
+        else:
+            reader.setClipRect(rect)
+        image = reader.read()
+        if image.isNull():
+            raise (ValueError("Failed to load region of image at %s: %s" %
+                              (self.path, reader.errorString())))
+        return image
+
+    def levelSize(self, level):
+        """
+        Returns the size of the image scaled down by 2**level (rounding
+        up).
+        """
+        self._requireLoad()
+        return QtCore.QSize(-(-self.image_width >> level),
+                            -(-self.image_height >> level))
+
+    def _decode(self, size=None):
+        if not self.path:
+            raise (ValueError("Don't have a path to load image."))
+        reader = QtGui.QImageReader(self.path)
+        if size:
+            reader.setScaledSize(size)
+        image = reader.read()
+        if image.isNull():
+            raise (ValueError("Failed to load image at %s: %s" %
+                              (self.path, reader.errorString())))
+        return image
 
     def width(self):
         """
@@ -101,6 +349,7 @@ class PixmapLoader:
         Marks that the largest sized pixmap should be kept in memory.
         """
         self.hold_original = True
+        pixmap_cache.pin(self)
 
     def freeOriginal(self):
         """
@@ -108,6 +357,7 @@ class PixmapLoader:
         (this is the default until holdOriginal() is called).
         """
         self.hold_original = False
+        pixmap_cache.unpin(self)
 
     def optimizeMemory(self, might_need_a_bit_bigger=True):
         """
@@ -118,8 +368,8 @@ class PixmapLoader:
         """
         # Actual memory freeing occurs whenever self.pixmap is set to a new value
         # in the code below: once this is done, the old object is not referenced
-        # by anything and so gets cleaned up by Python's garbage collector (in
-        # CPython, this happens immediately)
+        # by anything (the cache replaces it) and so gets cleaned up by Python's
+        # garbage collector (in CPython, this happens immediately)
 
         if self.pixmap and not self.hold_original:
             for size, requested_size in self._used_sizes_largest_to_smallest():
@@ -128,19 +378,18 @@ class PixmapLoader:
                 if might_need_a_bit_bigger:
                     slightly_large_size = size * self.slightly_large_size_factor
                     if slightly_large_size.width() <= self.pixmap.width(
-                    ) and slightly_large_size.height(
-                    ) <= self.pixmap.height() and self._estimatePixmapMemory(
-                            slightly_large_size, self.pixmap.depth()
-                    ) < self.maximum_megabytes_to_safely_keep:
+                    ) and slightly_large_size.height() <= self.pixmap.height(
+                    ) and pixmap_cache.fits(
+                            pixmap_bytes(slightly_large_size,
+                                         self.pixmap.depth())):
                         self.pixmap = self.pixmap.scaled(
                             slightly_large_size,
                             QtCore.Qt.AspectRatioMode.KeepAspectRatio)
                         break
 
                 if size.width() <= self.pixmap.width() and size.height(
-                ) <= self.pixmap.height() and self._estimatePixmapMemory(
-                        size, self.pixmap.depth()
-                ) < self.maximum_megabytes_to_safely_keep:
+                ) <= self.pixmap.height() and pixmap_cache.fits(
+                        pixmap_bytes(size, self.pixmap.depth())):
                     self.pixmap = self.pixmap.scaled(
                         requested_size,
                         QtCore.Qt.AspectRatioMode.KeepAspectRatio)
@@ -166,31 +415,193 @@ class PixmapLoader:
 
     def _requireLoad(self):
         """
-        Performs the initial read of the image, if necessary.
+        Performs the initial read of the image's size, if necessary.
         """
         if not self.image_width or not self.image_height:
-            self._loadOriginalPixmap()
+            self._readSize()
 
-    def _loadOriginalPixmap(self):
-        if not self.image.path:
+    def _readSize(self):
+        """
+        Reads the size of the image from the file's header, without
+        decoding it (unless the format doesn't allow that). Only the
+        size is kept: this can run in the decoding threads, which can't
+        make pixmaps.
+        """
+        if not self.path:
             raise (ValueError("Don't have a path to load image."))
-        self.pixmap = QtGui.QPixmap(self.image.path)
-        if self.pixmap.isNull():
-            self.pixmap = None
-            raise (ValueError("Failed to load image at %s" % self.image.path))
-        self.image_width = self.pixmap.width()
-        self.image_height = self.pixmap.height()
+        size = QtGui.QImageReader(self.path).size()
+        if not size.isValid():
+            size = self.readImage().size()
+        self.image_width = size.width()
+        self.image_height = size.height()
+        self.image_size = size
+
+    def _requestedSize(self, size):
+        self._requireLoad()
+        if not size:
+            size = QtCore.QSize(self.image_width, self.image_height)
+        return size
+
+    def _keptFor(self, size):
+        """
+        Returns the pixmap kept in memory if it's big enough for the
+        requested size, otherwise None.
+        """
+        kept = pixmap_cache.get(self)
+        if not kept or (
+            (size.width() > kept.width() and size.height() > kept.height()) and
+            (kept.width() < self.image_width
+             or kept.height() < self.image_height)):
+            logger.debug(
+                "Performing load to get bigger pixmap (have: %s need: %s, %s)"
+                % ("%s, %s" % (kept.width(), kept.height()) if kept else None,
+                   size.width(), size.height()))
+            return None
+        return kept
+
+    def _decodeSize(self, size):
+        """
+        Returns the size to decode the image at for the requested size,
+        or None for the original size.
+        """
+        fitted = QtCore.QSize(self.image_width, self.image_height).scaled(
+            size, QtCore.Qt.AspectRatioMode.KeepAspectRatio)
+        if fitted.width() < self.image_width and fitted.height(
+        ) < self.image_height:
+            return fitted
+        return None
+
+    def _storeImage(self, image):
+        """
+        Converts a decoded image into a pixmap (only possible in the UI
+        thread), keeping it unless a bigger one is already kept.
+        Returns the pixmap.
+        """
+        pixmap = QtGui.QPixmap.fromImage(image)
+        kept = pixmap_cache.peek(self)
+        if not kept or pixmap.width() > kept.width():
+            self.pixmap = pixmap
+        return pixmap
+
+    def _scaledFor(self, pixmap, size):
+        pixmap = pixmap.scaled(size, QtCore.Qt.AspectRatioMode.KeepAspectRatio)
+        key = (size.width(), size.height())
+        self.used_sizes.pop(key, None)
+        self.used_sizes[key] = (pixmap.size(), size)
+        while len(self.used_sizes) > self.max_used_sizes:
+            self.used_sizes.popitem(last=False)
+        # Note that this returned pixmap is now owned by the caller: PixmapLoader isn't responsible for
+        # freeing that memory (and in fact can't)
+        return pixmap
 
     def _estimatePixmapMemory(self, size, depth):
         """
         Returns an estimate of the memory used by a pixmap of the
         provided size and depth in MegaBytes (MB).
         """
-        # Calculation from https://forum.qt.io/topic/4876/how-much-memory/5
-        # Measured too and seems accurate enough.
-        return size.width() * size.height() * depth / 1024 / 1024 / 8
+        return pixmap_bytes(size, depth) / 1024 / 1024
 
     def _used_sizes_largest_to_smallest(self):
         # Assuming sizes all have the same aspect ratio, so it doesn't matter if we sort using width or height: so picking one:
-        self.used_sizes.sort(key=lambda item: item[0].width(), reverse=True)
-        return self.used_sizes
+        return sorted(self.used_sizes.values(),
+                      key=lambda item: item[0].width(),
+                      reverse=True)
+
+
+class DecodeRequest:
+    """
+    An image waiting to be decoded by a PixmapDecoder.
+    """
+
+    def __init__(self, loader, read, callback):
+        self.loader = loader
+        self.read = read  # Function returning the QImage
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Marks that the image isn't needed anymore: it won't be decoded
+        if it hasn't started to be, and the callback won't be called.
+        """
+        self.cancelled = True
+
+
+class PixmapDecoder(QtCore.QObject):
+    """
+    Decodes images in background threads so that the UI doesn't freeze
+    while they load. Only QImages can be made outside the UI thread, so
+    they're handed back to it (through a queued signal) to be made into
+    pixmaps.
+
+    Requests are decoded highest priority first, and newest first
+    within a priority since the newest images are the likeliest to be
+    looked at. If an image can't be decoded, the failure is logged and
+    the callback is called with None, so that callers can clean up.
+    """
+
+    # DecodeRequest, QImage (or the exception raised)
+    _decoded = QtCore.pyqtSignal(object, object)
+
+    def __init__(self, workers=None):
+        super().__init__()
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        # (-priority, -sequence number, DecodeRequest)
+        self._requests = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._threads = []
+        self._decoded.connect(self._handOff)
+
+    def decode(self, loader, size, callback, priority=0):
+        """
+        Decodes the loader's image at the provided size (None for the
+        original size) and calls callback with the QImage (or None if
+        it couldn't be decoded) in the UI thread. Returns the
+        DecodeRequest.
+        """
+        return self._submit(
+            DecodeRequest(loader, lambda: loader.readImage(size), callback),
+            priority)
+
+    def decodeRegion(self, loader, level, rect, callback, priority=0):
+        """
+        Decodes part of the loader's image (see
+        PixmapLoader.readRegion()) and calls callback with the QImage
+        (or None if it couldn't be decoded) in the UI thread. Returns
+        the DecodeRequest.
+        """
+        return self._submit(
+            DecodeRequest(loader, lambda: loader.readRegion(level, rect),
+                          callback), priority)
+
+    def _submit(self, request, priority):
+        self._requests.put((-priority, -next(self._sequence), request))
+        if len(self._threads) < self.workers:
+            thread = Thread(target=self._run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return request
+
+    def _run(self):
+        while True:
+            _, _, request = self._requests.get()
+            if request.cancelled:
+                continue
+            try:
+                image = request.read()
+            except Exception as e:
+                image = e
+            self._decoded.emit(request, image)
+
+    def _handOff(self, request, image):
+        if request.cancelled:
+            return
+        if isinstance(image, Exception):
+            logger.warning("Failed to decode %s: %s" %
+                           (request.loader.path, image))
+            image = None
+        request.callback(image)
+
+
+pixmap_cache = PixmapCache()  # Pixmaps of all the images shown in the UI
+pixmap_decoder = PixmapDecoder()  # Decodes the images shown in the UI
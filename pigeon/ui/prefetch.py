@@ -0,0 +1,121 @@
+"""
+Decodes images before they're shown, based on how the user is moving
+through them.
+"""
+
+import logging
+import time
+
+from pigeon.ui.pixmaploader import pixmap_bytes, pixmap_cache
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    Watches the current item of a list of images (items with a
+    pixmap_loader attribute) and decodes the images around it at the size they'd be
+    shown, so that they're already in the pixmap cache when the user
+    steps to them.
+
+    More images are decoded in the direction the user is moving than
+    behind, and the faster they're stepping the further ahead. The
+    prefetched pixmaps are limited to a fraction of the pixmap cache's
+    budget so that they don't push out everything else.
+    """
+
+    ahead = 3  # Images decoded ahead when stepping slowly
+    behind = 1
+    max_ahead = 12
+    lookahead_seconds = 1  # How far ahead (in time) to prefetch when stepping quickly
+    budget_fraction = 0.25
+    decode_priority = 1  # Below the image being shown, above thumbnails
+    smoothing = 0.5  # Weight of the latest step in the estimated speed
+
+    def __init__(self, list_widget, size):
+        """
+        list_widget - QListWidget of the images
+        size - function returning the size (QSize) images are shown at
+        """
+        self.list_widget = list_widget
+        self.size = size
+        self.direction = 1
+        self.speed = 0  # Steps per second
+        self._last_row = None
+        self._last_time = None
+        # PixmapLoader -> DecodeRequest, of the images being prefetched
+        self._requests = {}
+
+    def currentChanged(self, new_item, old_item=None):
+        """
+        Call when the current item changes (ex. connected to the list's
+        currentItemChanged signal).
+        """
+        if new_item is None:
+            return
+        row = self.list_widget.row(new_item)
+        now = time.monotonic()
+        if self._last_row is not None and row != self._last_row:
+            step = row - self._last_row
+            self.direction = 1 if step > 0 else -1
+            elapsed = max(now - self._last_time, 1e-3)
+            self.speed = (self.smoothing * abs(step) / elapsed +
+                          (1 - self.smoothing) * self.speed)
+        self._last_row = row
+        self._last_time = now
+        self._prefetch(row)
+
+    def _prefetch(self, row):
+        size = self.size()
+        if size.isEmpty():
+            return
+        ahead = min(self.ahead + int(self.speed * self.lookahead_seconds),
+                    self.max_ahead)
+        # Assuming 32 bit pixmaps filling the size: an overestimate
+        max_images = int(pixmap_cache.budget * self.budget_fraction //
+                         max(pixmap_bytes(size, 32), 1))
+        ahead = max(min(ahead, max_images - self.behind), 0)
+
+        rows = [
+            row + self.direction * offset for offset in range(1, ahead + 1)
+        ]
+        rows += [
+            row - self.direction * offset
+            for offset in range(1, self.behind + 1)
+        ]
+        loaders = []
+        for index in rows:
+            if not 0 <= index < self.list_widget.count():
+                continue
+            item = self.list_widget.item(index)
+            # Not item.image, which would look the image up in the catalog
+            loader = getattr(item, "pixmap_loader", None)
+            if loader is not None:
+                loaders.append(loader)
+
+        # Cancelling what's not needed anymore (ex. after a change of direction)
+        for loader in list(self._requests):
+            if loader not in loaders:
+                self._requests.pop(loader).cancel()
+
+        # Requesting the furthest first, since the newest requests are decoded first
+        for loader in reversed(loaders):
+            request = self._requests.get(loader)
+            if request is not None and not request.cancelled:
+                continue
+            request = loader.requestPixmapForSize(
+                size,
+                lambda pixmap, loader=loader: self._prefetched(loader, pixmap),
+                self.decode_priority)
+            if request is not None:
+                self._requests[loader] = request
+        logger.debug("Prefetching %s images (direction: %s, speed: %.1f/s)" %
+                     (len(self._requests), self.direction, self.speed))
+
+    def _prefetched(self, loader, pixmap):
+        """
+        Called when an image has been decoded, with None as the pixmap
+        if it couldn't be. Either way it's not in flight anymore: a
+        failed image is requested again the next time it's prefetched.
+        """
+        self._requests.pop(loader, None)
@@ -0,0 +1,202 @@
+"""
+Keeps small versions of the images on disk so that they don't have to
+be decoded from the full size files again after a restart.
+"""
+
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+from PyQt6 import QtCore, QtGui
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailCache:
+    """
+    SQLite store of thumbnails (JPEGs at most max_size pixels wide and
+    high), keyed by the path of the image along with its modification
+    time and size so that a changed file isn't matched.
+
+    Reads are done with a connection per thread (ex. the threads of
+    the PixmapDecoder) with the database memory-mapped. Writes are
+    queued and done in batches by a background thread, so storing a
+    thumbnail never waits on the disk.
+
+    Does nothing until open() is called.
+    """
+
+    max_size = 256
+    quality = 85
+    mmap_size = 256 * 1024 * 1024
+    max_batch = 64  # Thumbnails written per transaction, at most
+
+    def __init__(self):
+        self.path = None
+        self._local = threading.local()  # Reading connection of each thread
+        self._connections = []  # Every reading connection, to close them
+        self._connections_lock = threading.Lock()
+        self._writes = queue.Queue()  # (key, QImage) or None to stop
+        self._writer = None
+
+    def open(self, path):
+        """
+        Starts using the database at the provided path, creating it if
+        needed.
+        """
+        self.close()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(path)
+        try:
+            # Readers don't wait on the writer
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS thumbnails (
+                    path TEXT PRIMARY KEY,
+                    modified INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    data BLOB NOT NULL
+                )""")
+            connection.commit()
+        finally:
+            connection.close()
+        self.path = path
+        self._local = threading.local()
+        self._writer = threading.Thread(target=self._write,
+                                        args=(path, ),
+                                        daemon=True)
+        self._writer.start()
+        logger.info("Using thumbnail cache at %s" % path)
+
+    def close(self):
+        """
+        Finishes writing the queued thumbnails and stops using the
+        database.
+        """
+        if self._writer is None:
+            return
+        self._writes.put(None)
+        self._writer.join()
+        self._writer = None
+        self.path = None
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+    def covers(self, size):
+        """
+        Returns whether images requested at the provided size can be
+        made from a thumbnail.
+        """
+        return (self.path is not None and size.width() <= self.max_size
+                and size.height() <= self.max_size)
+
+    def thumbnailSize(self, width, height):
+        """
+        Returns the size of the thumbnail of an image of the provided
+        size.
+        """
+        return QtCore.QSize(width, height).scaled(
+            QtCore.QSize(self.max_size, self.max_size),
+            QtCore.Qt.AspectRatioMode.KeepAspectRatio)
+
+    def get(self, path, size=None):
+        """
+        Returns the thumbnail of the image at the provided path as a
+        QImage, or None if there isn't an up to date one. If a size is
+        provided, the thumbnail is decoded to fit in it (which is
+        faster than decoding it whole and scaling it). Safe to call
+        from any thread.
+        """
+        key = self._key(path)
+        connection = self._connection()
+        if key is None or connection is None:
+            return None
+        try:
+            row = connection.execute(
+                "SELECT data FROM thumbnails WHERE path = ? AND modified = ? AND size = ?",
+                key).fetchone()
+        except sqlite3.Error as e:
+            # Ex. the cache was closed by another thread meanwhile
+            logger.debug("Failed to read thumbnail of %s: %s" % (path, e))
+            return None
+        if row is None:
+            return None
+        buffer = QtCore.QBuffer()
+        buffer.setData(row[0])
+        reader = QtGui.QImageReader(buffer, b"JPG")
+        if size:
+            reader.setScaledSize(reader.size().scaled(
+                size, QtCore.Qt.AspectRatioMode.KeepAspectRatio))
+        image = reader.read()
+        return None if image.isNull() else image
+
+    def put(self, path, image):
+        """
+        Queues the thumbnail (a QImage) of the image at the provided
+        path to be stored. Safe to call from any thread.
+        """
+        key = self._key(path)
+        if key is not None and self._writer is not None:
+            self._writes.put((key, image))
+
+    def _key(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def _connection(self):
+        """
+        Returns the reading connection of the current thread.
+        """
+        if self.path is None:
+            return None
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Not checking the thread since close() closes it from another one
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA mmap_size=%d" % self.mmap_size)
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def _write(self, path):
+        connection = sqlite3.connect(path)
+        stopping = False
+        while not stopping:
+            batch = [self._writes.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._writes.get(block=False))
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = batch[:batch.index(None)]
+
+            rows = []
+            for key, image in batch:
+                data = QtCore.QByteArray()
+                buffer = QtCore.QBuffer(data)
+                buffer.open(QtCore.QIODevice.OpenModeFlag.WriteOnly)
+                if image.save(buffer, "JPG", self.quality):
+                    rows.append((*key, bytes(data)))
+            try:
+                with connection:
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?)",
+                        rows)
+            except sqlite3.Error as e:
+                logger.warning("Failed to store thumbnails: %s" % e)
+        connection.close()
+
+
+thumbnail_cache = ThumbnailCache()  # Thumbnails of the images shown in the UI
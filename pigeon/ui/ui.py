@@ -1,5 +1,6 @@
 import sys
 import logging
+import sqlite3
 import signal as signal_  # For exiting pigeon from terminal
 from queue import Queue
 
@@ -9,10 +10,18 @@ translate = QtCore.QCoreApplication.translate  # Potential aliasing
 
 from pigeon.ui.areas import InfoArea, ThumbnailArea, MessageLogArea, ImageMapArea, SettingsArea
 from pigeon.ui.common import QueueMixin
-from pigeon.ui.pixmaploader import PixmapLoader
+from pigeon.ui.pixmaploader import PixmapLoader, pixmap_cache
+from pigeon.ui.prefetch import Prefetcher
 from pigeon.ui.style import stylesheet
+from pigeon.ui.thumbnailcache import thumbnail_cache
 
 from pigeon.image import Image
+from pigeon.catalog import image_catalog
+from pigeon.footprints import footprint_index
+from pigeon.coverage import coverage_map
+from pigeon.landmarks import landmarks
+from pigeon.mosaic import mosaic_engine
+from pigeon.searcharea import SearchArea
 from pigeon.comms.services.messageservice import MavlinkMessage
 
 THUMBNAIL_AREA_START_HEIGHT = 100
@@ -87,7 +96,11 @@ class UI(QtCore.QObject, QueueMixin):
         """
         self.main_window.show()
         self.startQueueMonitoring()
-        return self.app.exec()
+        try:
+            return self.app.exec()
+        finally:
+            mosaic_engine.stop()
+            thumbnail_cache.close()
 
     def addImage(self, image):
         """
@@ -140,6 +153,11 @@ class UI(QtCore.QObject, QueueMixin):
         self.connectQueue(statustext_in_queue,
                           self.main_window.message_log_area.queueMessage)
 
+        # Mosaic tiles rendered in the background
+        self.connectQueue(
+            mosaic_engine.updates,
+            self.main_window.main_image_area.map_view.mosaicUpdate)
+
         # Kill signal
         signal_.signal(signal_.SIGINT, lambda signum, fram: self.app.exit())
 
@@ -240,6 +258,8 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def __init__(self, uav, settings_data={}, about_text="", exit_cb=noop):
         super().__init__()
+        self.logger = logging.getLogger(__name__ + "." +
+                                        self.__class__.__name__)
         self.uav = uav
         self.settings_data = settings_data
         self.about_text = about_text
@@ -251,6 +271,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         # State
         self.current_image = None
+        self._image_to_follow = None  # Newest image, until it's shown
 
         # Defining window properties
         self.setObjectName("main_window")
@@ -312,9 +333,48 @@ class MainWindow(QtWidgets.QMainWindow):
             lambda new_item, old_item: self.showImage(new_item.image)
         )  # Show the image that's selected
 
+        # Decoding the images the user is likely to step to next
+        self.prefetcher = Prefetcher(
+            self.thumbnail_area.contents,
+            lambda: self.main_image_area.image_area.size())
+        self.thumbnail_area.contents.currentItemChanged.connect(
+            self.prefetcher.currentChanged)
+
         self.info_area.settings_area.settings_save_requested.connect(
             self.settings_save_requested.emit)
 
+        try:
+            pixmap_cache.setBudget(
+                float(settings_data.get("Pixmap Cache Megabytes")) * 1024 *
+                1024)
+        except (TypeError, ValueError) as e:
+            self.logger.warning("Invalid pixmap cache size: %s" % e)
+
+        thumbnail_cache_path = settings_data.get("Thumbnail Cache")
+        if thumbnail_cache_path:
+            try:
+                thumbnail_cache.open(thumbnail_cache_path)
+            except (OSError, sqlite3.Error) as e:
+                self.logger.warning("Couldn't open thumbnail cache: %s" % e)
+
+        gcp_path = settings_data.get("Ground Control Points")
+        if gcp_path:
+            try:
+                landmarks.loadGroundControlPoints(gcp_path)
+            except (OSError, ValueError) as e:
+                self.logger.warning("Couldn't load ground control points: %s" %
+                                    e)
+
+        self.search_area = None
+        search_area_path = settings_data.get("Search Area")
+        if search_area_path:
+            try:
+                self.search_area = SearchArea.load(search_area_path)
+            except (OSError, ValueError) as e:
+                self.logger.warning("Couldn't load search area: %s" % e)
+            else:
+                self.main_image_area.map_view.setSearchArea(self.search_area)
+
         self.initMenuBar()
         QtCore.QMetaObject.connectSlotsByName(self)
 
@@ -387,15 +447,50 @@ class MainWindow(QtWidgets.QMainWindow):
             image.width = image.pixmap_loader.width()
             image.height = image.pixmap_loader.height()
 
+            # Working out the footprint once for all of the indexes (it can
+            # take a while over terrain)
+            try:
+                outline = image.getImageOutline()
+            except Exception as e:
+                self.logger.debug("Can't find footprint of %s: %s" %
+                                  (image, e))
+                outline = None
+            image_catalog.add(image, outline)
+            if outline is not None:
+                footprint_index.insert(image, outline)
+                if coverage_map.insert(image, outline):
+                    self.main_image_area.map_view.coverageChanged()
+                if self.search_area and self.search_area.insert(
+                        image, outline):
+                    self.main_image_area.map_view.coverageChanged()
+            if self.settings_data.get("Build Mosaic", False):
+                mosaic_engine.addImage(image)
+
             if self.settings_data.get("Follow Images",
-                                      False) or not self.current_image:
-                self.showImage(image)
+                                      False) or not (self.current_image
+                                                     or self._image_to_follow):
+                self._followImage(image)
             self.thumbnail_area.addImage(image)
             self.info_area.addImage(image)
             image.pixmap_loader.optimizeMemory()
         except Exception as err:
             print(f"WARN: Error parsing image\n{err}")
 
+    def _followImage(self, image):
+        """
+        Shows the provided image once the images that came with it have
+        been added, so that only the newest of a batch (ex. from a bulk
+        import) is shown.
+        """
+        if self._image_to_follow is None:
+            QtCore.QTimer.singleShot(0, self._showFollowedImage)
+        self._image_to_follow = image
+
+    def _showFollowedImage(self):
+        image, self._image_to_follow = self._image_to_follow, None
+        if image is not None:
+            self.showImage(image)
+
     def setSettings(self, settings_data):
         return self.info_area.setSettings(settings_data)
 
@@ -0,0 +1,112 @@
+"""
+Conversion of UTM coordinates (as sent by the GPS) to WGS84 Decimal
+Degree coordinates (lat/lon).
+
+Building a pyproj projection is much more expensive than using it, so
+one Transformer is created per UTM zone and hemisphere and then reused
+for every conversion. All functions accept scalars or arrays so that
+bulk telemetry and imports can be converted in a single call.
+"""
+
+import functools
+
+import numpy as np
+import pyproj
+
+# Easting and Northing ranges from http://geokov.com/education/utm.aspx (used to be:
+# https://www.e-education.psu.edu/natureofgeoinfo/c2_p23.html)
+MIN_EASTING, MAX_EASTING = 166000, 834000
+MIN_NORTHING, MAX_NORTHING = -9900000, 9400000
+# Standard southern northings (with the false northing), for "southern"
+MIN_SOUTHERN_NORTHING, MAX_SOUTHERN_NORTHING = 0, 10000000
+MIN_ZONE, MAX_ZONE = 1, 60
+
+HEMISPHERES = ("northern", "southern")
+
+
+@functools.lru_cache(maxsize=None)
+def get_transformer(zone, hemisphere="northern"):
+    """
+    Returns the (cached) Transformer from the provided UTM zone to
+    WGS84 longitude/latitude.
+    """
+    if hemisphere not in HEMISPHERES:
+        raise ValueError("Hemisphere must be one of %s, not %r" %
+                         (", ".join(HEMISPHERES), hemisphere))
+    utm = pyproj.CRS.from_dict({
+        "proj": "utm",
+        "zone": zone,
+        "ellps": "WGS84",
+        "south": hemisphere == "southern"
+    })
+    lat_lon = pyproj.CRS.from_dict({"proj": "longlat", "ellps": "WGS84"})
+    return pyproj.Transformer.from_crs(utm, lat_lon, always_xy=True)
+
+
+def validate(easting, northing, zone, hemisphere="northern"):
+    """
+    Checks that all of the provided values are within the valid UTM
+    ranges for the provided hemisphere (as with to_lat_lon()), raising
+    a ValueError describing the first bad value otherwise. Arguments
+    may be scalars or arrays.
+
+    Returns the arguments as broadcast numpy arrays (float, float, int).
+    """
+    easting, northing, zone = np.broadcast_arrays(
+        np.asarray(easting, dtype=np.float64),
+        np.asarray(northing, dtype=np.float64),
+        np.asarray(zone, dtype=np.float64))
+
+    if hemisphere == "southern":
+        min_northing, max_northing = MIN_SOUTHERN_NORTHING, MAX_SOUTHERN_NORTHING
+    else:
+        min_northing, max_northing = MIN_NORTHING, MAX_NORTHING
+    checks = [
+        ("Easting", easting, MIN_EASTING, MAX_EASTING),
+        ("Northing", northing, min_northing, max_northing),
+    ]
+    for name, values, minimum, maximum in checks:
+        # Written so that NaN's fail the check too:
+        bad = ~((minimum < values) & (values < maximum))
+        if bad.any():
+            raise ValueError("%s value of %s is out of bounds (%s to %s)." %
+                             (name, values[bad].flat[0], minimum, maximum))
+
+    bad = ~((MIN_ZONE <= zone) & (zone <= MAX_ZONE))
+    if bad.any():
+        raise ValueError("Zone value of %s is out of bounds" %
+                         zone[bad].flat[0])
+
+    return easting, northing, zone.astype(int)
+
+
+def to_lat_lon(easting, northing, zone, hemisphere="northern"):
+    """
+    Converts UTM coordinates to WGS84 decimal degrees. Arguments may be
+    scalars or arrays (zones can differ between entries).
+
+    easting - UTM easting in metres
+    northing - UTM northing in metres
+    zone - UTM zone
+
+    When hemisphere is "northern" (the default), southern hemisphere
+    positions are expected to have the false northing (10 000 000m)
+    subtracted. With "southern", standard southern northings are
+    expected.
+
+    Returns a tuple of (latitude, longitude) numpy arrays with the
+    broadcast shape of the inputs. A ValueError is raised if any of the
+    values are invalid.
+    """
+    easting, northing, zone = validate(easting, northing, zone, hemisphere)
+
+    lat = np.empty(easting.shape)
+    lon = np.empty(easting.shape)
+    # Almost always a single zone, so this is normally just one transform:
+    for zone_value in np.unique(zone):
+        in_zone = zone == zone_value
+        transformer = get_transformer(int(zone_value), hemisphere)
+        lon[in_zone], lat[in_zone] = transformer.transform(easting[in_zone],
+                                                           northing[in_zone],
+                                                           errcheck=True)
+    return lat, lon
@@ -5,6 +5,7 @@ sys.path.append("..")  # Allow importing pigeon from tools/ modules
 
 from tools.mock_uav import main as mock_uav_main
 from tools.mock_ground_station import main as mock_ground_station_main
+from tools.georeference_benchmark import main as georeference_benchmark_main
 
 root = argparse.ArgumentParser()
 tools = root.add_subparsers(help="Tools")
@@ -20,6 +21,34 @@ mock_gcs.add_argument("--device", type=str, default="tcp:127.0.0.1:14550")
 mock_gcs.add_argument("-timeout", "--timeout_value", type=int, default=-1)
 mock_gcs.set_defaults(_command="mock-gcs")
 
+georeference_benchmark = tools.add_parser(
+    "georeference-benchmark",
+    help="Benchmark geo-referencing against the ground control points")
+georeference_benchmark.add_argument("--gcps",
+                                    type=str,
+                                    default="data/ground_control_points.json")
+georeference_benchmark.add_argument("--images", type=int, default=200)
+georeference_benchmark.add_argument("--seed", type=int, default=0)
+georeference_benchmark.add_argument("--max-error",
+                                    type=float,
+                                    default=0.05,
+                                    help="Allowed error in metres")
+georeference_benchmark.add_argument("--max-pixel-error",
+                                    type=float,
+                                    default=0.5,
+                                    help="Allowed error in pixels")
+georeference_benchmark.add_argument(
+    "--max-approx-error",
+    type=float,
+    default=0.05,
+    help="Allowed error in metres for the approximate paths")
+georeference_benchmark.add_argument(
+    "--max-approx-pixel-error",
+    type=float,
+    default=1,
+    help="Allowed error in pixels for the approximate paths")
+georeference_benchmark.set_defaults(_command="georeference-benchmark")
+
 args = root.parse_args()
 
 if '_command' not in args:
@@ -32,5 +61,11 @@ match args._command:
         mock_uav_main(args.device, args.timeout_value)
     case "mock-gcs":
         mock_ground_station_main(args.device, args.timeout_value)
+    case "georeference-benchmark":
+        if not georeference_benchmark_main(
+                args.gcps, args.images, args.seed, args.max_error,
+                args.max_pixel_error, args.max_approx_error,
+                args.max_approx_pixel_error):
+            sys.exit(1)
     case _:  # Unknown _command
         raise NotImplementedError("Unknown command: %r" % args._command)
@@ -0,0 +1,315 @@
+"""
+Benchmarks the accuracy and speed of the different ways of
+geo-referencing against the surveyed ground control points (GCPs).
+
+Synthetic images are made by placing the plane at random poses above
+the GCPs and finding where each GCP appears with the original (scalar,
+geodesic) algorithm. Every path then has to take those pixels back to
+the surveyed positions (forward) and the surveyed positions back to
+those pixels (inverse). The errors show what, if anything, a faster
+path costs in accuracy.
+"""
+
+import json
+import random
+import time
+
+import numpy as np
+
+from pigeon import geo
+
+# Same as pigeon.image.Image._prepareGeo()
+image_width = 4000
+image_height = 3000
+field_of_view_horiz = 58.38
+field_of_view_vert = 48.25
+
+
+def load_gcps(path):
+    """
+    Returns a list of (name, Position) tuples of the GCPs in the
+    provided file.
+    """
+    with open(path) as gcp_file:
+        data = json.load(gcp_file)
+    return [(name, geo.Position(float(lat), float(lon)))
+            for name, (lat, lon) in data.items()]
+
+
+def make_poses(gcps, count, rng):
+    """
+    Returns a list of (location, orientation) tuples randomly placed
+    above the GCPs.
+    """
+    poses = []
+    for _ in range(count):
+        _, target = rng.choice(gcps)
+        location = geo.position_at_offset(target, rng.uniform(0, 40),
+                                          rng.uniform(0, 360))
+        location.height = rng.uniform(50, 150)
+        orientation = geo.Orientation(rng.uniform(-15, 15),
+                                      rng.uniform(-15, 15),
+                                      rng.uniform(-180, 180))
+        poses.append((location, orientation))
+    return poses
+
+
+def make_observations(georeference, poses, gcps):
+    """
+    Returns a list with one entry per pose of (indices of the GCPs in
+    the image, their pixel_x, their pixel_y).
+    """
+    observations = []
+    for location, orientation in poses:
+        indices, xs, ys = [], [], []
+        for index, (_, position) in enumerate(gcps):
+            pixel_x, pixel_y = georeference.pointOnImage(
+                location, orientation, position)
+            if pixel_x is not None:
+                indices.append(index)
+                xs.append(pixel_x)
+                ys.append(pixel_y)
+        observations.append((np.array(indices,
+                                      dtype=int), np.array(xs), np.array(ys)))
+    return observations
+
+
+class Result:
+    """
+    Errors and timing of one path.
+    """
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.approximate = "approx" in name  # Allowed more error and to have no answer
+        self.errors = []
+        self.failures = 0  # Points the path had no answer for
+        self.seconds = 0
+        self.points = 0
+
+    def add(self, errors, seconds, points=None):
+        """
+        Records the errors of a run that took seconds to process points
+        (by default, one per error).
+        """
+        errors = np.asarray(errors, dtype=np.float64)
+        self.failures += int(np.count_nonzero(np.isnan(errors)))
+        self.errors.extend(errors[~np.isnan(errors)].tolist())
+        self.seconds += seconds
+        self.points += errors.size if points is None else points
+
+    def maxError(self):
+        return max(self.errors, default=0)
+
+    def row(self):
+        errors = np.array(self.errors or [np.nan])
+        return ("%-28s %10.0f %10.2e %10.2e %10.2e %10.2e %6d %s" %
+                (self.name, self.points / self.seconds if self.seconds else 0,
+                 np.mean(errors), np.median(errors), np.percentile(
+                     errors, 95), np.max(errors), self.failures, self.unit))
+
+
+def _ground_errors(lats, lons, truth_lats, truth_lons):
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    _, _, errors = geo.geod.inv(np.nan_to_num(lons), np.nan_to_num(lats),
+                                truth_lons, truth_lats)
+    errors = np.asarray(errors)
+    errors[np.isnan(lats) | np.isnan(lons)] = np.nan
+    return errors
+
+
+def _pixel_errors(xs, ys, truth_xs, truth_ys):
+    return np.hypot(
+        np.asarray(xs, dtype=np.float64) - truth_xs,
+        np.asarray(ys, dtype=np.float64) - truth_ys)
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run(gcps, poses, observations, camera):
+    """
+    Runs every path over the observations. Returns a list of Results.
+    """
+    exact = geo.GeoReference(camera)
+    local = geo.GeoReference(camera, max_local_error=0.05)
+    gcp_lats = np.array([position.lat for _, position in gcps])
+    gcp_lons = np.array([position.lon for _, position in gcps])
+
+    forward = {
+        name: Result(name, "m")
+        for name in ("forward scalar", "forward scalar (local frame)",
+                     "forward batch", "forward approx (grid)",
+                     "forward approx batch (grid)")
+    }
+    inverse = {
+        name: Result(name, "px")
+        for name in ("inverse scalar", "inverse scalar (local frame)",
+                     "inverse batch", "inverse approx (grid)",
+                     "inverse approx batch (grid)")
+    }
+    grid_build = Result("grid build (per image)", "m")
+
+    for (location, orientation), (indices, xs, ys) in zip(poses, observations):
+        if not indices.size:
+            continue
+        lats = gcp_lats[indices]
+        lons = gcp_lons[indices]
+        positions = [gcps[index][1] for index in indices]
+
+        # Forward: pixel -> ground
+        for name, georeference in (("forward scalar", exact),
+                                   ("forward scalar (local frame)", local)):
+
+            def scalar():
+                results = [
+                    georeference.pointInImage(location, orientation, x, y)
+                    for x, y in zip(xs.tolist(), ys.tolist())
+                ]
+                return ([
+                    result.lat if result else np.nan for result in results
+                ], [result.lon if result else np.nan for result in results])
+
+            (result_lats, result_lons), seconds = _timed(scalar)
+            forward[name].add(
+                _ground_errors(result_lats, result_lons, lats, lons), seconds)
+
+        (result_lats, result_lons,
+         _), seconds = _timed(local.pointsInImage, location, orientation, xs,
+                              ys)
+        forward["forward batch"].add(
+            _ground_errors(result_lats, result_lons, lats, lons), seconds)
+
+        grid, seconds = _timed(geo.GeoReferenceGrid, local, location,
+                               orientation)
+        grid_build.add([grid.max_error], seconds)
+
+        def approx():
+            results = [
+                grid.pointInImage(x, y)
+                for x, y in zip(xs.tolist(), ys.tolist())
+            ]
+            return ([result[0] if result else np.nan for result in results],
+                    [result[1] if result else np.nan for result in results])
+
+        (result_lats, result_lons), seconds = _timed(approx)
+        forward["forward approx (grid)"].add(
+            _ground_errors(result_lats, result_lons, lats, lons), seconds)
+
+        (result_lats, result_lons,
+         _), seconds = _timed(grid.pointsInImage, xs, ys)
+        forward["forward approx batch (grid)"].add(
+            _ground_errors(result_lats, result_lons, lats, lons), seconds)
+
+        # Inverse: ground -> pixel
+        for name, georeference in (("inverse scalar", exact),
+                                   ("inverse scalar (local frame)", local)):
+
+            def scalar():
+                results = [
+                    georeference.pointOnImage(location, orientation, position)
+                    for position in positions
+                ]
+                return ([np.nan if x is None else x for x, _ in results],
+                        [np.nan if y is None else y for _, y in results])
+
+            (result_xs, result_ys), seconds = _timed(scalar)
+            inverse[name].add(_pixel_errors(result_xs, result_ys, xs, ys),
+                              seconds)
+
+        (result_xs, result_ys, _), seconds = _timed(local.pointsOnImage,
+                                                    location, orientation,
+                                                    lats, lons)
+        inverse["inverse batch"].add(
+            _pixel_errors(result_xs, result_ys, xs, ys), seconds)
+
+        def approx():
+            results = [
+                grid.pointOnImage(lat, lon)
+                for lat, lon in zip(lats.tolist(), lons.tolist())
+            ]
+            return ([result[0] if result else np.nan for result in results],
+                    [result[1] if result else np.nan for result in results])
+
+        (result_xs, result_ys), seconds = _timed(approx)
+        inverse["inverse approx (grid)"].add(
+            _pixel_errors(result_xs, result_ys, xs, ys), seconds)
+
+        (result_xs, result_ys, _), seconds = _timed(grid.pointsOnImage, lats,
+                                                    lons)
+        inverse["inverse approx batch (grid)"].add(
+            _pixel_errors(result_xs, result_ys, xs, ys), seconds)
+
+    # One GCP into every image at once
+    multi = Result("inverse multi-image batch", "px")
+    for index, (_, position) in enumerate(gcps):
+        (result_xs, result_ys,
+         _), seconds = _timed(geo.point_on_images, [local] * len(poses),
+                              [location for location, _ in poses],
+                              [orientation
+                               for _, orientation in poses], position)
+        truth_xs = np.full(len(poses), np.nan)
+        truth_ys = np.full(len(poses), np.nan)
+        for pose_index, (indices, xs, ys) in enumerate(observations):
+            found = np.flatnonzero(indices == index)
+            if found.size:
+                truth_xs[pose_index] = xs[found[0]]
+                truth_ys[pose_index] = ys[found[0]]
+        seen = ~np.isnan(truth_xs)
+        multi.add(
+            _pixel_errors(result_xs[seen], result_ys[seen], truth_xs[seen],
+                          truth_ys[seen]), seconds, len(poses))
+
+    return list(forward.values()) + list(
+        inverse.values()) + [multi, grid_build]
+
+
+def main(gcp_path,
+         pose_count,
+         seed,
+         max_error,
+         max_pixel_error,
+         max_approx_error=0.05,
+         max_approx_pixel_error=1):
+    """
+    Runs the benchmark and prints a report. Returns False if any path
+    was less accurate than allowed (ex. for failing a CI job). The
+    approximate paths have their own limits, and are allowed to have no
+    answer for some points (callers fall back to the exact paths).
+    """
+    rng = random.Random(seed)
+    gcps = load_gcps(gcp_path)
+    camera = geo.CameraSpecs(image_width, image_height, field_of_view_horiz,
+                             field_of_view_vert)
+    poses = make_poses(gcps, pose_count, rng)
+    observations = make_observations(geo.GeoReference(camera), poses, gcps)
+    print("%s GCPs, %s images, %s observations" %
+          (len(gcps), len(poses),
+           sum(indices.size for indices, _, _ in observations)))
+
+    results = run(gcps, poses, observations, camera)
+    print("%-28s %10s %10s %10s %10s %10s %6s" %
+          ("path", "points/s", "mean", "median", "p95", "max", "failed"))
+    for result in results:
+        print(result.row())
+
+    ok = True
+    for result in results:
+        if result.approximate:
+            limit = max_approx_error if result.unit == "m" else max_approx_pixel_error
+        else:
+            limit = max_error if result.unit == "m" else max_pixel_error
+            if result.failures:
+                print("FAIL: %s had no answer for %s points" %
+                      (result.name, result.failures))
+                ok = False
+        if result.maxError() > limit:
+            print("FAIL: %s has errors up to %.2e %s (allowed: %.2e)" %
+                  (result.name, result.maxError(), result.unit, limit))
+            ok = False
+    return ok